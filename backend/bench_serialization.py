@@ -0,0 +1,156 @@
+"""Serialization and compression benchmark for the large HR list payloads.
+
+Compares the previous response path (FastAPI's jsonable_encoder + json.dumps, uncompressed)
+with the current one (orjson straight from the Mongo rows, gzip/brotli on the wire) for
+payloads shaped like GET /api/credits/all and GET /api/requests/all.
+
+    python bench_serialization.py [--credits 5000] [--requests 1000] [--repeat 20] [--gzip-level 6]
+"""
+import argparse
+import gzip
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+CATEGORIES = {
+    "paid_holiday": "Paid Holidays",
+    "unpaid_leave": "Unpaid Leave",
+    "sick_leave": "Sick Leave (No Justification)",
+    "parental_leave": "Parental Leave",
+    "maternity_leave": "Maternity Leave",
+    "compensatory_rest": "Compensatory Rest"
+}
+
+WORDS = "family trip medical appointment moving house wedding school holidays visit parents rest recovery".split()
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def make_credits(count: int, rng: random.Random) -> list:
+    """Rows as served by /credits/all: stored fields plus category_name and available_days"""
+    now = datetime.now(timezone.utc).isoformat()
+    rows = []
+    for i in range(count):
+        category = rng.choice(list(CATEGORIES))
+        total = rng.choice([0.0, 5.0, 10.0, 35.0, 90.0])
+        used = round(rng.uniform(0, total) * 2) / 2
+        reserved = min(total - used, rng.choice([0.0, 0.0, 1.0, 2.5]))
+        rows.append({
+            "credit_id": f"cred_{uuid.uuid4().hex[:12]}",
+            "user_id": f"user_{i // len(CATEGORIES):06d}",
+            "user_email": f"employee{i // len(CATEGORIES)}@example.com",
+            "user_name": f"Employee {i // len(CATEGORIES)}",
+            "year": 2026 - rng.randint(0, 2),
+            "category": category,
+            "total_days": total,
+            "used_days": used,
+            "remaining_days": total - used,
+            "reserved_days": reserved,
+            "expires_at": None,
+            "created_at": now,
+            "updated_at": now,
+            "category_name": CATEGORIES[category],
+            "available_days": total - used - reserved
+        })
+    return rows
+
+
+def make_requests(count: int, rng: random.Random) -> list:
+    """Rows as served by /requests/all, with full reasons and HR comments"""
+    rows = []
+    for i in range(count):
+        start = datetime(2026, 1, 1) + timedelta(days=rng.randint(0, 360))
+        processed = rng.random() < 0.7
+        rows.append({
+            "request_id": f"req_{uuid.uuid4().hex[:12]}",
+            "user_id": f"user_{i % 800:06d}",
+            "user_name": f"Employee {i % 800}",
+            "user_email": f"employee{i % 800}@example.com",
+            "category": rng.choice(list(CATEGORIES)),
+            "start_date": start.date().isoformat(),
+            "end_date": (start + timedelta(days=rng.randint(0, 14))).date().isoformat(),
+            "days_count": float(rng.randint(1, 10)),
+            "start_half_day": False,
+            "end_half_day": rng.random() < 0.1,
+            "reason": sentence(rng, rng.randint(8, 40)),
+            "status": rng.choice(["approved", "rejected"]) if processed else "pending",
+            "credit_year": 2026,
+            "reserved_days": 0.0,
+            "hr_comment": sentence(rng, rng.randint(4, 20)) if processed else None,
+            "processed_by": "user_hr" if processed else None,
+            "processed_at": datetime.now(timezone.utc).isoformat() if processed else None,
+            "calendar_event_id": uuid.uuid4().hex if processed else None,
+            "created_at": datetime.now(timezone.utc).isoformat()
+        })
+    return rows
+
+
+def encode_before(rows: list) -> bytes:
+    """What FastAPI's default JSONResponse did for a route returning the rows"""
+    return json.dumps(
+        jsonable_encoder(rows), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def encode_after(rows: list) -> bytes:
+    return orjson.dumps(rows)
+
+
+def timed(func, payload, repeat: int) -> tuple:
+    """Best wall time in milliseconds over repeat runs, and the encoded body"""
+    best = float("inf")
+    body = b""
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = func(payload)
+        best = min(best, time.perf_counter() - started)
+    return best * 1000, body
+
+
+def report(name: str, rows: list, repeat: int, gzip_level: int):
+    before_ms, before_body = timed(encode_before, rows, repeat)
+    after_ms, after_body = timed(encode_after, rows, repeat)
+    # Same settings as the middlewares: GZipMiddleware at COMPRESSION_GZIP_LEVEL, brotli-asgi quality 4
+    gzip_ms, gzip_body = timed(lambda body: gzip.compress(body, compresslevel=gzip_level), after_body, repeat)
+    if brotli:
+        brotli_ms, brotli_body = timed(lambda body: brotli.compress(body, quality=4), after_body, repeat)
+
+    print(f"\n{name} ({len(rows)} rows)")
+    print(f"  serialize before (jsonable_encoder + json): {before_ms:8.2f} ms  {len(before_body):>10,} bytes")
+    print(f"  serialize after  (orjson):                  {after_ms:8.2f} ms  {len(after_body):>10,} bytes")
+    print(f"  speedup:                                    {before_ms / after_ms:8.1f}x")
+    print(f"  on the wire, gzip:                          {gzip_ms:8.2f} ms  {len(gzip_body):>10,} bytes ({len(gzip_body) / len(before_body):.1%})")
+    if brotli:
+        print(f"  on the wire, brotli:                        {brotli_ms:8.2f} ms  {len(brotli_body):>10,} bytes ({len(brotli_body) / len(before_body):.1%})")
+    else:
+        print("  on the wire, brotli:                        not installed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--credits", type=int, default=5000, help="rows in the /credits/all payload")
+    parser.add_argument("--requests", type=int, default=1000, help="rows in the /requests/all payload")
+    parser.add_argument("--repeat", type=int, default=20, help="runs per measurement, the best is kept")
+    parser.add_argument("--gzip-level", type=int, default=6, help="should match COMPRESSION_GZIP_LEVEL")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    report("GET /api/credits/all", make_credits(args.credits, rng), args.repeat, args.gzip_level)
+    report("GET /api/requests/all", make_requests(args.requests, rng), args.repeat, args.gzip_level)
+
+
+if __name__ == "__main__":
+    main()
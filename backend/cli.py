@@ -0,0 +1,75 @@
+"""Command line entry points for batch work against the app's database.
+
+Reads the same backend/.env as the server (MONGO_URL, DB_NAME, ...).
+
+    python cli.py import-users users.csv [--format csv|json] [--deactivate-missing] [--dry-run]
+    python cli.py run-job provision-credits [--year 2027]
+    python cli.py run-job expire-credits [--date 2027-08-01]
+"""
+import argparse
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+import server
+
+
+async def import_users_command(args) -> int:
+    path = Path(args.file)
+    import_format = args.format or ("csv" if path.suffix.lower() == ".csv" else "json")
+    try:
+        rows = server.parse_user_import(path.read_bytes(), import_format)
+    except server.HTTPException as e:
+        print(f"error: {e.detail}", file=sys.stderr)
+        return 2
+    report = await server.import_users(rows, deactivate_missing=args.deactivate_missing, dry_run=args.dry_run)
+    print(json.dumps(report, indent=2))
+    return 1 if report["error_count"] else 0
+
+
+async def run_job_command(args) -> int:
+    if args.job == "provision-credits":
+        kwargs = {"year": args.year or server.datetime.now(server.timezone.utc).year}
+    else:
+        kwargs = {"today": args.date or server.datetime.now(server.timezone.utc).date().isoformat()}
+    report = await server.run_job(args.job, **kwargs)
+    if report is None:
+        print(f"error: {args.job} is already running in another process", file=sys.stderr)
+        return 1
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+async def run(args) -> int:
+    try:
+        # Credits are provisioned from the category registry, which the server seeds on its first start
+        await server.seed_categories()
+        return await args.command(args)
+    finally:
+        server.client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="name", required=True)
+
+    import_users = commands.add_parser("import-users", help="create, update and deactivate users from a WordPress user export")
+    import_users.add_argument("file", help="CSV or JSON export, the format is taken from the extension unless --format is given")
+    import_users.add_argument("--format", choices=["csv", "json"])
+    import_users.add_argument("--deactivate-missing", action="store_true", help="deactivate users that are not in the export")
+    import_users.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    import_users.set_defaults(command=import_users_command)
+
+    run_job = commands.add_parser("run-job", help="run a scheduled batch job now, resuming from its last checkpoint")
+    run_job.add_argument("job", choices=sorted(server.JOBS))
+    run_job.add_argument("--year", type=int, help="provision-credits: the year to provision, defaults to the current one")
+    run_job.add_argument("--date", help="expire-credits: expire balances whose expires_at is before this ISO date, defaults to today (UTC)")
+    run_job.set_defaults(command=run_job_command)
+
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,49 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Request, Response, Depends
-from fastapi.responses import RedirectResponse
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Response, Depends, Query
+from fastapi.responses import ORJSONResponse, RedirectResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, IndexModel, InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from typing import Callable, List, Optional, Union
+from collections import OrderedDict
+from copy import deepcopy
+from types import MappingProxyType
+import asyncio
+import socket
+import threading
 import uuid
-from datetime import datetime, timezone, timedelta
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone, timedelta
 import base64
+import re
+import csv
+import io
+import hashlib
+import json
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-import requests
+from email.utils import format_datetime, parsedate_to_datetime
+import httpx
+import orjson
+import numpy as np
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request as GoogleRequest
 from googleapiclient.discovery import build
 import warnings
 
+# Brotli comes with requirements.txt, an install without it only serves gzip
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
@@ -41,7 +66,105 @@ GOOGLE_SCOPES = [
     "https://www.googleapis.com/auth/userinfo.profile"
 ]
 
-app = FastAPI()
+# Session cache config. A logout or user change made on another worker reaches this one's cache within
+# SESSION_CACHE_REVALIDATE_SECONDS, through a probe of the sessions change counter; the TTL bounds the rest.
+SESSION_CACHE_TTL_SECONDS = float(os.environ.get('SESSION_CACHE_TTL_SECONDS', '60'))
+SESSION_CACHE_REVALIDATE_SECONDS = float(os.environ.get('SESSION_CACHE_REVALIDATE_SECONDS', '5'))
+SESSION_CACHE_MAX_SIZE = int(os.environ.get('SESSION_CACHE_MAX_SIZE', '10000'))
+
+# Outbound HTTP client config (identity provider, OAuth token exchange)
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.environ.get('HTTP_CONNECT_TIMEOUT_SECONDS', '5'))
+HTTP_READ_TIMEOUT_SECONDS = float(os.environ.get('HTTP_READ_TIMEOUT_SECONDS', '15'))
+HTTP_MAX_CONNECTIONS = int(os.environ.get('HTTP_MAX_CONNECTIONS', '100'))
+HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', '2'))
+HTTP_RETRY_BACKOFF_SECONDS = float(os.environ.get('HTTP_RETRY_BACKOFF_SECONDS', '0.5'))
+
+# Shared pooled client, created on startup and closed on shutdown
+http_client: Optional[httpx.AsyncClient] = None
+
+# Notification outbox config
+OUTBOX_WORKERS = int(os.environ.get('OUTBOX_WORKERS', '2'))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', '6'))
+OUTBOX_BACKOFF_BASE_SECONDS = float(os.environ.get('OUTBOX_BACKOFF_BASE_SECONDS', '30'))
+OUTBOX_BACKOFF_MAX_SECONDS = float(os.environ.get('OUTBOX_BACKOFF_MAX_SECONDS', '3600'))
+OUTBOX_POLL_INTERVAL_SECONDS = float(os.environ.get('OUTBOX_POLL_INTERVAL_SECONDS', '5'))
+OUTBOX_CLAIM_TIMEOUT_SECONDS = float(os.environ.get('OUTBOX_CLAIM_TIMEOUT_SECONDS', '300'))
+# Sent and skipped entries are dropped by a TTL index this long after sent_at; dead ones stay for HR to retry.
+# Changing it on an existing database needs a collMod of the sent_at_ttl index.
+OUTBOX_RETENTION_SECONDS = int(os.environ.get('OUTBOX_RETENTION_SECONDS', str(30 * 24 * 3600)))
+
+# Google API client config
+GOOGLE_API_MAX_WORKERS = int(os.environ.get('GOOGLE_API_MAX_WORKERS', '4'))
+
+# Settings cache config
+SETTINGS_CACHE_REVALIDATE_SECONDS = float(os.environ.get('SETTINGS_CACHE_REVALIDATE_SECONDS', '30'))
+
+# Google token refresh config
+GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS = float(os.environ.get('GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS', '300'))
+GOOGLE_TOKEN_REFRESH_LEASE_SECONDS = float(os.environ.get('GOOGLE_TOKEN_REFRESH_LEASE_SECONDS', '30'))
+# How long every worker waits before trying again after a refresh failed (e.g. the refresh token was revoked)
+GOOGLE_TOKEN_REFRESH_BACKOFF_SECONDS = float(os.environ.get('GOOGLE_TOKEN_REFRESH_BACKOFF_SECONDS', '300'))
+
+# HR recipient list cache config
+HR_RECIPIENTS_CACHE_TTL_SECONDS = float(os.environ.get('HR_RECIPIENTS_CACHE_TTL_SECONDS', '300'))
+
+# Working-day engine config, the TTL bounds how long another worker's holiday edits can go unseen
+HOLIDAY_CALENDAR_CACHE_TTL_SECONDS = float(os.environ.get('HOLIDAY_CALENDAR_CACHE_TTL_SECONDS', '3600'))
+WORKING_DAYS_BATCH_SIZE = 1000
+RECOMPUTE_REPORT_LIMIT = 500
+
+# Longest calendar span of one request, it bounds the start_date side of every overlap query
+MAX_REQUEST_SPAN_DAYS = int(os.environ.get('MAX_REQUEST_SPAN_DAYS', '366'))
+
+# Calendar month buckets are kept up to date on writes, the max age only guards against writes from outside the app
+CALENDAR_BUCKET_MAX_AGE_SECONDS = float(os.environ.get('CALENDAR_BUCKET_MAX_AGE_SECONDS', '86400'))
+
+# Widest range served by GET /api/calendar/range
+CALENDAR_RANGE_MAX_DAYS = 366
+
+# Category registry config, edits made by another worker are picked up within the revalidate window
+CATEGORY_REGISTRY_REVALIDATE_SECONDS = float(os.environ.get('CATEGORY_REGISTRY_REVALIDATE_SECONDS', '30'))
+
+# Credit account config, legacy per-category credit documents are folded into accounts this many at a time
+CREDIT_MIGRATION_BATCH_SIZE = int(os.environ.get('CREDIT_MIGRATION_BATCH_SIZE', '1000'))
+CREDIT_MIGRATION_LEASE_SECONDS = float(os.environ.get('CREDIT_MIGRATION_LEASE_SECONDS', '600'))
+# How often workers that did not get the migration lease check whether it has finished
+CREDIT_MIGRATION_POLL_SECONDS = float(os.environ.get('CREDIT_MIGRATION_POLL_SECONDS', '30'))
+CREDIT_UPDATE_ATTEMPTS = 3  # Read-modify-write retries when a balance changes under an HR edit
+
+# Scheduled jobs config, next year's credits are provisioned from NEXT_YEAR_PROVISIONING_FROM (MM-DD) on
+SCHEDULED_JOBS_ENABLED = os.environ.get('SCHEDULED_JOBS_ENABLED', 'true').lower() == 'true'
+JOB_SCHEDULER_TICK_SECONDS = float(os.environ.get('JOB_SCHEDULER_TICK_SECONDS', '3600'))
+JOB_LEASE_SECONDS = float(os.environ.get('JOB_LEASE_SECONDS', '600'))
+JOB_BATCH_SIZE = int(os.environ.get('JOB_BATCH_SIZE', '1000'))
+NEXT_YEAR_PROVISIONING_FROM = os.environ.get('NEXT_YEAR_PROVISIONING_FROM', '12-01')
+
+# HR digest config
+HR_DIGEST_TICK_SECONDS = float(os.environ.get('HR_DIGEST_TICK_SECONDS', '60'))
+HR_DIGEST_MAX_ITEMS = int(os.environ.get('HR_DIGEST_MAX_ITEMS', '200'))
+
+# Index management config
+ENSURE_INDEXES_ON_STARTUP = os.environ.get('ENSURE_INDEXES_ON_STARTUP', 'true').lower() == 'true'
+
+# Keyset pagination config
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', '5000'))
+
+# Bulk decision config
+BULK_DECISION_MAX_REQUESTS = int(os.environ.get('BULK_DECISION_MAX_REQUESTS', '500'))
+GOOGLE_BATCH_SIZE = 50  # Calendar API batch requests are capped at 50 calls
+
+# User import config
+USER_IMPORT_MAX_ROWS = int(os.environ.get('USER_IMPORT_MAX_ROWS', '20000'))
+USER_IMPORT_ERROR_LIMIT = 500  # Per-row errors listed in the report, the count is always complete
+
+# Export config, rows fetched per cursor batch and written per streamed chunk
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '1000'))
+
+# Response compression config, smaller bodies are not worth the CPU
+COMPRESSION_MIN_SIZE_BYTES = int(os.environ.get('COMPRESSION_MIN_SIZE_BYTES', '1024'))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', '6'))  # 9 costs ~4x the CPU for ~12% fewer bytes
+
+app = FastAPI(default_response_class=ORJSONResponse)
 api_router = APIRouter(prefix="/api")
 
 # Configure logging
@@ -51,6 +174,8 @@ logger = logging.getLogger(__name__)
 # ==================== MODELS ====================
 
 # Holiday Categories
+# Categories and their default yearly credits seeded into the holiday_categories registry on first start,
+# after that the registry is the source of truth and HR edits it through the API
 HOLIDAY_CATEGORIES = [
     {"id": "paid_holiday", "name": "Paid Holidays", "description": "Regular paid time off"},
     {"id": "unpaid_leave", "name": "Unpaid Leave", "description": "Leave without pay"},
@@ -60,7 +185,6 @@ HOLIDAY_CATEGORIES = [
     {"id": "compensatory_rest", "name": "Compensatory Rest", "description": "Rest days for overtime or extra work"}
 ]
 
-# Default credits per category
 DEFAULT_CREDITS = {
     "paid_holiday": 35.0,
     "unpaid_leave": 0.0,  # Usually unlimited but tracked
@@ -77,6 +201,7 @@ class User(BaseModel):
     name: str
     picture: Optional[str] = None
     role: str = "employee"  # employee or hr
+    active: bool = True  # Deactivated users keep their history but can no longer sign in
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class UserSession(BaseModel):
@@ -96,9 +221,13 @@ class HolidayRequest(BaseModel):
     category: str = "paid_holiday"  # Holiday category
     start_date: str  # ISO date string
     end_date: str
-    days_count: float
+    days_count: float  # Working days, computed by the server
+    start_half_day: bool = False  # Only the afternoon of the first day is taken
+    end_half_day: bool = False  # Only the morning of the last day is taken
     reason: str
-    status: str = "pending"  # pending, approved, rejected
+    status: str = "pending"  # pending, approved, rejected, cancelled
+    credit_year: Optional[int] = None  # Year of the credit the days are reserved against
+    reserved_days: float = 0.0  # Days held on the credit while pending
     hr_comment: Optional[str] = None
     processed_by: Optional[str] = None
     processed_at: Optional[datetime] = None
@@ -109,10 +238,18 @@ class HolidayRequestCreate(BaseModel):
     category: str = "paid_holiday"
     start_date: str
     end_date: str
-    days_count: float
+    days_count: Optional[float] = None  # Ignored, the server counts working days itself
+    start_half_day: bool = False
+    end_half_day: bool = False
     reason: str
 
+class BulkDecision(BaseModel):
+    request_ids: List[str]
+    decision: str  # approve or reject
+    hr_comment: Optional[str] = None
+
 class HolidayCredit(BaseModel):
+    """One category balance of a user for a year, as served by the API and exports"""
     model_config = ConfigDict(extra="ignore")
     credit_id: str = Field(default_factory=lambda: f"cred_{uuid.uuid4().hex[:12]}")
     user_id: str
@@ -123,7 +260,34 @@ class HolidayCredit(BaseModel):
     total_days: float = 35.0
     used_days: float = 0.0
     remaining_days: float = 35.0
+    reserved_days: float = 0.0  # Held by pending requests, available = remaining - reserved
     expires_at: Optional[str] = None  # ISO date string for expiration
+    migration_conflict: bool = False  # A legacy balance kept because the account already has a used one
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class CreditBalance(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    credit_id: str = Field(default_factory=lambda: f"cred_{uuid.uuid4().hex[:12]}")
+    category: str
+    total_days: float = 0.0
+    used_days: float = 0.0
+    remaining_days: float = 0.0
+    reserved_days: float = 0.0
+    available_days: float = 0.0  # remaining - reserved, stored so a reservation can be checked inside $elemMatch
+    expires_at: Optional[str] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class CreditAccount(BaseModel):
+    """Every category balance of a user for a year in one document (the credit_accounts collection)"""
+    model_config = ConfigDict(extra="ignore")
+    account_id: str = Field(default_factory=lambda: f"acct_{uuid.uuid4().hex[:12]}")
+    user_id: str
+    user_email: str
+    user_name: str
+    year: int
+    balances: List[CreditBalance] = []
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -134,6 +298,28 @@ class HolidayCreditCreate(BaseModel):
     total_days: float = 35.0
     expires_at: Optional[str] = None  # ISO date string for expiration
 
+class HolidayCategory(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    name: str
+    description: str = ""
+    default_credits: float = 0.0  # Days granted to every user each year
+    active: bool = True  # Inactive categories keep their name for old records but take no new requests or credits
+    sort_order: int = 0
+
+class HolidayCategoryCreate(BaseModel):
+    id: str
+    name: str
+    description: str = ""
+    default_credits: float = 0.0
+
+class HolidayCategoryUpdate(BaseModel):
+    name: Optional[str] = None
+    description: Optional[str] = None
+    default_credits: Optional[float] = None
+    active: Optional[bool] = None
+    sort_order: Optional[int] = None
+
 class PublicHoliday(BaseModel):
     model_config = ConfigDict(extra="ignore")
     holiday_id: str = Field(default_factory=lambda: f"ph_{uuid.uuid4().hex[:12]}")
@@ -151,12 +337,29 @@ class PublicHolidayCreate(BaseModel):
 class AppSettings(BaseModel):
     model_config = ConfigDict(extra="ignore")
     settings_id: str = "app_settings"
+    version: int = 0  # Bumped on every write so cached copies can be revalidated cheaply
     email_notifications_enabled: bool = True
     calendar_sync_enabled: bool = True
     notification_email: Optional[str] = None
+    hr_digest_enabled: bool = False  # Batch new request notifications into a periodic HR summary
+    hr_digest_interval_minutes: int = 60
     google_tokens: Optional[dict] = None
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class NotificationOutboxEntry(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    outbox_id: str = Field(default_factory=lambda: f"out_{uuid.uuid4().hex[:12]}")
+    to_email: Union[str, List[str]]  # A list is sent as one multi-recipient message
+    subject: str
+    body: str
+    status: str = "pending"  # pending, sending, sent, skipped, dead
+    attempts: int = 0
+    next_attempt_at: str  # ISO datetime string
+    claimed_until: Optional[str] = None
+    last_error: Optional[str] = None
+    sent_at: Optional[datetime] = None  # A BSON date, the TTL index only expires those
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
 class GoogleOAuthToken(BaseModel):
     model_config = ConfigDict(extra="ignore")
     token_id: str = Field(default_factory=lambda: f"token_{uuid.uuid4().hex[:12]}")
@@ -169,6 +372,473 @@ class GoogleOAuthToken(BaseModel):
     client_secret: str
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+# ==================== CACHES ====================
+
+class TTLCache:
+    """Bounded in-process LRU cache whose entries expire after a TTL"""
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (value, monotonic expiry)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl_seconds: Optional[float] = None):
+        """Store a value; ttl_seconds can only shorten the cache-wide TTL"""
+        ttl = self.ttl_seconds if ttl_seconds is None else min(ttl_seconds, self.ttl_seconds)
+        if ttl <= 0 or self.max_size <= 0:
+            return
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    def invalidate_where(self, predicate: Callable) -> int:
+        """Drop every entry whose value matches predicate, returns the number dropped"""
+        keys = [key for key, (value, _) in self._entries.items() if predicate(value)]
+        for key in keys:
+            del self._entries[key]
+        return len(keys)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+# Resolved sessions keyed by session token -> User
+session_cache = TTLCache(SESSION_CACHE_MAX_SIZE, SESSION_CACHE_TTL_SECONDS)
+
+# sessions change counter seq this worker's cache was last checked against
+_session_cache_seq: Optional[int] = None
+_session_cache_checked_at = 0.0
+
+async def revalidate_session_cache():
+    """Drop every cached session once another worker logged someone out or changed a user"""
+    global _session_cache_seq, _session_cache_checked_at
+    if time.monotonic() - _session_cache_checked_at < SESSION_CACHE_REVALIDATE_SECONDS:
+        return
+    _session_cache_checked_at = time.monotonic()
+    counter = await db.change_counters.find_one({"_id": "sessions"}, {"_id": 0, "seq": 1})
+    seq = counter.get("seq", 0) if counter else 0
+    if seq != _session_cache_seq:
+        session_cache.clear()
+        _session_cache_seq = seq
+
+async def invalidate_user_sessions(*user_ids: str):
+    """Drop cached sessions of users after their profile, role or account changed, here and on every other worker"""
+    changed = set(user_ids)
+    session_cache.invalidate_where(lambda cached_user: cached_user.user_id in changed)
+    await bump_change_counter("sessions")
+
+class SettingsSnapshot:
+    """Read-only view of the app_settings document with ready-to-use Google credentials"""
+
+    def __init__(self, doc: Optional[dict]):
+        self.exists = doc is not None
+        self.data = MappingProxyType(deepcopy(doc or {}))
+        self.version = self.data.get("version", 0)
+        self.credentials = None
+        self.token_expires_at = None
+        self.token_refresh_retry_at = None
+        
+        tokens = self.data.get("google_tokens")
+        if tokens:
+            self.credentials = self.new_credentials()
+            self.token_expires_at = self._timestamp(tokens.get("expires_at"))
+            self.token_refresh_retry_at = self._timestamp(tokens.get("refresh_retry_at"))
+
+    def new_credentials(self) -> Credentials:
+        """A fresh Credentials object for the stored tokens, never shared with the snapshot"""
+        tokens = self.data["google_tokens"]
+        return Credentials(
+            token=tokens.get("access_token"),
+            refresh_token=tokens.get("refresh_token"),
+            token_uri="https://oauth2.googleapis.com/token",
+            client_id=GOOGLE_CLIENT_ID,
+            client_secret=GOOGLE_CLIENT_SECRET
+        )
+
+    @staticmethod
+    def _timestamp(value) -> Optional[datetime]:
+        if not value:
+            return None
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+    def get(self, key: str, default=None):
+        return self.data.get(key, default)
+
+class SettingsCache:
+    """Process-wide app_settings snapshot, revalidated against the document's version stamp"""
+
+    def __init__(self, revalidate_seconds: float):
+        self.revalidate_seconds = revalidate_seconds
+        self._snapshot: Optional[SettingsSnapshot] = None
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+    async def get(self) -> SettingsSnapshot:
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._checked_at < self.revalidate_seconds:
+            self.hits += 1
+            return snapshot
+        
+        async with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and time.monotonic() - self._checked_at < self.revalidate_seconds:
+                self.hits += 1
+                return snapshot
+            
+            if snapshot is not None:
+                # Another worker may have written settings, a version probe is enough to find out
+                self.revalidations += 1
+                stamp = await db.settings.find_one({"settings_id": "app_settings"}, {"_id": 0, "version": 1})
+                if stamp is not None and stamp.get("version", 0) == snapshot.version:
+                    self._checked_at = time.monotonic()
+                    self.hits += 1
+                    return snapshot
+            
+            self.misses += 1
+            doc = await db.settings.find_one({"settings_id": "app_settings"}, {"_id": 0})
+            self._snapshot = SettingsSnapshot(doc)
+            self._checked_at = time.monotonic()
+            return self._snapshot
+
+    def invalidate(self):
+        self._snapshot = None
+
+    def stats(self) -> dict:
+        return {
+            "version": self._snapshot.version if self._snapshot else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidations": self.revalidations
+        }
+
+settings_cache = SettingsCache(SETTINGS_CACHE_REVALIDATE_SECONDS)
+
+# Email addresses of every HR user, used for new request fan-out
+hr_recipients_cache = TTLCache(1, HR_RECIPIENTS_CACHE_TTL_SECONDS)
+
+class CategorySnapshot:
+    """Read-only id-keyed view of the holiday category registry"""
+
+    def __init__(self, docs: List[dict], version: int):
+        self.version = version
+        self.by_id = MappingProxyType({doc["id"]: MappingProxyType(doc) for doc in docs})
+        self.active = [dict(doc) for doc in docs if doc.get("active", True)]
+        self.default_credits = {doc["id"]: doc.get("default_credits", 0.0) for doc in self.active}
+        self.etag = f'W/"categories-{version}"'
+
+    def name(self, category_id: str) -> str:
+        category = self.by_id.get(category_id)
+        return category["name"] if category else category_id
+
+    def is_active(self, category_id: str) -> bool:
+        category = self.by_id.get(category_id)
+        return category is not None and category.get("active", True)
+
+class CategoryRegistry:
+    """Process-wide category snapshot, reloaded when the categories change counter moves"""
+
+    def __init__(self, revalidate_seconds: float):
+        self.revalidate_seconds = revalidate_seconds
+        self._snapshot: Optional[CategorySnapshot] = None
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+    async def get(self) -> CategorySnapshot:
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._checked_at < self.revalidate_seconds:
+            self.hits += 1
+            return snapshot
+        
+        async with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and time.monotonic() - self._checked_at < self.revalidate_seconds:
+                self.hits += 1
+                return snapshot
+            
+            stamp = await db.change_counters.find_one({"_id": "categories"}, {"seq": 1})
+            version = stamp.get("seq", 0) if stamp else 0
+            if snapshot is not None:
+                self.revalidations += 1
+                if version == snapshot.version:
+                    self._checked_at = time.monotonic()
+                    self.hits += 1
+                    return snapshot
+            
+            self.misses += 1
+            docs = await db.holiday_categories.find({}, {"_id": 0}).sort([("sort_order", 1), ("id", 1)]).to_list(None)
+            self._snapshot = CategorySnapshot(docs, version)
+            self._checked_at = time.monotonic()
+            return self._snapshot
+
+    def invalidate(self):
+        self._snapshot = None
+
+    def stats(self) -> dict:
+        return {
+            "version": self._snapshot.version if self._snapshot else None,
+            "categories": len(self._snapshot.by_id) if self._snapshot else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidations": self.revalidations
+        }
+
+category_registry = CategoryRegistry(CATEGORY_REGISTRY_REVALIDATE_SECONDS)
+
+async def get_hr_recipients() -> List[str]:
+    """Get the HR email list, cached until a role change or the TTL runs out"""
+    recipients = hr_recipients_cache.get("hr")
+    if recipients is None:
+        hr_users = await db.users.find({"role": "hr", "active": {"$ne": False}}, {"_id": 0, "email": 1}).to_list(1000)
+        recipients = sorted({hr["email"] for hr in hr_users if hr.get("email")})
+        hr_recipients_cache.set("hr", recipients)
+    return recipients
+
+# ==================== LEASES ====================
+
+# Identifies this worker process as the holder of a lease
+LEASE_OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+async def acquire_lease(name: str, ttl_seconds: float) -> bool:
+    """Take or renew a cross-worker lease, returns False while another live worker holds it"""
+    now = datetime.now(timezone.utc)
+    try:
+        await db.leases.update_one(
+            {"_id": name, "$or": [{"owner": LEASE_OWNER}, {"expires_at": {"$lte": now.isoformat()}}]},
+            {"$set": {
+                "owner": LEASE_OWNER,
+                "expires_at": (now + timedelta(seconds=ttl_seconds)).isoformat(),
+                "acquired_at": now.isoformat()
+            }},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        # The lease document exists and is held by someone else, so the upsert collided on _id
+        return False
+
+async def release_lease(name: str):
+    await db.leases.delete_one({"_id": name, "owner": LEASE_OWNER})
+
+# ==================== INDEXES ====================
+
+# Every index the queries in this module rely on, created or verified on startup
+INDEX_SPECS = {
+    "users": [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("role", ASCENDING)], name="role"),
+        IndexModel([("name", ASCENDING), ("user_id", ASCENDING)], name="name_user_id")
+    ],
+    "user_sessions": [
+        IndexModel([("session_token", ASCENDING)], name="session_token_unique", unique=True),
+        IndexModel([("user_id", ASCENDING)], name="user_id")
+    ],
+    "holiday_requests": [
+        IndexModel([("request_id", ASCENDING)], name="request_id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("request_id", DESCENDING)], name="user_id_created_at_request_id"),
+        IndexModel([("status", ASCENDING), ("created_at", DESCENDING), ("request_id", DESCENDING)], name="status_created_at_request_id"),
+        IndexModel([("status", ASCENDING), ("start_date", ASCENDING), ("end_date", ASCENDING)], name="status_start_date_end_date"),
+        IndexModel([("user_id", ASCENDING), ("start_date", ASCENDING), ("end_date", ASCENDING)], name="user_id_start_date_end_date"),
+        IndexModel([("created_at", DESCENDING), ("request_id", DESCENDING)], name="created_at_request_id"),
+        IndexModel([("start_date", ASCENDING), ("request_id", ASCENDING)], name="start_date_request_id")
+    ],
+    "credit_accounts": [
+        IndexModel([("user_id", ASCENDING), ("year", ASCENDING)], name="user_id_year_unique", unique=True),
+        IndexModel([("year", DESCENDING), ("user_name", ASCENDING), ("user_id", ASCENDING)], name="year_user_name_user_id"),
+        IndexModel([("balances.expires_at", ASCENDING)], name="balances_expires_at")
+    ],
+    "credit_archive": [
+        IndexModel([("credit_id", ASCENDING)], name="credit_id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("year", DESCENDING)], name="user_id_year")
+    ],
+    # Legacy per-category layout, only read until the credit account migration has emptied it
+    "holiday_credits": [
+        IndexModel([("user_id", ASCENDING), ("year", ASCENDING), ("category", ASCENDING)], name="user_year_category_unique", unique=True)
+    ],
+    "holiday_categories": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True)
+    ],
+    "public_holidays": [
+        IndexModel([("holiday_id", ASCENDING)], name="holiday_id_unique", unique=True),
+        IndexModel([("date", ASCENDING)], name="date"),
+        IndexModel([("year", ASCENDING), ("date", ASCENDING)], name="year_date")
+    ],
+    "settings": [
+        IndexModel([("settings_id", ASCENDING)], name="settings_id_unique", unique=True)
+    ],
+    "oauth_states": [
+        IndexModel([("state", ASCENDING)], name="state_unique", unique=True)
+    ],
+    "notification_outbox": [
+        IndexModel([("outbox_id", ASCENDING)], name="outbox_id_unique", unique=True),
+        IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)], name="status_next_attempt_at"),
+        IndexModel([("status", ASCENDING), ("claimed_until", ASCENDING)], name="status_claimed_until"),
+        IndexModel([("created_at", DESCENDING)], name="created_at"),
+        IndexModel([("sent_at", ASCENDING)], name="sent_at_ttl", expireAfterSeconds=OUTBOX_RETENTION_SECONDS)
+    ]
+}
+
+# Representative (collection, filter, sort) of every query shape issued by the routes, checked with explain
+QUERY_SHAPES = [
+    ("user_sessions", {"session_token": "x"}, None),
+    ("users", {"user_id": "x"}, None),
+    ("users", {"email": "x"}, None),
+    ("users", {"role": "hr"}, None),
+    ("users", {}, [("name", 1), ("user_id", 1)]),
+    ("holiday_requests", {"request_id": "x"}, None),
+    ("holiday_requests", {"user_id": "x"}, [("created_at", -1), ("request_id", -1)]),
+    ("holiday_requests", {}, [("created_at", -1), ("request_id", -1)]),
+    ("holiday_requests", {"status": "pending"}, [("created_at", -1), ("request_id", -1)]),
+    ("holiday_requests", {"status": "approved", "start_date": {"$gte": "1999-01-01", "$lte": "2000-01-31"}, "end_date": {"$gte": "2000-01-01"}}, None),
+    ("holiday_requests", {"status": {"$in": ["pending", "approved"]}, "start_date": {"$gte": "1999-01-01", "$lte": "2000-01-31"}, "end_date": {"$gte": "2000-01-01"}}, [("start_date", 1)]),
+    ("holiday_requests", {"user_id": "x", "status": {"$in": ["pending", "approved"]}, "start_date": {"$gte": "1999-01-01", "$lte": "2000-01-31"}, "end_date": {"$gte": "2000-01-01"}}, None),
+    ("holiday_requests", {"start_date": {"$gte": "2000-01-01", "$lte": "2000-12-31"}}, [("start_date", 1), ("request_id", 1)]),
+    ("holiday_requests", {"status": "approved", "start_date": {"$gte": "2000-01-01", "$lte": "2000-12-31"}}, [("start_date", 1), ("request_id", 1)]),
+    ("credit_accounts", {"user_id": "x", "year": 2000}, None),
+    ("credit_accounts", {"user_id": "x"}, [("year", -1)]),
+    ("credit_accounts", {"year": 2000}, [("year", -1), ("user_name", 1), ("user_id", 1)]),
+    ("credit_accounts", {}, [("year", -1), ("user_name", 1), ("user_id", 1)]),
+    ("credit_accounts", {"balances.expires_at": {"$lt": "2000-01-01"}}, None),
+    ("users", {"user_id": {"$gt": "x"}, "active": {"$ne": False}}, [("user_id", 1)]),
+    ("holiday_credits", {"$and": [{"user_id": "x", "year": 2000}, {"migration_conflict": {"$ne": True}}]}, [("_id", 1)]),
+    ("holiday_credits", {"migration_conflict": {"$ne": True}}, [("_id", 1)]),
+    ("public_holidays", {"holiday_id": "x"}, None),
+    ("public_holidays", {"year": 2000}, [("date", 1)]),
+    ("public_holidays", {"date": {"$gte": "2000-01-01", "$lt": "2000-02-01"}}, None),
+    ("settings", {"settings_id": "app_settings"}, None),
+    ("oauth_states", {"state": "x"}, None),
+    ("notification_outbox", {"status": "pending", "next_attempt_at": {"$lte": "2000-01-01"}}, [("next_attempt_at", 1)])
+]
+
+# Result of the last ensure_indexes run, served by GET /api/indexes/report
+index_report: dict = {}
+
+def _plan_stages(plan: dict):
+    """Yield every stage name in an explain plan tree"""
+    if not isinstance(plan, dict):
+        return
+    if "stage" in plan:
+        yield plan["stage"]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _plan_stages(child)
+
+async def find_collection_scans() -> List[dict]:
+    """Explain every known query shape and return the ones whose winning plan is a collection scan"""
+    scans = []
+    for collection, query_filter, sort in QUERY_SHAPES:
+        cursor = db[collection].find(query_filter)
+        if sort:
+            cursor = cursor.sort(sort)
+        try:
+            explain = await cursor.explain()
+        except Exception as e:
+            logger.warning(f"Could not explain query on {collection}: {e}")
+            continue
+        stages = set(_plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {})))
+        if "COLLSCAN" in stages:
+            scans.append({"collection": collection, "filter": query_filter, "sort": sort})
+    return scans
+
+async def ensure_indexes() -> dict:
+    """Create missing indexes, verify they exist and report query shapes that would scan a collection"""
+    report = {"created": {}, "missing": {}, "errors": {}, "collection_scans": []}
+    for collection, models in INDEX_SPECS.items():
+        try:
+            await db[collection].create_indexes(models)
+        except OperationFailure as e:
+            # Usually duplicate data blocking a unique index, the other collections still get theirs
+            report["errors"][collection] = str(e)
+            logger.error(f"Index creation failed on {collection}: {e}")
+        
+        existing = await db[collection].index_information()
+        expected = [model.document["name"] for model in models]
+        report["created"][collection] = [name for name in expected if name in existing]
+        missing = [name for name in expected if name not in existing]
+        if missing:
+            report["missing"][collection] = missing
+            logger.warning(f"Missing indexes on {collection}: {missing}")
+    
+    report["collection_scans"] = await find_collection_scans()
+    for scan in report["collection_scans"]:
+        logger.warning(f"Query on {scan['collection']} would scan the collection: filter={scan['filter']} sort={scan['sort']}")
+    
+    report["checked_at"] = datetime.now(timezone.utc).isoformat()
+    index_report.clear()
+    index_report.update(report)
+    return report
+
+# ==================== GOOGLE API CLIENT ====================
+
+# Blocking googleapiclient calls run here instead of on the event loop thread
+google_api_executor = ThreadPoolExecutor(max_workers=GOOGLE_API_MAX_WORKERS, thread_name_prefix="google-api")
+
+# httplib2 transports are not thread-safe, so every executor thread keeps its own services
+_google_services = threading.local()
+
+def get_google_service(api: str, version: str, creds: Credentials):
+    """Return this thread's service for api, built once per credential generation (access token)"""
+    services = getattr(_google_services, "services", None)
+    if services is None:
+        services = _google_services.services = {}
+    
+    generation = creds.token
+    cached = services.get((api, version))
+    if cached and cached[0] == generation:
+        return cached[1]
+    
+    service = build(api, version, credentials=creds, cache_discovery=False)
+    services[(api, version)] = (generation, service)
+    return service
+
+async def run_google_call(func: Callable, *args):
+    """Run blocking Google client code on the bounded Google API executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(google_api_executor, func, *args)
+
 # ==================== HELPER FUNCTIONS ====================
 
 async def get_current_user(request: Request) -> User:
@@ -182,6 +852,11 @@ async def get_current_user(request: Request) -> User:
     if not session_token:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
+    await revalidate_session_cache()
+    cached_user = session_cache.get(session_token)
+    if cached_user is not None:
+        return cached_user
+    
     session = await db.user_sessions.find_one({"session_token": session_token}, {"_id": 0})
     if not session:
         raise HTTPException(status_code=401, detail="Invalid session")
@@ -191,14 +866,138 @@ async def get_current_user(request: Request) -> User:
         expires_at = datetime.fromisoformat(expires_at)
     if expires_at.tzinfo is None:
         expires_at = expires_at.replace(tzinfo=timezone.utc)
-    if expires_at < datetime.now(timezone.utc):
+    now = datetime.now(timezone.utc)
+    if expires_at < now:
         raise HTTPException(status_code=401, detail="Session expired")
     
     user = await db.users.find_one({"user_id": session["user_id"]}, {"_id": 0})
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
+    if not user.get("active", True):
+        raise HTTPException(status_code=403, detail="Account deactivated")
     
-    return User(**user)
+    user = User(**user)
+    # Never keep a session cached past its own expiry
+    session_cache.set(session_token, user, ttl_seconds=(expires_at - now).total_seconds())
+    return user
+
+# Gateway errors are worth retrying, anything else is returned to the caller as-is
+RETRYABLE_STATUS_CODES = {502, 503, 504}
+# Methods safe to send twice. Anything else (e.g. the single-use OAuth code exchange) is only retried when the
+# connection was never made, since a dropped response or a gateway error may follow a call that did go through.
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+async def http_request(method: str, url: str, **kwargs) -> httpx.Response:
+    """Send an outbound request on the shared pool, retrying transient failures with backoff"""
+    idempotent = method.upper() in IDEMPOTENT_METHODS
+    retryable_errors = (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError) if idempotent else (httpx.ConnectError, httpx.ConnectTimeout)
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        try:
+            resp = await http_client.request(method, url, **kwargs)
+        except retryable_errors as e:
+            if attempt == HTTP_MAX_RETRIES:
+                raise
+            logger.warning(f"{method} {url} failed ({e!r}), retrying")
+        else:
+            if not idempotent or resp.status_code not in RETRYABLE_STATUS_CODES or attempt == HTTP_MAX_RETRIES:
+                return resp
+            logger.warning(f"{method} {url} returned {resp.status_code}, retrying")
+        await asyncio.sleep(HTTP_RETRY_BACKOFF_SECONDS * 2 ** attempt)
+
+def json_response(content, response: Optional[Response] = None) -> ORJSONResponse:
+    """Serialize rows straight to orjson, skipping FastAPI's jsonable_encoder pass over every document.
+    
+    Headers already set on the route's injected response (e.g. X-Next-Cursor) are carried over.
+    """
+    headers = None
+    if response is not None:
+        headers = {key: value for key, value in response.headers.items() if key != "content-length"}
+    return ORJSONResponse(content, headers=headers)
+
+# ==================== KEYSET PAGINATION ====================
+
+# Sort orders of the paginated listings, each ending in a unique field so positions are unambiguous
+REQUESTS_SORT = [("created_at", DESCENDING), ("request_id", DESCENDING)]
+CREDIT_ACCOUNTS_SORT = [("year", DESCENDING), ("user_name", ASCENDING), ("user_id", ASCENDING)]  # (year, user_id) is unique
+USERS_SORT = [("name", ASCENDING), ("user_id", ASCENDING)]
+
+def encode_cursor(values: list) -> str:
+    """Encode the sort key of the last returned document as an opaque cursor"""
+    values = [{"$dt": v.isoformat()} if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(",", ":")).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, size: int) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return [datetime.fromisoformat(v["$dt"]) if isinstance(v, dict) and "$dt" in v else v for v in values]
+
+def keyset_filter(sort: list, values: list) -> dict:
+    """Match documents strictly after values in sort order: (a > x) or (a == x and b > y) ...
+    
+    A missing or null field sorts before every value but $gt/$lt never match across types, so null is handled
+    explicitly: ascending, everything non-null follows it; descending, nothing does, and it follows every value.
+    """
+    clauses = []
+    for i, (field, direction) in enumerate(sort):
+        clause = {prev_field: value for (prev_field, _), value in zip(sort[:i], values[:i])}
+        value = values[i]
+        if direction == ASCENDING:
+            clause[field] = {"$ne": None} if value is None else {"$gt": value}
+        elif value is None:
+            continue
+        else:
+            clause["$or"] = [{field: {"$lt": value}}, {field: None}]
+        clauses.append(clause)
+    return {"$or": clauses}
+
+async def find_page(collection, query: dict, sort: list, limit: int, cursor: Optional[str], response: Response,
+                    projection: Optional[dict] = None) -> List[dict]:
+    """Fetch one page in sort order, setting X-Next-Cursor when more documents follow"""
+    if cursor:
+        query = {"$and": [query, keyset_filter(sort, decode_cursor(cursor, len(sort)))]}
+    docs = await collection.find(query, projection or {"_id": 0}).sort(sort).limit(limit + 1).to_list(limit + 1)
+    if len(docs) > limit:
+        docs = docs[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor([docs[-1].get(field) for field, _ in sort])
+    return docs
+
+# ==================== SPARSE FIELDS ====================
+
+# Credit fields added by the routes rather than stored, with the stored fields they are derived from
+CREDIT_COMPUTED_FIELDS = {"category_name": ["category"], "available_days": ["remaining_days", "reserved_days"]}
+
+def select_fields(fields: Optional[str], model: type, sort: list, computed: Optional[dict] = None) -> tuple:
+    """Translate a comma separated fields= list into a Mongo projection, validated against model.
+    
+    Returns (projection, selected); selected is None when no fields= was given and every field is returned.
+    """
+    if fields is None:
+        return {"_id": 0}, None
+    computed = computed or {}
+    selected = list(dict.fromkeys(field.strip() for field in fields.split(",") if field.strip()))
+    if not selected:
+        raise HTTPException(status_code=400, detail="No fields selected")
+    unknown = [field for field in selected if field not in model.model_fields and field not in computed]
+    if unknown:
+        allowed = ", ".join(sorted([*model.model_fields, *computed]))
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}. Allowed: {allowed}")
+    
+    stored = set()
+    for field in selected:
+        stored.update(computed.get(field, [field]))
+    # The sort keys are needed for the next-page cursor even when not asked for
+    stored.update(field for field, _ in sort)
+    return {"_id": 0, **{field: 1 for field in sorted(stored)}}, selected
+
+def trim_fields(docs: List[dict], selected: Optional[List[str]]) -> List[dict]:
+    """Drop the fields that were only fetched for the cursor or to derive another field"""
+    if selected is None:
+        return docs
+    return [{field: doc[field] for field in selected if field in doc} for doc in docs]
 
 async def get_hr_user(request: Request) -> User:
     """Get current user and verify they are HR"""
@@ -207,76 +1006,138 @@ async def get_hr_user(request: Request) -> User:
         raise HTTPException(status_code=403, detail="HR access required")
     return user
 
-async def get_google_creds():
-    """Get Google credentials from settings for sending emails/calendar"""
-    settings = await db.settings.find_one({"settings_id": "app_settings"}, {"_id": 0})
-    if not settings or not settings.get("google_tokens"):
-        return None
-    
-    tokens = settings["google_tokens"]
-    creds = Credentials(
-        token=tokens.get("access_token"),
-        refresh_token=tokens.get("refresh_token"),
-        token_uri="https://oauth2.googleapis.com/token",
-        client_id=GOOGLE_CLIENT_ID,
-        client_secret=GOOGLE_CLIENT_SECRET
+def google_token_needs_refresh(settings: SettingsSnapshot) -> bool:
+    """True once the stored access token is within the refresh margin of its expiry, unless a failed refresh
+    is backing off"""
+    if not settings.credentials or not settings.credentials.refresh_token or not settings.token_expires_at:
+        return False
+    now = datetime.now(timezone.utc)
+    if settings.token_refresh_retry_at and now < settings.token_refresh_retry_at:
+        return False
+    margin = timedelta(seconds=GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS)
+    return now >= settings.token_expires_at - margin
+
+def google_token_usable(settings: SettingsSnapshot) -> bool:
+    """True while the stored access token has not actually expired yet"""
+    return bool(settings.credentials) and (
+        settings.token_expires_at is None or datetime.now(timezone.utc) < settings.token_expires_at
     )
-    
-    # Check if expired and refresh
-    expires_at = tokens.get("expires_at")
-    if expires_at:
-        if isinstance(expires_at, str):
-            expires_at = datetime.fromisoformat(expires_at)
-        if expires_at.tzinfo is None:
-            expires_at = expires_at.replace(tzinfo=timezone.utc)
-        
-        if datetime.now(timezone.utc) >= expires_at and creds.refresh_token:
+
+# The refresh currently in flight in this process, awaited by every concurrent caller
+_google_token_refresh: Optional[asyncio.Task] = None
+
+async def _refresh_google_creds() -> Optional[Credentials]:
+    """Refresh the shared access token under the cross-worker lease, or wait for whoever holds it"""
+    deadline = time.monotonic() + GOOGLE_TOKEN_REFRESH_LEASE_SECONDS
+    while True:
+        if await acquire_lease("google_token_refresh", GOOGLE_TOKEN_REFRESH_LEASE_SECONDS):
+            settings = None
             try:
-                creds.refresh(GoogleRequest())
+                # Another worker may have refreshed while we were waiting for the lease
+                settings_cache.invalidate()
+                settings = await settings_cache.get()
+                if not google_token_needs_refresh(settings):
+                    return settings.credentials if google_token_usable(settings) else None
+                
+                # Refresh a copy, the snapshot's credentials are shared with every request holding it
+                creds = settings.new_credentials()
+                await run_google_call(creds.refresh, GoogleRequest())
+                expires_at = creds.expiry.replace(tzinfo=timezone.utc) if creds.expiry else datetime.now(timezone.utc) + timedelta(hours=1)
                 # Update tokens in DB
                 await db.settings.update_one(
                     {"settings_id": "app_settings"},
-                    {"$set": {
-                        "google_tokens.access_token": creds.token,
-                        "google_tokens.expires_at": (datetime.now(timezone.utc) + timedelta(hours=1)).isoformat()
-                    }}
+                    {
+                        "$set": {
+                            "google_tokens.access_token": creds.token,
+                            "google_tokens.expires_at": expires_at.isoformat()
+                        },
+                        "$unset": {"google_tokens.refresh_retry_at": ""},
+                        "$inc": {"version": 1}
+                    }
                 )
+                logger.info(f"Google access token refreshed, valid until {expires_at.isoformat()}")
             except Exception as e:
                 logger.error(f"Failed to refresh token: {e}")
-                return None
+                await backoff_google_token_refresh()
+                return settings.credentials if settings and google_token_usable(settings) else None
+            finally:
+                await release_lease("google_token_refresh")
+            # The reloaded snapshot publishes the new token to this worker, the version bump to the others
+            settings_cache.invalidate()
+            return (await settings_cache.get()).credentials
+        
+        # Someone else holds the lease, pick up their token once it lands
+        await asyncio.sleep(0.5)
+        settings_cache.invalidate()
+        settings = await settings_cache.get()
+        if not google_token_needs_refresh(settings):
+            return settings.credentials if google_token_usable(settings) else None
+        if time.monotonic() >= deadline:
+            logger.warning("Timed out waiting for another worker to refresh the Google token")
+            return settings.credentials if google_token_usable(settings) else None
+
+async def backoff_google_token_refresh():
+    """Record a failed refresh so no worker tries again for GOOGLE_TOKEN_REFRESH_BACKOFF_SECONDS"""
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=GOOGLE_TOKEN_REFRESH_BACKOFF_SECONDS)
+    try:
+        await db.settings.update_one(
+            {"settings_id": "app_settings", "google_tokens": {"$type": "object"}},
+            {"$set": {"google_tokens.refresh_retry_at": retry_at.isoformat()}, "$inc": {"version": 1}}
+        )
+    except Exception as e:
+        logger.error(f"Failed to record the Google token refresh backoff: {e}")
+    settings_cache.invalidate()
+
+async def get_google_creds():
+    """Get Google credentials from the cached settings for sending emails/calendar"""
+    global _google_token_refresh
+    settings = await settings_cache.get()
+    if not settings.credentials:
+        return None
+    
+    # Refresh proactively a few minutes before expiry rather than after a failed call
+    if not google_token_needs_refresh(settings):
+        return settings.credentials if google_token_usable(settings) else None
     
-    return creds
+    if _google_token_refresh is None or _google_token_refresh.done():
+        _google_token_refresh = asyncio.create_task(_refresh_google_creds())
+    # Shield so a cancelled caller does not abort the refresh the others are waiting on
+    return await asyncio.shield(_google_token_refresh)
 
-async def send_email_notification(to_email: str, subject: str, body: str):
-    """Send email notification via Gmail API"""
-    settings = await db.settings.find_one({"settings_id": "app_settings"}, {"_id": 0})
-    if not settings or not settings.get("email_notifications_enabled", True):
+async def deliver_email_notification(to_email: Union[str, List[str]], subject: str, body: str) -> bool:
+    """Send an email via Gmail API, returns False when notifications are disabled or Google is not connected
+    and raises on failure"""
+    settings = await settings_cache.get()
+    if not settings.exists or not settings.get("email_notifications_enabled", True):
+        return False
+    if not settings.credentials:
         return False
     
     creds = await get_google_creds()
     if not creds:
-        logger.warning("No Google credentials configured for email")
-        return False
+        # Connected, but the token could not be refreshed: worth retrying once it can
+        raise RuntimeError("Google access token expired and could not be refreshed")
     
-    try:
-        service = build('gmail', 'v1', credentials=creds)
-        message = MIMEMultipart()
-        message['to'] = to_email
-        message['subject'] = subject
-        message.attach(MIMEText(body, 'html'))
-        
-        raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
-        service.users().messages().send(userId='me', body={'raw': raw}).execute()
-        logger.info(f"Email sent to {to_email}")
-        return True
-    except Exception as e:
-        logger.error(f"Failed to send email: {e}")
-        return False
+    if isinstance(to_email, list):
+        to_email = ", ".join(to_email)
+    message = MIMEMultipart()
+    message['to'] = to_email
+    message['subject'] = subject
+    message.attach(MIMEText(body, 'html'))
+    raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
+    
+    def send():
+        service = get_google_service('gmail', 'v1', creds)
+        return service.users().messages().send(userId='me', body={'raw': raw}).execute()
+    
+    await run_google_call(send)
+    logger.info(f"Email sent to {to_email}")
+    return True
 
 async def create_calendar_event(summary: str, start_date: str, end_date: str, description: str = ""):
     """Create a calendar event for approved holidays"""
-    settings = await db.settings.find_one({"settings_id": "app_settings"}, {"_id": 0})
-    if not settings or not settings.get("calendar_sync_enabled", True):
+    settings = await settings_cache.get()
+    if not settings.exists or not settings.get("calendar_sync_enabled", True):
         return None
     
     creds = await get_google_creds()
@@ -284,15 +1145,19 @@ async def create_calendar_event(summary: str, start_date: str, end_date: str, de
         logger.warning("No Google credentials configured for calendar")
         return None
     
+    event = {
+        'summary': summary,
+        'description': description,
+        'start': {'date': start_date},
+        'end': {'date': end_date},
+    }
+    
+    def insert():
+        service = get_google_service('calendar', 'v3', creds)
+        return service.events().insert(calendarId='primary', body=event).execute()
+    
     try:
-        service = build('calendar', 'v3', credentials=creds)
-        event = {
-            'summary': summary,
-            'description': description,
-            'start': {'date': start_date},
-            'end': {'date': end_date},
-        }
-        result = service.events().insert(calendarId='primary', body=event).execute()
+        result = await run_google_call(insert)
         logger.info(f"Calendar event created: {result.get('id')}")
         return result.get('id')
     except Exception as e:
@@ -305,14 +1170,1028 @@ async def delete_calendar_event(event_id: str):
     if not creds or not event_id:
         return False
     
+    def delete():
+        service = get_google_service('calendar', 'v3', creds)
+        return service.events().delete(calendarId='primary', eventId=event_id).execute()
+    
     try:
-        service = build('calendar', 'v3', credentials=creds)
-        service.events().delete(calendarId='primary', eventId=event_id).execute()
+        await run_google_call(delete)
         return True
     except Exception as e:
         logger.error(f"Failed to delete calendar event: {e}")
         return False
 
+# ==================== WORKING DAYS ====================
+
+# Public holiday dates per calendar year, dropped when HR adds or removes a holiday in that year
+holiday_calendar_cache = TTLCache(16, HOLIDAY_CALENDAR_CACHE_TTL_SECONDS)
+
+async def get_holiday_dates(year: int) -> np.ndarray:
+    """Public holidays falling in a year as a sorted datetime64[D] array"""
+    holidays = holiday_calendar_cache.get(year)
+    if holidays is None:
+        docs = await db.public_holidays.find(
+            {"date": {"$gte": f"{year}-01-01", "$lte": f"{year}-12-31"}}, {"_id": 0, "date": 1}
+        ).to_list(None)
+        holidays = np.unique(np.array([doc["date"][:10] for doc in docs], dtype="datetime64[D]"))
+        holiday_calendar_cache.set(year, holidays)
+    return holidays
+
+async def get_busday_calendar(first: np.datetime64, last: np.datetime64) -> np.busdaycalendar:
+    """Monday to Friday calendar with the public holidays of every year between first and last"""
+    years = range(first.astype(object).year, last.astype(object).year + 1)
+    holidays = [await get_holiday_dates(year) for year in years]
+    return np.busdaycalendar(weekmask="1111100", holidays=np.concatenate(holidays))
+
+def parse_date_range(start_date: str, end_date: str) -> tuple:
+    try:
+        start = np.datetime64(start_date[:10], "D")
+        end = np.datetime64(end_date[:10], "D")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be ISO dates (YYYY-MM-DD)")
+    if end < start:
+        raise HTTPException(status_code=400, detail="End date must be on or after start date")
+    return start, end
+
+async def count_working_days_many(starts, ends, start_half_days, end_half_days) -> np.ndarray:
+    """Working days for many inclusive date ranges at once, half days count as 0.5"""
+    starts = np.asarray(starts, dtype="datetime64[D]")
+    ends = np.asarray(ends, dtype="datetime64[D]")
+    if not len(starts):
+        return np.zeros(0)
+    start_half_days = np.asarray(start_half_days, dtype=bool)
+    end_half_days = np.asarray(end_half_days, dtype=bool)
+    
+    calendar = await get_busday_calendar(starts.min(), ends.max())
+    days = np.busday_count(starts, ends + 1, busdaycal=calendar).astype(float)
+    # A single-day request with either half flag is half a day, not zero
+    single_day = starts == ends
+    days -= 0.5 * ((start_half_days | (end_half_days & single_day)) & np.is_busday(starts, busdaycal=calendar))
+    days -= 0.5 * (end_half_days & ~single_day & np.is_busday(ends, busdaycal=calendar))
+    return np.maximum(days, 0.0)
+
+async def count_working_days(start_date: str, end_date: str, start_half_day: bool = False, end_half_day: bool = False) -> float:
+    """Working days between two ISO dates inclusive, excluding weekends and public holidays"""
+    start, end = parse_date_range(start_date, end_date)
+    days = await count_working_days_many([start], [end], [start_half_day], [end_half_day])
+    return float(days[0])
+
+# ==================== ABSENCE INTERVALS ====================
+
+# Requests that hold the dates they cover
+ABSENCE_STATUSES = ["pending", "approved"]
+
+def overlap_filter(start_date: str, end_date: str) -> dict:
+    """Filter for requests whose inclusive [start_date, end_date] intersects the given range.
+    
+    No request spans more than MAX_REQUEST_SPAN_DAYS, so start_date also gets a lower bound and the
+    query stays a bounded range scan on the (…, start_date, end_date) indexes.
+    """
+    earliest = (date.fromisoformat(start_date[:10]) - timedelta(days=MAX_REQUEST_SPAN_DAYS)).isoformat()
+    return {"start_date": {"$gte": earliest, "$lte": end_date}, "end_date": {"$gte": start_date}}
+
+async def find_overlapping_request(user_id: str, start_date: str, end_date: str,
+                                   exclude_request_id: Optional[str] = None) -> Optional[dict]:
+    """A pending or approved request of this user, other than exclude_request_id, that shares at least one day with the range"""
+    query = {"user_id": user_id, "status": {"$in": ABSENCE_STATUSES}, **overlap_filter(start_date, end_date)}
+    if exclude_request_id:
+        query["request_id"] = {"$ne": exclude_request_id}
+    return await db.holiday_requests.find_one(query, {"_id": 0, "request_id": 1, "start_date": 1, "end_date": 1, "status": 1})
+
+# ==================== CONDITIONAL GET ====================
+
+# change_counters holds one document per data set ({_id, seq, changed_at}), bumped on every write to it.
+# Read endpoints derive their ETag from the counters they depend on instead of from the response body.
+
+async def bump_change_counter(name: str):
+    await db.change_counters.update_one(
+        {"_id": name},
+        {"$inc": {"seq": 1}, "$set": {"changed_at": datetime.now(timezone.utc).isoformat()}},
+        upsert=True
+    )
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # Weak comparison, the ETags are weak since compression changes the bytes but not the content
+    return any(tag.removeprefix("W/") == etag.removeprefix("W/") for tag in candidates)
+
+def not_modified_since(if_modified_since: str, last_modified: datetime) -> bool:
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    return since is not None and last_modified.replace(microsecond=0) <= since
+
+async def conditional_get(request: Request, response: Response, counters: List[str]) -> Optional[Response]:
+    """Validate the client's cached copy against change counters.
+    
+    Returns a 304 response to send as-is when the copy is current, otherwise sets ETag and
+    Last-Modified on response and returns None so the route builds the body.
+    """
+    docs = await db.change_counters.find({"_id": {"$in": counters}}).to_list(None)
+    seqs = {doc["_id"]: doc.get("seq", 0) for doc in docs}
+    changed = [datetime.fromisoformat(doc["changed_at"]) for doc in docs if doc.get("changed_at")]
+    
+    # Same counters and same URL means same body
+    fingerprint = f"{request.url.path}?{request.url.query}|" + ",".join(f"{name}:{seqs.get(name, 0)}" for name in counters)
+    headers = {
+        "ETag": f'W/"{hashlib.sha1(fingerprint.encode()).hexdigest()[:20]}"',
+        "Cache-Control": "private, no-cache"
+    }
+    if changed:
+        headers["Last-Modified"] = format_datetime(max(changed), usegmt=True)
+    
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        current = etag_matches(if_none_match, headers["ETag"])
+    else:
+        if_modified_since = request.headers.get("if-modified-since")
+        current = bool(if_modified_since and changed and not_modified_since(if_modified_since, max(changed)))
+    if current:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+# ==================== CALENDAR BUCKETS ====================
+
+# calendar_buckets holds the ready-made events of one month per document (_id "YYYY-MM").
+# Writers patch the buckets a change touches and bump seq; a bucket is (re)built from the source
+# collections on a miss and only stored if no write landed on it while it was being built.
+
+def month_bounds(month: str) -> tuple:
+    """First and last ISO day of a "YYYY-MM" month"""
+    year, month_number = int(month[:4]), int(month[5:7])
+    first = date(year, month_number, 1)
+    next_first = date(year + 1, 1, 1) if month_number == 12 else date(year, month_number + 1, 1)
+    return first.isoformat(), (next_first - timedelta(days=1)).isoformat()
+
+def months_between(start_date: str, end_date: str) -> List[str]:
+    """Every "YYYY-MM" month touched by an inclusive date range"""
+    year, month_number = int(start_date[:4]), int(start_date[5:7])
+    last = (int(end_date[:4]), int(end_date[5:7]))
+    months = []
+    while (year, month_number) <= last:
+        months.append(f"{year}-{month_number:02d}")
+        year, month_number = (year + 1, 1) if month_number == 12 else (year, month_number + 1)
+    return months
+
+def request_calendar_event(req: dict, categories: CategorySnapshot) -> dict:
+    category = req.get("category", "paid_holiday")
+    return {
+        "id": req["request_id"],
+        "title": f"{req['user_name']} - {categories.name(category)}",
+        "start": req["start_date"],
+        "end": req["end_date"],
+        "type": "holiday",
+        "category": category,
+        "user_id": req["user_id"],
+        "user_name": req["user_name"]
+    }
+
+def public_holiday_calendar_event(holiday: dict) -> dict:
+    return {
+        "id": holiday["holiday_id"],
+        "title": holiday["name"],
+        "start": holiday["date"],
+        "end": holiday["date"],
+        "type": "public_holiday"
+    }
+
+async def build_calendar_bucket(month: str) -> List[dict]:
+    """Compute a month's events from the source collections and store them unless a write raced us"""
+    bucket = await db.calendar_buckets.find_one_and_update(
+        {"_id": month},
+        {"$setOnInsert": {"events": [], "seq": 0, "building": True}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    first, last = month_bounds(month)
+    holidays = await db.holiday_requests.find(
+        {"status": "approved", **overlap_filter(first, last)},
+        {"_id": 0, "request_id": 1, "user_id": 1, "user_name": 1, "category": 1, "start_date": 1, "end_date": 1}
+    ).to_list(None)
+    public_holidays = await db.public_holidays.find(
+        {"date": {"$gte": first, "$lte": last}}, {"_id": 0, "holiday_id": 1, "name": 1, "date": 1}
+    ).to_list(None)
+    categories = await category_registry.get()
+    events = [request_calendar_event(h, categories) for h in holidays] + [public_holiday_calendar_event(ph) for ph in public_holidays]
+    
+    await db.calendar_buckets.update_one(
+        {"_id": month, "seq": bucket["seq"]},
+        {"$set": {"events": events, "building": False, "built_at": datetime.now(timezone.utc).isoformat()}}
+    )
+    return events
+
+async def get_calendar_buckets(months: List[str]) -> dict:
+    """Events per month for several months, read in one query and built where missing or stale"""
+    buckets = await db.calendar_buckets.find({"_id": {"$in": months}}).to_list(None)
+    now = datetime.now(timezone.utc)
+    events = {}
+    for bucket in buckets:
+        if bucket.get("building"):
+            continue
+        if (now - datetime.fromisoformat(bucket["built_at"])).total_seconds() < CALENDAR_BUCKET_MAX_AGE_SECONDS:
+            events[bucket["_id"]] = bucket["events"]
+    for month in months:
+        if month not in events:
+            events[month] = await build_calendar_bucket(month)
+    return events
+
+async def get_calendar_bucket(month: str) -> List[dict]:
+    return (await get_calendar_buckets([month]))[month]
+
+async def add_to_calendar_buckets(events: List[dict]):
+    """Append events to the already built buckets of every month they touch.
+    
+    A build that read the request after its status write but stored the bucket before this push already has the
+    event, so the push skips buckets holding its id.
+    """
+    operations = [
+        UpdateOne({"_id": month, "events.id": {"$ne": event["id"]}}, {"$push": {"events": event}, "$inc": {"seq": 1}})
+        for event in events
+        for month in months_between(event["start"], event["end"])
+    ]
+    if operations:
+        await db.calendar_buckets.bulk_write(operations, ordered=False)
+        await bump_change_counter("calendar")
+
+async def remove_from_calendar_buckets(**match):
+    """Drop the events matching every field in match from the buckets holding them"""
+    await db.calendar_buckets.update_many(
+        {"events": {"$elemMatch": match}},
+        {"$pull": {"events": match}, "$inc": {"seq": 1}}
+    )
+    await bump_change_counter("calendar")
+
+# ==================== CREDIT ACCOUNTS ====================
+
+# Fields of a credit row that live on the account document rather than on one of its balances
+CREDIT_ACCOUNT_FIELDS = ["user_id", "user_email", "user_name", "year"]
+
+# Set once every legacy per-category credit document has been folded into an account, or kept as a conflict
+credit_layout_migrated = False
+# Legacy documents the migration kept, read alongside the accounts until HR has reconciled them
+legacy_credit_conflicts = 0
+
+def legacy_credits_remain() -> bool:
+    """Whether credit reads still have to look at the legacy collection"""
+    return not credit_layout_migrated or legacy_credit_conflicts > 0
+
+def default_credit_expiry(category: str, year: int) -> Optional[str]:
+    """Paid holidays of year N expire after July 31 of year N+1, other categories only on a date HR sets"""
+    return f"{year + 1}-07-31" if category == "paid_holiday" else None
+
+def new_credit_balance(category: str, total_days: float, expires_at: Optional[str] = None) -> dict:
+    now = datetime.now(timezone.utc).isoformat()
+    return {
+        "credit_id": f"cred_{uuid.uuid4().hex[:12]}",
+        "category": category,
+        "total_days": total_days,
+        "used_days": 0.0,
+        "remaining_days": total_days,
+        "reserved_days": 0.0,
+        "available_days": total_days,
+        "expires_at": expires_at,
+        "created_at": now,
+        "updated_at": now
+    }
+
+def new_credit_account(user_id: str, user_email: str, user_name: str, year: int, default_credits: dict) -> dict:
+    """An account holding a fresh balance for every category in default_credits"""
+    now = datetime.now(timezone.utc).isoformat()
+    return {
+        "account_id": f"acct_{uuid.uuid4().hex[:12]}",
+        "user_id": user_id,
+        "user_email": user_email,
+        "user_name": user_name,
+        "year": year,
+        "balances": [
+            new_credit_balance(category, days, default_credit_expiry(category, year)) for category, days in default_credits.items()
+        ],
+        "created_at": now,
+        "updated_at": now
+    }
+
+def credit_account_upsert(user_id: str, user_email: str, user_name: str, year: int, default_credits: dict) -> UpdateOne:
+    """Create the (user, year) account with default credits unless it exists, e.g. made by the provisioning job"""
+    account = new_credit_account(user_id, user_email, user_name, year, default_credits)
+    del account["user_id"], account["year"]
+    return UpdateOne({"user_id": user_id, "year": year}, {"$setOnInsert": account}, upsert=True)
+
+def balance_filter(user_id: str, year: int, category: str, **conditions) -> dict:
+    """Match the account holding a category balance, with conditions on that same balance, for balances.$ updates"""
+    return {"user_id": user_id, "year": year, "balances": {"$elemMatch": {"category": category, **conditions}}}
+
+def balance_update(inc: Optional[dict] = None, set_fields: Optional[dict] = None, decision_batch: Optional[str] = None) -> dict:
+    """$inc/$set of fields of the balance matched by balance_filter, recording decision_batch when given"""
+    now = datetime.now(timezone.utc).isoformat()
+    update = {"$set": {"updated_at": now, "balances.$.updated_at": now,
+                       **{f"balances.$.{field}": value for field, value in (set_fields or {}).items()}}}
+    if inc:
+        update["$inc"] = {f"balances.$.{field}": value for field, value in inc.items()}
+    if decision_batch:
+        # A set rather than a field, a concurrent batch must not hide that this one landed
+        update["$addToSet"] = {"balances.$.decision_batches": decision_batch}
+    return update
+
+def add_balance_operation(account: dict, balance: dict) -> UpdateOne:
+    """Upsert adding balance to the (user, year) account, a no-op when the category is already there"""
+    return UpdateOne(
+        {"user_id": account["user_id"], "year": account["year"], "balances.category": {"$ne": balance["category"]}},
+        {
+            "$push": {"balances": balance},
+            "$set": {"updated_at": datetime.now(timezone.utc).isoformat()},
+            "$setOnInsert": {
+                "account_id": f"acct_{uuid.uuid4().hex[:12]}",
+                "user_email": account["user_email"],
+                "user_name": account["user_name"],
+                "created_at": balance.get("created_at") or datetime.now(timezone.utc).isoformat()
+            }
+        },
+        upsert=True
+    )
+
+async def add_credit_balances(operations: List[UpdateOne]):
+    """Apply add_balance_operation upserts.
+    
+    The $ne filter turns an already present category into an insert that fails on the unique (user_id, year) index.
+    The same error comes from two workers creating one account at once, so the failed ones are retried once: by then
+    the account exists and a duplicate key really means the category was already there. Those are left to the
+    caller, which can tell from the account whether its balance landed.
+    """
+    for attempt in range(2):
+        if not operations:
+            return
+        try:
+            await db.credit_accounts.bulk_write(operations, ordered=False)
+            return
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(error.get("code") != 11000 for error in errors):
+                raise
+            operations = [operations[error["index"]] for error in errors]
+
+# Bookkeeping kept on a balance while a bulk decision runs, never part of a credit row
+CREDIT_BALANCE_INTERNAL_FIELDS = {"decision_batches"}
+
+def credit_rows(account: dict) -> List[dict]:
+    """Flatten an account into one row per category, the shape of the API and of the legacy documents"""
+    header = {field: account[field] for field in CREDIT_ACCOUNT_FIELDS if field in account}
+    balances = sorted(account.get("balances", []), key=lambda b: b.get("category", ""))
+    return [
+        {**({"credit_id": b["credit_id"]} if "credit_id" in b else {}), **header,
+         **{field: value for field, value in b.items() if field not in CREDIT_BALANCE_INTERNAL_FIELDS}}
+        for b in balances
+    ]
+
+def credit_account_projection(projection: dict) -> dict:
+    """Map a projection over credit rows onto the account documents the rows are flattened from"""
+    fields = [field for field in projection if field != "_id"]
+    if not fields:
+        return projection
+    # The category is what makes a balance a row, without it every row would vanish from a sparse listing
+    mapped = {"_id": 0, "balances.category": 1}
+    for field in fields:
+        mapped[field if field in CREDIT_ACCOUNT_FIELDS else f"balances.{field}"] = 1
+    return mapped
+
+def legacy_credit_balance(doc: dict) -> dict:
+    """A legacy per-category credit document as an account balance"""
+    now = datetime.now(timezone.utc).isoformat()
+    remaining = doc.get("remaining_days", 0.0)
+    reserved = doc.get("reserved_days", 0.0)
+    return {
+        "credit_id": doc.get("credit_id") or f"cred_{uuid.uuid4().hex[:12]}",
+        "category": doc.get("category", "paid_holiday"),
+        "total_days": doc.get("total_days", 0.0),
+        "used_days": doc.get("used_days", 0.0),
+        "remaining_days": remaining,
+        "reserved_days": reserved,
+        "available_days": remaining - reserved,
+        "expires_at": doc.get("expires_at"),
+        "created_at": doc.get("created_at") or now,
+        "updated_at": doc.get("updated_at") or now
+    }
+
+async def migrate_legacy_credits(query: dict, retry_conflicts: bool = False) -> int:
+    """Fold the legacy per-category credit documents matching query into accounts, returns how many moved.
+    
+    Every credit write calls this for the user-years it touches, so balances are only ever written in the account
+    layout; once the background migration has finished it is a no-op. Safe to run concurrently: a document that
+    two callers both fold lands once, and deleting an already deleted document does nothing.
+    
+    A legacy document is only deleted once its balance is on the account. When the account already has the
+    category, a balance nothing has used or reserved yet (fresh defaults) is replaced by the legacy one; any other
+    conflict keeps the legacy document, marked migration_conflict and logged for HR to reconcile. Marked documents
+    are skipped unless retry_conflicts is set, which only the startup migration does.
+    """
+    if credit_layout_migrated:
+        return 0
+    if not retry_conflicts:
+        query = {"$and": [query, {"migration_conflict": {"$ne": True}}]} if query else {"migration_conflict": {"$ne": True}}
+    moved = 0
+    last_id = None
+    while True:
+        batch_query = query if last_id is None else {"$and": [query, {"_id": {"$gt": last_id}}]}
+        docs = await db.holiday_credits.find(batch_query).sort("_id", 1).limit(CREDIT_MIGRATION_BATCH_SIZE).to_list(None)
+        if not docs:
+            return moved
+        last_id = docs[-1]["_id"]
+        balances = {doc["_id"]: legacy_credit_balance(doc) for doc in docs}
+        await add_credit_balances([add_balance_operation(doc, balances[doc["_id"]]) for doc in docs])
+        
+        landed = await landed_credit_ids(docs)
+        conflicts = [doc for doc in docs if balances[doc["_id"]]["credit_id"] not in landed]
+        if conflicts:
+            await db.credit_accounts.bulk_write([
+                UpdateOne(
+                    balance_filter(doc["user_id"], doc["year"], balances[doc["_id"]]["category"], used_days=0, reserved_days=0),
+                    {"$set": {"balances.$": balances[doc["_id"]], "updated_at": datetime.now(timezone.utc).isoformat()}}
+                )
+                for doc in conflicts
+            ], ordered=False)
+            landed = await landed_credit_ids(docs)
+        
+        folded = [doc["_id"] for doc in docs if balances[doc["_id"]]["credit_id"] in landed]
+        kept = [doc for doc in docs if doc["_id"] not in folded]
+        for doc in kept:
+            logger.warning(
+                f"Legacy credit {doc.get('credit_id')} ({doc['user_id']}, {doc['year']}, {doc.get('category')}) kept: "
+                f"the account already has a used balance for that category"
+            )
+        if kept:
+            await db.holiday_credits.update_many(
+                {"_id": {"$in": [doc["_id"] for doc in kept]}}, {"$set": {"migration_conflict": True}}
+            )
+        if folded:
+            await db.holiday_credits.delete_many({"_id": {"$in": folded}})
+        moved += len(folded)
+
+async def landed_credit_ids(docs: List[dict]) -> set:
+    """credit_ids present on the accounts of the user-years of docs"""
+    accounts = await db.credit_accounts.find(
+        {"$or": [{"user_id": u, "year": y} for u, y in {(doc["user_id"], doc["year"]) for doc in docs}]},
+        {"_id": 0, "balances.credit_id": 1}
+    ).to_list(None)
+    return {balance.get("credit_id") for account in accounts for balance in account.get("balances", [])}
+
+async def find_credit_rows(query: dict) -> List[dict]:
+    """Credit rows of the accounts matching a user_id/year query, newest year first.
+    
+    Until the migration has finished, balances still in the legacy layout are read from there too.
+    """
+    accounts = await db.credit_accounts.find(query, {"_id": 0}).sort("year", -1).to_list(None)
+    rows = [row for account in accounts for row in credit_rows(account)]
+    if legacy_credits_remain():
+        rows.extend(await legacy_credit_rows(query))
+        rows.sort(key=lambda row: (-row["year"], row["category"]))
+    return rows
+
+async def legacy_credit_rows(query: dict) -> List[dict]:
+    """Rows of the legacy credit documents matching query that are not on an account yet, and of kept conflicts"""
+    docs = await db.holiday_credits.find(query, {"_id": 0}).to_list(None)
+    if not docs:
+        return []
+    accounts = await db.credit_accounts.find(
+        {"$or": [{"user_id": u, "year": y} for u, y in {(doc["user_id"], doc["year"]) for doc in docs}]},
+        {"_id": 0, "user_id": 1, "year": 1, "balances.category": 1}
+    ).to_list(None)
+    on_accounts = {(a["user_id"], a["year"], b["category"]) for a in accounts for b in a.get("balances", [])}
+    return [
+        {**doc, **legacy_credit_balance(doc)} for doc in docs
+        if doc.get("migration_conflict") or (doc["user_id"], doc["year"], doc.get("category", "paid_holiday")) not in on_accounts
+    ]
+
+async def find_credit_balance(user_id: str, year: int, category: str) -> Optional[dict]:
+    """The row of one category balance, or None when the user has no credit for it that year"""
+    await migrate_legacy_credits({"user_id": user_id, "year": year})
+    account = await db.credit_accounts.find_one(
+        {"user_id": user_id, "year": year},
+        {"_id": 0, **{field: 1 for field in CREDIT_ACCOUNT_FIELDS}, "balances": {"$elemMatch": {"category": category}}}
+    )
+    if not account or not account.get("balances"):
+        return None
+    return credit_rows(account)[0]
+
+async def update_credit_balance(user_id: str, year: int, category: str, compute: Callable) -> Optional[tuple]:
+    """Read-modify-write of one balance for HR edits, returns (row before, fields set) or None without such a credit.
+    
+    compute(row) returns the balance fields to set and may raise to refuse the edit. The write only lands if the
+    balance still has the amounts it was computed from, otherwise it is recomputed from a fresh read.
+    """
+    for _ in range(CREDIT_UPDATE_ATTEMPTS):
+        row = await find_credit_balance(user_id, year, category)
+        if row is None:
+            return None
+        changes = compute(row)
+        unchanged = {field: row.get(field, 0.0) for field in ("total_days", "used_days", "remaining_days", "reserved_days")}
+        result = await db.credit_accounts.update_one(
+            balance_filter(user_id, year, category, **unchanged), balance_update(set_fields=changes)
+        )
+        if result.matched_count:
+            return row, changes
+    raise HTTPException(status_code=409, detail="The credit changed while it was being updated, please try again")
+
+async def migrate_credit_layout():
+    """Fold every legacy credit document into accounts in the background, once per database.
+    
+    One worker holds the lease and does the fold, the others keep folding on demand and poll job_state until it
+    has finished. Documents kept as conflicts are retried on every start.
+    """
+    global credit_layout_migrated, legacy_credit_conflicts
+    try:
+        while True:
+            state = await db.job_state.find_one({"_id": "credit_accounts_migration"})
+            if state and state.get("status") == "done":
+                credit_layout_migrated, legacy_credit_conflicts = True, 0
+                return
+            if await acquire_lease("credit_accounts_migration", CREDIT_MIGRATION_LEASE_SECONDS):
+                try:
+                    started = time.monotonic()
+                    moved = await migrate_legacy_credits({}, retry_conflicts=True)
+                    # Conflicting documents stay behind, and with them the compatibility reads, until they are reconciled
+                    kept = await db.holiday_credits.count_documents({})
+                    await db.job_state.update_one(
+                        {"_id": "credit_accounts_migration"},
+                        {"$set": {
+                            "status": "conflicts" if kept else "done", "migrated": moved, "kept": kept,
+                            "finished_at": datetime.now(timezone.utc).isoformat()
+                        }},
+                        upsert=True
+                    )
+                    credit_layout_migrated, legacy_credit_conflicts = True, kept
+                    logger.info(f"Credit account migration: {moved} legacy credit(s) folded, {kept} kept, in {time.monotonic() - started:.1f}s")
+                    return
+                finally:
+                    await release_lease("credit_accounts_migration")
+            if state and state.get("status") == "conflicts":
+                # Finished before, another worker is retrying the conflicts
+                credit_layout_migrated, legacy_credit_conflicts = True, state.get("kept", 0)
+                return
+            await asyncio.sleep(CREDIT_MIGRATION_POLL_SECONDS)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Credit account migration failed, will resume on next start: {e}")
+
+# ==================== CREDIT LEDGER ====================
+
+# Set on startup: multi-document transactions need a replica set or sharded cluster
+mongo_supports_transactions = False
+
+async def detect_transaction_support() -> bool:
+    try:
+        hello = await client.admin.command("hello")
+    except Exception as e:
+        logger.warning(f"Could not determine MongoDB topology, transactions disabled: {e}")
+        return False
+    return bool(hello.get("setName")) or hello.get("msg") == "isdbgrid"
+
+async def run_atomically(operation: Callable):
+    """Run operation(session) inside a transaction when the deployment supports it, else with session=None.
+    
+    with_transaction reruns operation on TransientTransactionError (e.g. a WriteConflict with a concurrent decision)
+    and retries an UnknownTransactionCommitResult commit, so operation must be safe to rerun from the start. Its own
+    exceptions, HTTPException included, abort the transaction and propagate unchanged.
+    """
+    if not mongo_supports_transactions:
+        return await operation(None)
+    async with await client.start_session() as session:
+        return await session.with_transaction(operation)
+
+async def reserve_credit(user_id: str, year: int, category: str, days: float, session=None) -> bool:
+    """Hold days for a pending request, only if remaining minus already reserved covers them"""
+    await migrate_legacy_credits({"user_id": user_id, "year": year})
+    result = await db.credit_accounts.update_one(
+        balance_filter(user_id, year, category, available_days={"$gte": days}),
+        balance_update(inc={"reserved_days": days, "available_days": -days}),
+        session=session
+    )
+    return result.matched_count == 1
+
+async def release_credit(user_id: str, year: int, category: str, days: float, session=None):
+    """Give back days held by a pending request that was rejected or cancelled"""
+    if not days:
+        return
+    await migrate_legacy_credits({"user_id": user_id, "year": year})
+    await db.credit_accounts.update_one(
+        balance_filter(user_id, year, category),
+        balance_update(inc={"reserved_days": -days, "available_days": days}),
+        session=session
+    )
+
+async def debit_credit(user_id: str, year: int, category: str, days: float, reserved: float = 0.0, session=None) -> bool:
+    """Move days from remaining to used and drop their reservation, only if the balance covers them"""
+    await migrate_legacy_credits({"user_id": user_id, "year": year})
+    result = await db.credit_accounts.update_one(
+        balance_filter(user_id, year, category, remaining_days={"$gte": days}),
+        balance_update(inc={"used_days": days, "remaining_days": -days, "reserved_days": -reserved, "available_days": reserved - days}),
+        session=session
+    )
+    return result.matched_count == 1
+
+async def release_request_reservation(req: dict, session=None):
+    """Release whatever a request still holds on its credit"""
+    await release_credit(
+        req["user_id"],
+        req.get("credit_year") or datetime.now().year,
+        req.get("category", "paid_holiday"),
+        req.get("reserved_days", 0.0),
+        session=session
+    )
+
+async def revert_to_pending(request_ids: List[str], processed_at: str, status: str = "approved"):
+    """Undo a decision (an approval unless status says otherwise) we made at processed_at when the credit side of it failed"""
+    await db.holiday_requests.update_many(
+        {"request_id": {"$in": request_ids}, "status": status, "processed_at": processed_at},
+        {
+            "$set": {"status": "pending"},
+            "$unset": {"hr_comment": "", "processed_by": "", "processed_at": "", "decision_batch": ""}
+        }
+    )
+
+# ==================== NOTIFICATION OUTBOX ====================
+
+# Long-running workers and schedulers, started on startup and cancelled on shutdown
+background_tasks: List[asyncio.Task] = []
+
+# Set whenever an entry is queued so idle workers pick it up without waiting for the next poll
+outbox_wakeup = asyncio.Event()
+
+async def queue_email_notification(to_email: Union[str, List[str]], subject: str, body: str):
+    """Write an email to the notification outbox, delivery happens in the background workers"""
+    outbox_ids = await queue_email_notifications([(to_email, subject, body)])
+    return outbox_ids[0]
+
+async def queue_email_notifications(messages: List[tuple]) -> List[str]:
+    """Write many (to_email, subject, body) messages to the outbox in one insert"""
+    if not messages:
+        return []
+    now = datetime.now(timezone.utc).isoformat()
+    docs = []
+    for to_email, subject, body in messages:
+        doc = NotificationOutboxEntry(to_email=to_email, subject=subject, body=body, next_attempt_at=now).model_dump()
+        doc["created_at"] = doc["created_at"].isoformat()
+        docs.append(doc)
+    await db.notification_outbox.insert_many(docs)
+    outbox_wakeup.set()
+    return [doc["outbox_id"] for doc in docs]
+
+async def claim_outbox_entry() -> Optional[dict]:
+    """Atomically claim the next due entry, including ones abandoned by a crashed worker"""
+    now = datetime.now(timezone.utc)
+    return await db.notification_outbox.find_one_and_update(
+        {"$or": [
+            {"status": "pending", "next_attempt_at": {"$lte": now.isoformat()}},
+            {"status": "sending", "claimed_until": {"$lt": now.isoformat()}}
+        ]},
+        {
+            "$set": {
+                "status": "sending",
+                "claimed_until": (now + timedelta(seconds=OUTBOX_CLAIM_TIMEOUT_SECONDS)).isoformat()
+            },
+            "$inc": {"attempts": 1}
+        },
+        projection={"_id": 0},
+        sort=[("next_attempt_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+async def process_outbox_entry(entry: dict):
+    """Deliver one claimed entry and record the outcome, rescheduling or dead-lettering failures"""
+    now = datetime.now(timezone.utc)
+    try:
+        sent = await deliver_email_notification(entry["to_email"], entry["subject"], entry["body"])
+    except Exception as e:
+        attempts = entry["attempts"]
+        if attempts >= OUTBOX_MAX_ATTEMPTS:
+            update = {"status": "dead", "claimed_until": None, "last_error": str(e)}
+            logger.error(f"Email {entry['outbox_id']} to {entry['to_email']} dead-lettered after {attempts} attempts: {e}")
+        else:
+            delay = min(OUTBOX_BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), OUTBOX_BACKOFF_MAX_SECONDS)
+            update = {
+                "status": "pending",
+                "claimed_until": None,
+                "next_attempt_at": (now + timedelta(seconds=delay)).isoformat(),
+                "last_error": str(e)
+            }
+            logger.warning(f"Email {entry['outbox_id']} to {entry['to_email']} failed (attempt {attempts}), retrying in {delay:.0f}s: {e}")
+    else:
+        update = {"status": "sent" if sent else "skipped", "claimed_until": None, "sent_at": now}
+    
+    await db.notification_outbox.update_one({"outbox_id": entry["outbox_id"]}, {"$set": update})
+
+async def outbox_worker(worker_id: int):
+    """Drain the outbox until cancelled, sleeping between polls when there is nothing due"""
+    while True:
+        # Clear before claiming so an entry queued after the claim still wakes us up
+        outbox_wakeup.clear()
+        try:
+            entry = await claim_outbox_entry()
+            if entry:
+                await process_outbox_entry(entry)
+                continue
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Outbox worker {worker_id} error: {e}")
+        
+        try:
+            await asyncio.wait_for(outbox_wakeup.wait(), timeout=OUTBOX_POLL_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+async def create_calendar_events(events: List[dict]) -> List[Optional[str]]:
+    """Create many all-day events with Calendar batch requests, returns event ids in input order"""
+    event_ids: List[Optional[str]] = [None] * len(events)
+    if not events:
+        return event_ids
+    
+    settings = await settings_cache.get()
+    if not settings.exists or not settings.get("calendar_sync_enabled", True):
+        return event_ids
+    
+    creds = await get_google_creds()
+    if not creds:
+        logger.warning("No Google credentials configured for calendar")
+        return event_ids
+    
+    def insert_batch(offset: int, chunk: List[dict]):
+        service = get_google_service('calendar', 'v3', creds)
+        
+        def on_result(request_id, response, exception):
+            if exception is not None:
+                logger.error(f"Failed to create calendar event: {exception}")
+            else:
+                event_ids[offset + int(request_id)] = response.get('id')
+        
+        batch = service.new_batch_http_request(callback=on_result)
+        for i, event in enumerate(chunk):
+            body = {
+                'summary': event['summary'],
+                'description': event.get('description', ''),
+                'start': {'date': event['start_date']},
+                'end': {'date': event['end_date']},
+            }
+            batch.add(service.events().insert(calendarId='primary', body=body), request_id=str(i))
+        batch.execute()
+    
+    for offset in range(0, len(events), GOOGLE_BATCH_SIZE):
+        try:
+            await run_google_call(insert_batch, offset, events[offset:offset + GOOGLE_BATCH_SIZE])
+        except Exception as e:
+            logger.error(f"Failed to create calendar event batch: {e}")
+    logger.info(f"Calendar events created: {sum(1 for event_id in event_ids if event_id)}/{len(events)}")
+    return event_ids
+
+# ==================== HR DIGEST ====================
+
+async def build_hr_digest(since: str) -> Optional[str]:
+    """Summarise requests still pending, highlighting those created after since, or None if nothing is new"""
+    # One aggregation gives both the new requests and the per-category pending totals
+    result = await db.holiday_requests.aggregate([
+        {"$match": {"status": "pending"}},
+        {"$facet": {
+            "new": [
+                {"$match": {"created_at": {"$gt": since}}},
+                {"$sort": {"created_at": 1}},
+                {"$limit": HR_DIGEST_MAX_ITEMS},
+                {"$project": {"_id": 0, "user_name": 1, "category": 1, "start_date": 1, "end_date": 1, "days_count": 1}}
+            ],
+            "new_count": [
+                {"$match": {"created_at": {"$gt": since}}},
+                {"$count": "count"}
+            ],
+            "totals": [
+                {"$group": {"_id": "$category", "count": {"$sum": 1}, "days": {"$sum": "$days_count"}}},
+                {"$sort": {"_id": 1}}
+            ]
+        }}
+    ]).to_list(1)
+    digest = result[0] if result else {}
+    new_requests = digest.get("new", [])
+    if not new_requests:
+        return None
+    
+    new_count = digest["new_count"][0]["count"] if digest.get("new_count") else len(new_requests)
+    categories = await category_registry.get()
+    rows = "".join(
+        f"<tr><td>{r['user_name']}</td><td>{categories.name(r.get('category', 'paid_holiday'))}</td>"
+        f"<td>{r['start_date']} to {r['end_date']}</td><td>{r['days_count']}</td></tr>"
+        for r in new_requests
+    )
+    more = f"<p>...and {new_count - len(new_requests)} more.</p>" if new_count > len(new_requests) else ""
+    totals = "".join(
+        f"<li>{categories.name(t['_id'] or 'paid_holiday')}: {t['count']} request(s), {t['days']} day(s)</li>"
+        for t in digest.get("totals", [])
+    )
+    return f"""
+    <h2>Holiday Requests Digest</h2>
+    <p><strong>{new_count}</strong> new request(s) since the last summary.</p>
+    <table>
+        <tr><th>Employee</th><th>Category</th><th>Dates</th><th>Days</th></tr>
+        {rows}
+    </table>
+    {more}
+    <h3>All Pending Requests</h3>
+    <ul>{totals}</ul>
+    <p>Please review these requests in the Holiday Management System.</p>
+    """
+
+async def run_hr_digest():
+    """Send the HR digest if digest mode is on and the interval has elapsed since the last one"""
+    settings = await settings_cache.get()
+    if not settings.get("hr_digest_enabled", False):
+        return
+    
+    interval = timedelta(minutes=settings.get("hr_digest_interval_minutes", 60))
+    # Only one worker sends each digest
+    if not await acquire_lease("hr_digest", HR_DIGEST_TICK_SECONDS * 2):
+        return
+    
+    now = datetime.now(timezone.utc)
+    state = await db.job_state.find_one({"_id": "hr_digest"}) or {}
+    last_sent_at = state.get("last_sent_at")
+    if last_sent_at is None:
+        # First run after enabling: start accumulating from now on
+        await db.job_state.update_one({"_id": "hr_digest"}, {"$set": {"last_sent_at": now.isoformat()}}, upsert=True)
+        return
+    if now - datetime.fromisoformat(last_sent_at) < interval:
+        return
+    
+    body = await build_hr_digest(last_sent_at)
+    hr_recipients = await get_hr_recipients()
+    if body and hr_recipients:
+        await queue_email_notification(hr_recipients, "Holiday Requests Digest", body)
+        logger.info(f"HR digest queued for {len(hr_recipients)} recipient(s)")
+    await db.job_state.update_one({"_id": "hr_digest"}, {"$set": {"last_sent_at": now.isoformat()}}, upsert=True)
+
+async def hr_digest_scheduler():
+    """Check every HR_DIGEST_TICK_SECONDS whether a digest is due, until cancelled"""
+    while True:
+        try:
+            await run_hr_digest()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"HR digest error: {e}")
+        await asyncio.sleep(HR_DIGEST_TICK_SECONDS)
+
+# ==================== SCHEDULED JOBS ====================
+
+async def checkpoint_job(job_id: str, lease: str, fields: dict):
+    """Record a job's progress and renew its lease, stopping the job if another worker took the lease over"""
+    await db.job_state.update_one(
+        {"_id": job_id}, {"$set": {**fields, "updated_at": datetime.now(timezone.utc).isoformat()}}, upsert=True
+    )
+    if not await acquire_lease(lease, JOB_LEASE_SECONDS):
+        raise RuntimeError(f"Lost the {lease} lease, the job stops at its last checkpoint")
+
+async def provision_credits(year: int) -> dict:
+    """Create the year's credit account, with default credits, for every active user that has none.
+    
+    Users are walked in user_id order and the last one done is checkpointed, so a crashed run resumes where it
+    stopped. Accounts are upserted with $setOnInsert, so re-running over users already provisioned changes nothing.
+    Each batch's legacy credits are folded first, a default account must never take the place of a legacy balance.
+    """
+    job_id = f"provision_credits:{year}"
+    state = await db.job_state.find_one({"_id": job_id}) or {}
+    if state.get("status") == "done":
+        # The previous pass finished, this is a new one from the first user
+        state = {}
+    
+    categories = await category_registry.get()
+    last_user_id = state.get("last_user_id", "")
+    provisioned = state.get("provisioned", 0)
+    await checkpoint_job(job_id, "job:provision-credits", {
+        "status": "running", "last_user_id": last_user_id, "provisioned": provisioned,
+        "started_at": state.get("started_at") or datetime.now(timezone.utc).isoformat()
+    })
+    while True:
+        users = await db.users.find(
+            {"user_id": {"$gt": last_user_id}, "active": {"$ne": False}}, {"_id": 0, "user_id": 1, "email": 1, "name": 1}
+        ).sort("user_id", 1).limit(JOB_BATCH_SIZE).to_list(None)
+        if not users:
+            break
+        await migrate_legacy_credits({"user_id": {"$in": [user["user_id"] for user in users]}, "year": year})
+        operations = [
+            credit_account_upsert(user["user_id"], user["email"], user["name"], year, categories.default_credits) for user in users
+        ]
+        result = await db.credit_accounts.bulk_write(operations, ordered=False)
+        provisioned += result.upserted_count
+        last_user_id = users[-1]["user_id"]
+        await checkpoint_job(job_id, "job:provision-credits", {"last_user_id": last_user_id, "provisioned": provisioned})
+    
+    await checkpoint_job(job_id, "job:provision-credits", {
+        "status": "done", "last_run_date": datetime.now(timezone.utc).date().isoformat(),
+        "finished_at": datetime.now(timezone.utc).isoformat()
+    })
+    logger.info(f"Provisioned {year} credits for {provisioned} user(s)")
+    return {"job": job_id, "status": "done", "provisioned": provisioned}
+
+async def expire_credits(today: str) -> dict:
+    """Archive to credit_archive and remove every balance whose expires_at is before today.
+    
+    Expired balances are found with one range query on the balances.expires_at index. A balance is only pulled
+    from its account once its archive copy exists, and archived balances no longer match, so the query itself
+    is the resume point after a crash.
+    
+    Balances still holding days for pending requests are left alone, pulling them would leave those requests
+    unable to be approved or rejected; they are counted as held and expire on the first run after HR decides.
+    """
+    archived = 0
+    await checkpoint_job("expire_credits", "job:expire-credits", {"status": "running", "run_date": today})
+    while True:
+        accounts = await db.credit_accounts.find(
+            {"balances": {"$elemMatch": {"expires_at": {"$lt": today}, "reserved_days": {"$not": {"$gt": 0}}}}}
+        ).limit(JOB_BATCH_SIZE).to_list(None)
+        if not accounts:
+            break
+        now = datetime.now(timezone.utc).isoformat()
+        expired = {
+            account["_id"]: [
+                row for row in credit_rows(account)
+                if row.get("expires_at") and row["expires_at"] < today and not row.get("reserved_days", 0) > 0
+            ]
+            for account in accounts
+        }
+        rows = [{**row, "archived_at": now} for account_rows in expired.values() for row in account_rows]
+        try:
+            await db.credit_archive.insert_many(rows, ordered=False)
+        except BulkWriteError as e:
+            # Already archived by a run that crashed before removing them
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+        await db.credit_accounts.bulk_write([
+            UpdateOne(
+                {"_id": account_id},
+                {"$pull": {"balances": {"credit_id": {"$in": [row["credit_id"] for row in account_rows]}}}, "$set": {"updated_at": now}}
+            )
+            for account_id, account_rows in expired.items()
+        ], ordered=False)
+        await db.credit_accounts.delete_many({"_id": {"$in": list(expired)}, "balances": {"$size": 0}})
+        archived += len(rows)
+        await checkpoint_job("expire_credits", "job:expire-credits", {"archived": archived})
+    
+    reserved = await db.credit_accounts.find(
+        {"balances": {"$elemMatch": {"expires_at": {"$lt": today}, "reserved_days": {"$gt": 0}}}},
+        {"_id": 0, "user_id": 1, "year": 1, "balances.category": 1, "balances.expires_at": 1, "balances.reserved_days": 1}
+    ).to_list(None)
+    held = [
+        {"user_id": account["user_id"], "year": account["year"], "category": balance["category"], "reserved_days": balance["reserved_days"]}
+        for account in reserved for balance in account.get("balances", [])
+        if balance.get("expires_at") and balance["expires_at"] < today and balance.get("reserved_days", 0) > 0
+    ]
+    await checkpoint_job("expire_credits", "job:expire-credits", {
+        "status": "done", "last_run_date": today, "archived": archived, "held": len(held),
+        "finished_at": datetime.now(timezone.utc).isoformat()
+    })
+    if held:
+        logger.warning(f"{len(held)} expired credit balance(s) kept, they still hold days for pending requests: {held}")
+    logger.info(f"Expired {archived} credit balance(s) past their expiry date")
+    return {"job": "expire_credits", "status": "done", "archived": archived, "held": held}
+
+JOBS = {"provision-credits": provision_credits, "expire-credits": expire_credits}
+
+async def run_job(name: str, **kwargs) -> Optional[dict]:
+    """Run a job under its lease, returns its report or None while another worker is running it"""
+    lease = f"job:{name}"
+    if not await acquire_lease(lease, JOB_LEASE_SECONDS):
+        return None
+    try:
+        return await JOBS[name](**kwargs)
+    finally:
+        await release_lease(lease)
+
+async def run_due_jobs():
+    """Once a day, provision this year's and (from NEXT_YEAR_PROVISIONING_FROM on) next year's credits and expire
+    credits; a run that did not finish is resumed on the next tick. Days are UTC days on every worker."""
+    today = datetime.now(timezone.utc).date()
+    years = [today.year]
+    if today.strftime("%m-%d") >= NEXT_YEAR_PROVISIONING_FROM:
+        years.append(today.year + 1)
+    for year in years:
+        state = await db.job_state.find_one({"_id": f"provision_credits:{year}"}) or {}
+        if state.get("last_run_date") != today.isoformat() or state.get("status") != "done":
+            await run_job("provision-credits", year=year)
+    
+    state = await db.job_state.find_one({"_id": "expire_credits"}) or {}
+    if state.get("last_run_date") != today.isoformat() or state.get("status") != "done":
+        await run_job("expire-credits", today=today.isoformat())
+
+async def job_scheduler():
+    """Run the due batch jobs every JOB_SCHEDULER_TICK_SECONDS, until cancelled"""
+    while True:
+        try:
+            await run_due_jobs()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Scheduled job error: {e}")
+        await asyncio.sleep(JOB_SCHEDULER_TICK_SECONDS)
+
 # ==================== AUTH ROUTES ====================
 
 @api_router.get("/auth/session")
@@ -320,7 +2199,8 @@ async def process_session(session_id: str, response: Response):
     """Exchange session_id for user data and set session cookie"""
     try:
         # Get session data from Emergent Auth
-        resp = requests.get(
+        resp = await http_request(
+            "GET",
             "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
             headers={"X-Session-ID": session_id}
         )
@@ -336,12 +2216,15 @@ async def process_session(session_id: str, response: Response):
         # Check if user exists
         existing_user = await db.users.find_one({"email": email}, {"_id": 0})
         if existing_user:
+            if not existing_user.get("active", True):
+                raise HTTPException(status_code=403, detail="Account deactivated")
             user_id = existing_user["user_id"]
             # Update user info
             await db.users.update_one(
                 {"user_id": user_id},
                 {"$set": {"name": name, "picture": picture}}
             )
+            await invalidate_user_sessions(user_id)
         else:
             # Create new user
             user_id = f"user_{uuid.uuid4().hex[:12]}"
@@ -355,23 +2238,11 @@ async def process_session(session_id: str, response: Response):
             }
             await db.users.insert_one(new_user)
             
-            # Create default holiday credits for all categories
-            current_year = datetime.now().year
-            for cat_id, default_days in DEFAULT_CREDITS.items():
-                credit = {
-                    "credit_id": f"cred_{uuid.uuid4().hex[:12]}",
-                    "user_id": user_id,
-                    "user_email": email,
-                    "user_name": name,
-                    "year": current_year,
-                    "category": cat_id,
-                    "total_days": default_days,
-                    "used_days": 0.0,
-                    "remaining_days": default_days,
-                    "created_at": datetime.now(timezone.utc).isoformat(),
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }
-                await db.holiday_credits.insert_one(credit)
+            # Create default holiday credits for all categories, one account document for the year
+            categories = await category_registry.get()
+            await db.credit_accounts.bulk_write(
+                [credit_account_upsert(user_id, email, name, datetime.now().year, categories.default_credits)]
+            )
         
         # Store session
         expires_at = datetime.now(timezone.utc) + timedelta(days=7)
@@ -398,6 +2269,8 @@ async def process_session(session_id: str, response: Response):
         user = await db.users.find_one({"user_id": user_id}, {"_id": 0})
         return user
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Session processing error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -413,39 +2286,131 @@ async def logout(request: Request, response: Response):
     session_token = request.cookies.get("session_token")
     if session_token:
         await db.user_sessions.delete_one({"session_token": session_token})
+        session_cache.invalidate(session_token)
+        await bump_change_counter("sessions")
     
     response.delete_cookie(key="session_token", path="/")
     return {"message": "Logged out successfully"}
 
-# ==================== HOLIDAY REQUEST ROUTES ====================
+# ==================== CATEGORY ROUTES ====================
+
+CATEGORY_ID_PATTERN = re.compile(r"^[a-z][a-z0-9_]{1,39}$")
+
+async def seed_categories():
+    """Insert the built-in categories that are not in the registry yet, HR edits are left alone"""
+    seeded = 0
+    for order, category in enumerate(HOLIDAY_CATEGORIES):
+        doc = HolidayCategory(**category, default_credits=DEFAULT_CREDITS.get(category["id"], 0.0), sort_order=order)
+        result = await db.holiday_categories.update_one(
+            {"id": doc.id}, {"$setOnInsert": doc.model_dump()}, upsert=True
+        )
+        if result.upserted_id is not None:
+            seeded += 1
+    if seeded:
+        await bump_change_counter("categories")
+        logger.info(f"Seeded {seeded} holiday categories")
+
+async def categories_changed(renamed: bool = False):
+    """Publish a registry edit to every worker; a rename also drops the calendar buckets holding the old name"""
+    await bump_change_counter("categories")
+    category_registry.invalidate()
+    if renamed:
+        await db.calendar_buckets.delete_many({})
+        await bump_change_counter("calendar")
 
 @api_router.get("/categories")
-async def get_holiday_categories():
-    """Get all holiday categories"""
-    return HOLIDAY_CATEGORIES
+async def get_holiday_categories(request: Request, response: Response):
+    """Get all active holiday categories"""
+    categories = await category_registry.get()
+    # HR can edit the registry at any time, so clients revalidate with the version ETag on every use
+    headers = {"ETag": categories.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match", ""), categories.etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return categories.active
+
+@api_router.post("/categories", status_code=201)
+async def create_holiday_category(category: HolidayCategoryCreate, user: User = Depends(get_hr_user)):
+    """Add a holiday category (HR only), existing users get its credits through the usual credit routes"""
+    if not CATEGORY_ID_PATTERN.match(category.id):
+        raise HTTPException(status_code=400, detail="Category id must be 2-40 lowercase letters, digits or underscores")
+    if category.default_credits < 0:
+        raise HTTPException(status_code=400, detail="Default credits cannot be negative")
+    
+    categories = await category_registry.get()
+    if category.id in categories.by_id:
+        raise HTTPException(status_code=400, detail="Category already exists")
+    
+    sort_order = max((c.get("sort_order", 0) for c in categories.by_id.values()), default=-1) + 1
+    doc = HolidayCategory(**category.model_dump(), sort_order=sort_order).model_dump()
+    try:
+        await db.holiday_categories.insert_one(doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Category already exists")
+    await categories_changed()
+    
+    doc.pop("_id", None)
+    return doc
+
+@api_router.put("/categories/{category_id}")
+async def update_holiday_category(category_id: str, update: HolidayCategoryUpdate, user: User = Depends(get_hr_user)):
+    """Rename, re-describe, reorder or (de)activate a holiday category, or change its default credits (HR only)"""
+    changes = update.model_dump(exclude_none=True)
+    if not changes:
+        raise HTTPException(status_code=400, detail="Nothing to update")
+    if changes.get("default_credits", 0.0) < 0:
+        raise HTTPException(status_code=400, detail="Default credits cannot be negative")
+    
+    before = await db.holiday_categories.find_one_and_update(
+        {"id": category_id}, {"$set": changes}, projection={"_id": 0}
+    )
+    if not before:
+        raise HTTPException(status_code=404, detail="Category not found")
+    await categories_changed(renamed="name" in changes and changes["name"] != before["name"])
+    
+    return {**before, **changes}
+
+# ==================== HOLIDAY REQUEST ROUTES ====================
 
 @api_router.post("/requests", response_model=dict, status_code=201)
 async def create_holiday_request(req: HolidayRequestCreate, user: User = Depends(get_current_user)):
     """Create a new holiday request"""
     # Validate category
-    valid_categories = [c["id"] for c in HOLIDAY_CATEGORIES]
-    if req.category not in valid_categories:
+    categories = await category_registry.get()
+    if not categories.is_active(req.category):
         raise HTTPException(status_code=400, detail="Invalid holiday category")
     
-    # Check if user has enough credits for this category
-    current_year = datetime.now().year
-    credit = await db.holiday_credits.find_one(
-        {"user_id": user.user_id, "year": current_year, "category": req.category}, {"_id": 0}
-    )
-    
     # Get category name for display
-    category_name = next((c["name"] for c in HOLIDAY_CATEGORIES if c["id"] == req.category), req.category)
+    category_name = categories.name(req.category)
+    
+    start, end = parse_date_range(req.start_date, req.end_date)
+    if (end - start).astype(int) >= MAX_REQUEST_SPAN_DAYS:
+        raise HTTPException(status_code=400, detail=f"A request cannot span more than {MAX_REQUEST_SPAN_DAYS} days")
+    start_date, end_date = str(start), str(end)
+    
+    # Whatever the client sent, the days charged are the working days in the range
+    days_count = await count_working_days(start_date, end_date, req.start_half_day, req.end_half_day)
+    if days_count <= 0:
+        raise HTTPException(status_code=400, detail="The selected dates contain no working days")
+    
+    def overlap_error(overlapping: dict) -> HTTPException:
+        return HTTPException(
+            status_code=400,
+            detail=f"Overlaps your {overlapping['status']} request from {overlapping['start_date']} to {overlapping['end_date']}"
+        )
     
-    if not credit:
-        raise HTTPException(status_code=400, detail=f"No credits assigned for {category_name}")
+    overlapping = await find_overlapping_request(user.user_id, start_date, end_date)
+    if overlapping:
+        raise overlap_error(overlapping)
     
-    if credit["remaining_days"] < req.days_count:
-        raise HTTPException(status_code=400, detail=f"Insufficient {category_name} credits. Available: {credit['remaining_days']} days")
+    # Reserve the days up front so pending requests can never add up to more than the balance
+    current_year = datetime.now().year
+    if not await reserve_credit(user.user_id, current_year, req.category, days_count):
+        credit = await find_credit_balance(user.user_id, current_year, req.category)
+        if not credit:
+            raise HTTPException(status_code=400, detail=f"No credits assigned for {category_name}")
+        available = credit["remaining_days"] - credit.get("reserved_days", 0.0)
+        raise HTTPException(status_code=400, detail=f"Insufficient {category_name} credits. Available: {available} days")
     
     # Create request
     request_doc = {
@@ -454,53 +2419,121 @@ async def create_holiday_request(req: HolidayRequestCreate, user: User = Depends
         "user_name": user.name,
         "user_email": user.email,
         "category": req.category,
-        "start_date": req.start_date,
-        "end_date": req.end_date,
-        "days_count": req.days_count,
+        "start_date": start_date,
+        "end_date": end_date,
+        "days_count": days_count,
+        "start_half_day": req.start_half_day,
+        "end_half_day": req.end_half_day,
         "reason": req.reason,
         "status": "pending",
+        "credit_year": current_year,
+        "reserved_days": days_count,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
-    await db.holiday_requests.insert_one(request_doc)
-    
-    # Send notification to HR
-    hr_users = await db.users.find({"role": "hr"}, {"_id": 0}).to_list(100)
-    for hr in hr_users:
-        await send_email_notification(
-            hr["email"],
+    try:
+        await db.holiday_requests.insert_one(request_doc)
+    except Exception:
+        await release_credit(user.user_id, current_year, req.category, days_count)
+        raise
+    
+    # The check above raced any other create for this user: look again now that ours is visible. Of two racing
+    # inserts the later one always sees the earlier and backs out (both may, the user then simply retries).
+    overlapping = await find_overlapping_request(user.user_id, start_date, end_date, exclude_request_id=request_doc["request_id"])
+    if overlapping:
+        removed = await db.holiday_requests.delete_one({"request_id": request_doc["request_id"], "status": "pending"})
+        if removed.deleted_count:
+            await release_credit(user.user_id, current_year, req.category, days_count)
+            raise overlap_error(overlapping)
+    
+    # Notify HR with one multi-recipient message, whatever the size of the team.
+    # In digest mode the request is picked up by the next periodic summary instead.
+    settings = await settings_cache.get()
+    hr_recipients = [] if settings.get("hr_digest_enabled", False) else await get_hr_recipients()
+    if hr_recipients:
+        await queue_email_notification(
+            hr_recipients,
             f"New {category_name} Request from {user.name}",
             f"""
             <h2>New Holiday Request</h2>
             <p><strong>Employee:</strong> {user.name}</p>
             <p><strong>Category:</strong> {category_name}</p>
-            <p><strong>Dates:</strong> {req.start_date} to {req.end_date}</p>
-            <p><strong>Days:</strong> {req.days_count}</p>
+            <p><strong>Dates:</strong> {start_date} to {end_date}</p>
+            <p><strong>Days:</strong> {days_count}</p>
             <p><strong>Reason:</strong> {req.reason}</p>
             <p>Please review this request in the Holiday Management System.</p>
             """
         )
     
-    return {"message": "Request created successfully", "request_id": request_doc["request_id"]}
+    return {"message": "Request created successfully", "request_id": request_doc["request_id"], "days_count": days_count}
 
 @api_router.get("/requests/my")
-async def get_my_requests(user: User = Depends(get_current_user)):
-    """Get current user's holiday requests"""
-    requests = await db.holiday_requests.find(
-        {"user_id": user.user_id}, {"_id": 0}
-    ).sort("created_at", -1).to_list(1000)
-    return requests
+async def get_my_requests(
+    response: Response,
+    limit: int = Query(1000, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    user: User = Depends(get_current_user)
+):
+    """Get current user's holiday requests, newest first, paginated with X-Next-Cursor"""
+    projection, selected = select_fields(fields, HolidayRequest, REQUESTS_SORT)
+    requests = await find_page(db.holiday_requests, {"user_id": user.user_id}, REQUESTS_SORT, limit, cursor, response, projection)
+    return json_response(trim_fields(requests, selected), response)
 
 @api_router.get("/requests/all")
-async def get_all_requests(user: User = Depends(get_hr_user)):
-    """Get all holiday requests (HR only)"""
-    requests = await db.holiday_requests.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    return requests
+async def get_all_requests(
+    response: Response,
+    limit: int = Query(1000, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    user: User = Depends(get_hr_user)
+):
+    """Get all holiday requests, paginated with X-Next-Cursor (HR only)"""
+    projection, selected = select_fields(fields, HolidayRequest, REQUESTS_SORT)
+    requests = await find_page(db.holiday_requests, {}, REQUESTS_SORT, limit, cursor, response, projection)
+    return json_response(trim_fields(requests, selected), response)
 
 @api_router.get("/requests/pending")
-async def get_pending_requests(user: User = Depends(get_hr_user)):
-    """Get pending holiday requests (HR only)"""
-    requests = await db.holiday_requests.find({"status": "pending"}, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    return requests
+async def get_pending_requests(
+    response: Response,
+    limit: int = Query(1000, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    user: User = Depends(get_hr_user)
+):
+    """Get pending holiday requests, paginated with X-Next-Cursor (HR only)"""
+    projection, selected = select_fields(fields, HolidayRequest, REQUESTS_SORT)
+    requests = await find_page(db.holiday_requests, {"status": "pending"}, REQUESTS_SORT, limit, cursor, response, projection)
+    return json_response(trim_fields(requests, selected), response)
+
+def approval_email(req: dict, category_name: str, hr_comment: Optional[str]) -> tuple:
+    """(to, subject, body) telling an employee their request was approved"""
+    return (
+        req["user_email"],
+        f"Your {category_name} Request has been Approved",
+        f"""
+        <h2>{category_name} Request Approved</h2>
+        <p>Your request has been approved!</p>
+        <p><strong>Category:</strong> {category_name}</p>
+        <p><strong>Dates:</strong> {req['start_date']} to {req['end_date']}</p>
+        <p><strong>Days:</strong> {req['days_count']}</p>
+        {f'<p><strong>HR Comment:</strong> {hr_comment}</p>' if hr_comment else ''}
+        """
+    )
+
+def rejection_email(req: dict, hr_comment: Optional[str]) -> tuple:
+    """(to, subject, body) telling an employee their request was rejected"""
+    return (
+        req["user_email"],
+        "Your Holiday Request has been Rejected",
+        f"""
+        <h2>Holiday Request Rejected</h2>
+        <p>Unfortunately, your holiday request has been rejected.</p>
+        <p><strong>Dates:</strong> {req['start_date']} to {req['end_date']}</p>
+        <p><strong>Days:</strong> {req['days_count']}</p>
+        {f'<p><strong>HR Comment:</strong> {hr_comment}</p>' if hr_comment else ''}
+        <p>Please contact HR for more information.</p>
+        """
+    )
 
 @api_router.put("/requests/{request_id}/approve")
 async def approve_request(request_id: str, hr_comment: Optional[str] = None, user: User = Depends(get_hr_user)):
@@ -512,19 +2545,40 @@ async def approve_request(request_id: str, hr_comment: Optional[str] = None, use
     if req["status"] != "pending":
         raise HTTPException(status_code=400, detail="Request already processed")
     
-    # Update credit for the specific category
-    current_year = datetime.now().year
+    credit_year = req.get("credit_year") or datetime.now().year
     category = req.get("category", "paid_holiday")
-    await db.holiday_credits.update_one(
-        {"user_id": req["user_id"], "year": current_year, "category": category},
-        {
-            "$inc": {"used_days": req["days_count"], "remaining_days": -req["days_count"]},
-            "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
-        }
-    )
-    
-    # Get category name for calendar
-    category_name = next((c["name"] for c in HOLIDAY_CATEGORIES if c["id"] == category), category)
+    categories = await category_registry.get()
+    category_name = categories.name(category)
+    processed_at = datetime.now(timezone.utc).isoformat()
+    
+    async def approve(session):
+        # Only one concurrent approver can move the request out of pending
+        claimed = await db.holiday_requests.find_one_and_update(
+            {"request_id": request_id, "status": "pending"},
+            {"$set": {
+                "status": "approved",
+                "hr_comment": hr_comment,
+                "processed_by": user.user_id,
+                "processed_at": processed_at
+            }},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        if not claimed:
+            raise HTTPException(status_code=400, detail="Request already processed")
+        
+        # Requests filed before reservations existed have nothing held on the credit
+        reserved = claimed.get("reserved_days", 0.0)
+        if not await debit_credit(req["user_id"], credit_year, category, req["days_count"], reserved, session=session):
+            if session is None:
+                # No transaction to roll back, so hand the request back to the queue ourselves
+                await revert_to_pending([request_id], processed_at)
+            raise HTTPException(status_code=400, detail=f"Insufficient {category_name} credits to approve this request")
+        return claimed
+    
+    req = await run_atomically(approve)
+    await add_to_calendar_buckets([request_calendar_event(req, categories)])
     
     # Create calendar event
     event_id = await create_calendar_event(
@@ -533,84 +2587,409 @@ async def approve_request(request_id: str, hr_comment: Optional[str] = None, use
         req["end_date"],
         req.get("reason", "")
     )
-    
-    # Update request
-    await db.holiday_requests.update_one(
-        {"request_id": request_id},
-        {"$set": {
-            "status": "approved",
-            "hr_comment": hr_comment,
-            "processed_by": user.user_id,
-            "processed_at": datetime.now(timezone.utc).isoformat(),
-            "calendar_event_id": event_id
-        }}
-    )
+    if event_id:
+        await db.holiday_requests.update_one(
+            {"request_id": request_id},
+            {"$set": {"calendar_event_id": event_id}}
+        )
     
     # Notify employee
-    await send_email_notification(
-        req["user_email"],
-        f"Your {category_name} Request has been Approved",
-        f"""
-        <h2>{category_name} Request Approved</h2>
-        <p>Your request has been approved!</p>
-        <p><strong>Category:</strong> {category_name}</p>
-        <p><strong>Dates:</strong> {req['start_date']} to {req['end_date']}</p>
-        <p><strong>Days:</strong> {req['days_count']}</p>
-        {f'<p><strong>HR Comment:</strong> {hr_comment}</p>' if hr_comment else ''}
-        """
-    )
+    await queue_email_notification(*approval_email(req, category_name, hr_comment))
     
     return {"message": "Request approved successfully"}
 
 @api_router.put("/requests/{request_id}/reject")
 async def reject_request(request_id: str, hr_comment: Optional[str] = None, user: User = Depends(get_hr_user)):
     """Reject a holiday request (HR only)"""
-    req = await db.holiday_requests.find_one({"request_id": request_id}, {"_id": 0})
-    if not req:
-        raise HTTPException(status_code=404, detail="Request not found")
+    async def reject(session):
+        rejected = await db.holiday_requests.find_one_and_update(
+            {"request_id": request_id, "status": "pending"},
+            {"$set": {
+                "status": "rejected",
+                "hr_comment": hr_comment,
+                "processed_by": user.user_id,
+                "processed_at": datetime.now(timezone.utc).isoformat()
+            }},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        if rejected:
+            await release_request_reservation(rejected, session=session)
+        return rejected
     
-    if req["status"] != "pending":
+    req = await run_atomically(reject)
+    if not req:
+        if not await db.holiday_requests.find_one({"request_id": request_id}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Request not found")
         raise HTTPException(status_code=400, detail="Request already processed")
     
-    await db.holiday_requests.update_one(
-        {"request_id": request_id},
-        {"$set": {
-            "status": "rejected",
-            "hr_comment": hr_comment,
-            "processed_by": user.user_id,
-            "processed_at": datetime.now(timezone.utc).isoformat()
-        }}
-    )
-    
     # Notify employee
-    await send_email_notification(
-        req["user_email"],
-        "Your Holiday Request has been Rejected",
-        f"""
-        <h2>Holiday Request Rejected</h2>
-        <p>Unfortunately, your holiday request has been rejected.</p>
-        <p><strong>Dates:</strong> {req['start_date']} to {req['end_date']}</p>
-        <p><strong>Days:</strong> {req['days_count']}</p>
-        {f'<p><strong>HR Comment:</strong> {hr_comment}</p>' if hr_comment else ''}
-        <p>Please contact HR for more information.</p>
-        """
-    )
+    await queue_email_notification(*rejection_email(req, hr_comment))
     
     return {"message": "Request rejected successfully"}
 
+@api_router.put("/requests/{request_id}/cancel")
+async def cancel_request(request_id: str, user: User = Depends(get_current_user)):
+    """Cancel one of your own pending holiday requests"""
+    async def cancel(session):
+        cancelled = await db.holiday_requests.find_one_and_update(
+            {"request_id": request_id, "user_id": user.user_id, "status": "pending"},
+            {"$set": {"status": "cancelled", "processed_at": datetime.now(timezone.utc).isoformat()}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        if cancelled:
+            await release_request_reservation(cancelled, session=session)
+        return cancelled
+    
+    req = await run_atomically(cancel)
+    if not req:
+        if not await db.holiday_requests.find_one({"request_id": request_id, "user_id": user.user_id}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Request not found")
+        raise HTTPException(status_code=400, detail="Only pending requests can be cancelled")
+    
+    return {"message": "Request cancelled successfully"}
+
+@api_router.post("/requests/bulk-decision")
+async def bulk_decision(data: BulkDecision, user: User = Depends(get_hr_user)):
+    """Approve or reject many pending requests in one call, with a result per request (HR only)"""
+    if data.decision not in ["approve", "reject"]:
+        raise HTTPException(status_code=400, detail="Decision must be 'approve' or 'reject'")
+    request_ids = list(dict.fromkeys(data.request_ids))
+    if not request_ids:
+        raise HTTPException(status_code=400, detail="No requests given")
+    if len(request_ids) > BULK_DECISION_MAX_REQUESTS:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_DECISION_MAX_REQUESTS} requests per call")
+    
+    new_status = "approved" if data.decision == "approve" else "rejected"
+    batch_id = f"batch_{uuid.uuid4().hex[:12]}"
+    processed_at = datetime.now(timezone.utc).isoformat()
+    categories = await category_registry.get()
+    results = {}
+    
+    existing = await db.holiday_requests.find({"request_id": {"$in": request_ids}}, {"_id": 0, "request_id": 1}).to_list(None)
+    existing_ids = {r["request_id"] for r in existing}
+    for request_id in request_ids:
+        if request_id not in existing_ids:
+            results[request_id] = {"status": "error", "detail": "Request not found"}
+    
+    def credit_key(req):
+        return (req["user_id"], req.get("credit_year") or datetime.now().year, req.get("category", "paid_holiday"))
+    
+    if not credit_layout_migrated and existing_ids:
+        # Bring the credits the batch touches into the account layout before the updates below
+        pending = await db.holiday_requests.find(
+            {"request_id": {"$in": list(existing_ids)}, "status": "pending"}, {"_id": 0, "user_id": 1, "credit_year": 1}
+        ).to_list(None)
+        user_years = {(req["user_id"], req.get("credit_year") or datetime.now().year) for req in pending}
+        if user_years:
+            await migrate_legacy_credits({"$or": [{"user_id": u, "year": y} for u, y in user_years]})
+    
+    async def applied_credit_keys(keys, session) -> set:
+        """The (user_id, year, category) balances among keys that took this batch"""
+        applied = await db.credit_accounts.find(
+            {"user_id": {"$in": list({u for u, _, _ in keys})}, "balances.decision_batches": batch_id},
+            {"_id": 0, "user_id": 1, "year": 1, "balances.category": 1, "balances.decision_batches": 1},
+            session=session
+        ).to_list(None)
+        return {
+            (a["user_id"], a["year"], b["category"])
+            for a in applied for b in a.get("balances", []) if batch_id in b.get("decision_batches", [])
+        }
+    
+    async def apply_credits(groups, session) -> List[str]:
+        """Debit (approve) or release (reject) the credits of the claimed requests, returns the ids that did not fit"""
+        failed_ids = []
+        if data.decision == "approve":
+            # Fit requests into each balance oldest first, then apply one conditional update per credit
+            accounts = await db.credit_accounts.find(
+                {"$or": [{"user_id": u, "year": y} for u, y in {(u, y) for u, y, _ in groups}]},
+                {"_id": 0, "user_id": 1, "year": 1, "balances.category": 1, "balances.remaining_days": 1},
+                session=session
+            ).to_list(None) if groups else []
+            remaining = {
+                (a["user_id"], a["year"], b["category"]): b["remaining_days"] for a in accounts for b in a.get("balances", [])
+            }
+            
+            operations = []
+            applied_groups = {}
+            for key, reqs in groups.items():
+                balance = remaining.get(key)
+                fitting = []
+                for req in reqs:
+                    if balance is not None and balance >= req["days_count"]:
+                        balance -= req["days_count"]
+                        fitting.append(req)
+                    else:
+                        failed_ids.append(req["request_id"])
+                if not fitting:
+                    continue
+                days = sum(req["days_count"] for req in fitting)
+                reserved = sum(req.get("reserved_days", 0.0) for req in fitting)
+                user_id, year, category = key
+                operations.append(UpdateOne(
+                    balance_filter(user_id, year, category, remaining_days={"$gte": days}),
+                    balance_update(
+                        inc={"used_days": days, "remaining_days": -days, "reserved_days": -reserved, "available_days": reserved - days},
+                        decision_batch=batch_id
+                    )
+                ))
+                applied_groups[key] = fitting
+            
+            if operations:
+                result = await db.credit_accounts.bulk_write(operations, ordered=False, session=session)
+                if result.matched_count < len(operations):
+                    # A balance changed under us, find out which credits actually took the batch
+                    applied_keys = await applied_credit_keys(applied_groups, session)
+                    for key, reqs in applied_groups.items():
+                        if key not in applied_keys:
+                            failed_ids.extend(req["request_id"] for req in reqs)
+        else:
+            operations = []
+            for (user_id, year, category), reqs in groups.items():
+                reserved = sum(req.get("reserved_days", 0.0) for req in reqs)
+                if reserved:
+                    operations.append(UpdateOne(
+                        balance_filter(user_id, year, category),
+                        balance_update(inc={"reserved_days": -reserved, "available_days": reserved}, decision_batch=batch_id)
+                    ))
+            if operations:
+                await db.credit_accounts.bulk_write(operations, ordered=False, session=session)
+        return failed_ids
+    
+    async def decide(session):
+        # One multi-update claims every request that is still pending, tagged so we can tell which ones we got
+        await db.holiday_requests.update_many(
+            {"request_id": {"$in": list(existing_ids)}, "status": "pending"},
+            {"$set": {
+                "status": new_status,
+                "hr_comment": data.hr_comment,
+                "processed_by": user.user_id,
+                "processed_at": processed_at,
+                "decision_batch": batch_id
+            }},
+            session=session
+        )
+        claimed = []
+        groups = {}
+        try:
+            claimed = await db.holiday_requests.find(
+                {"request_id": {"$in": list(existing_ids)}, "decision_batch": batch_id}, {"_id": 0}, session=session
+            ).sort("created_at", 1).to_list(None)
+            for req in claimed:
+                groups.setdefault(credit_key(req), []).append(req)
+            failed_ids = await apply_credits(groups, session)
+        except Exception:
+            if session is not None:
+                # The transaction is aborted and takes the claim with it
+                raise
+            # Without a transaction nothing else undoes the claim: put back every request whose credit did not
+            # change, those whose balance took the batch stay decided
+            try:
+                applied_keys = await applied_credit_keys(groups, None) if groups else set()
+            except Exception:
+                applied_keys = set()
+            if data.decision == "reject":
+                applied_keys |= {key for key, reqs in groups.items() if not sum(req.get("reserved_days", 0.0) for req in reqs)}
+            kept = {req["request_id"] for key, reqs in groups.items() if key in applied_keys for req in reqs}
+            await revert_to_pending([request_id for request_id in existing_ids if request_id not in kept], processed_at, new_status)
+            raise
+        
+        if failed_ids:
+            if session is not None:
+                # Inside the transaction the status change is simply undone along with everything else
+                await db.holiday_requests.update_many(
+                    {"request_id": {"$in": failed_ids}},
+                    {"$set": {"status": "pending"}, "$unset": {"hr_comment": "", "processed_by": "", "processed_at": "", "decision_batch": ""}},
+                    session=session
+                )
+            else:
+                await revert_to_pending(failed_ids, processed_at)
+        return claimed, set(failed_ids)
+    
+    try:
+        claimed, failed_ids = await run_atomically(decide)
+    finally:
+        # Which balances took the batch only matters while it runs
+        await db.credit_accounts.update_many(
+            {"balances.decision_batches": batch_id}, {"$pull": {"balances.$[].decision_batches": batch_id}}
+        )
+    decided = [req for req in claimed if req["request_id"] not in failed_ids]
+    if decided:
+        # The tag only told this call which requests it claimed
+        await db.holiday_requests.update_many(
+            {"request_id": {"$in": [req["request_id"] for req in decided]}, "decision_batch": batch_id},
+            {"$unset": {"decision_batch": ""}}
+        )
+    if data.decision == "approve":
+        await add_to_calendar_buckets([request_calendar_event(req, categories) for req in decided])
+    for req in claimed:
+        if req["request_id"] in failed_ids:
+            name = categories.name(req.get("category", "paid_holiday"))
+            results[req["request_id"]] = {"status": "error", "detail": f"Insufficient {name} credits to approve this request"}
+        else:
+            results[req["request_id"]] = {"status": new_status}
+    for request_id in existing_ids:
+        results.setdefault(request_id, {"status": "error", "detail": "Request already processed"})
+    
+    if data.decision == "approve" and decided:
+        # Calendar events go out in batch HTTP requests, ids are written back in one bulk_write
+        event_ids = await create_calendar_events([
+            {
+                "summary": f"{categories.name(req.get('category', 'paid_holiday'))}: {req['user_name']}",
+                "start_date": req["start_date"],
+                "end_date": req["end_date"],
+                "description": req.get("reason", "")
+            }
+            for req in decided
+        ])
+        event_updates = [
+            UpdateOne({"request_id": req["request_id"]}, {"$set": {"calendar_event_id": event_id}})
+            for req, event_id in zip(decided, event_ids) if event_id
+        ]
+        if event_updates:
+            await db.holiday_requests.bulk_write(event_updates, ordered=False)
+    
+    if data.decision == "approve":
+        messages = [approval_email(req, categories.name(req.get("category", "paid_holiday")), data.hr_comment) for req in decided]
+    else:
+        messages = [rejection_email(req, data.hr_comment) for req in decided]
+    await queue_email_notifications(messages)
+    
+    return {
+        "decision": data.decision,
+        "processed": len(decided),
+        "failed": len(request_ids) - len(decided),
+        "results": [{"request_id": request_id, **results[request_id]} for request_id in request_ids]
+    }
+
+@api_router.get("/absences")
+async def get_absences(
+    start_date: str,
+    end_date: str,
+    include_pending: bool = False,
+    user: User = Depends(get_current_user)
+):
+    """Who is off at some point between two dates, pending requests are visible to HR only"""
+    start, end = parse_date_range(start_date, end_date)
+    if include_pending and user.role != "hr":
+        raise HTTPException(status_code=403, detail="HR access required")
+    
+    statuses = ABSENCE_STATUSES if include_pending else ["approved"]
+    absences = await db.holiday_requests.find(
+        {"status": {"$in": statuses}, **overlap_filter(str(start), str(end))},
+        {"_id": 0, "request_id": 1, "user_id": 1, "user_name": 1, "category": 1, "status": 1,
+         "start_date": 1, "end_date": 1, "days_count": 1}
+    ).sort("start_date", 1).to_list(None)
+    return absences
+
+@api_router.post("/requests/recompute-days")
+async def recompute_request_days(
+    apply: bool = False,
+    year: Optional[int] = None,
+    user: User = Depends(get_hr_user)
+):
+    """Recount the working days of every stored request against the current public holidays (HR only).
+    
+    Mismatches are reported; with apply=true pending requests and their reservations are corrected.
+    Approved requests are only reported, their days are already debited from the credit.
+    """
+    query = {"start_date": {"$gte": f"{year}-01-01", "$lte": f"{year}-12-31"}} if year else {}
+    projection = {"_id": 0, "request_id": 1, "user_id": 1, "category": 1, "status": 1, "credit_year": 1,
+                  "start_date": 1, "end_date": 1, "days_count": 1, "reserved_days": 1,
+                  "start_half_day": 1, "end_half_day": 1}
+    recompute_id = f"rcd_{uuid.uuid4().hex[:12]}"
+    scanned = 0
+    invalid = []
+    changes = []
+    updated = 0
+    
+    async def process(rows: List[dict]):
+        nonlocal updated
+        parsed = []
+        for row in rows:
+            try:
+                parsed.append((row, *parse_date_range(row["start_date"], row["end_date"])))
+            except HTTPException:
+                invalid.append(row["request_id"])
+        if not parsed:
+            return
+        computed = await count_working_days_many(
+            [start for _, start, _ in parsed],
+            [end for _, _, end in parsed],
+            [row.get("start_half_day", False) for row, _, _ in parsed],
+            [row.get("end_half_day", False) for row, _, _ in parsed]
+        )
+        mismatched = [(row, float(days)) for (row, _, _), days in zip(parsed, computed) if days != row["days_count"]]
+        changes.extend(mismatched)
+        
+        pending = [(row, days) for row, days in mismatched if row["status"] == "pending"]
+        if not apply or not pending:
+            return
+        # Only requests still pending with the days we read are corrected, tagged so the credit side can follow
+        result = await db.holiday_requests.bulk_write([
+            UpdateOne(
+                {"request_id": row["request_id"], "status": "pending", "days_count": row["days_count"]},
+                {"$set": {"days_count": days, "reserved_days": days, "days_recomputed_by": recompute_id}}
+            )
+            for row, days in pending
+        ], ordered=False)
+        updated += result.modified_count
+        corrected = await db.holiday_requests.find(
+            {"request_id": {"$in": [row["request_id"] for row, _ in pending]}, "days_recomputed_by": recompute_id},
+            {"_id": 0, "request_id": 1}
+        ).to_list(None)
+        corrected_ids = {r["request_id"] for r in corrected}
+        
+        deltas = {}
+        for row, days in pending:
+            if row["request_id"] in corrected_ids:
+                key = (row["user_id"], row.get("credit_year") or datetime.now().year, row.get("category", "paid_holiday"))
+                deltas[key] = deltas.get(key, 0.0) + days - row.get("reserved_days", 0.0)
+        credit_updates = [
+            UpdateOne(balance_filter(user_id, credit_year, category), balance_update(inc={"reserved_days": delta, "available_days": -delta}))
+            for (user_id, credit_year, category), delta in deltas.items() if delta
+        ]
+        if credit_updates:
+            await migrate_legacy_credits({"$or": [{"user_id": u, "year": y} for u, y, _ in deltas]})
+            await db.credit_accounts.bulk_write(credit_updates, ordered=False)
+    
+    rows = []
+    async for row in db.holiday_requests.find(query, projection):
+        rows.append(row)
+        scanned += 1
+        if len(rows) >= WORKING_DAYS_BATCH_SIZE:
+            await process(rows)
+            rows = []
+    await process(rows)
+    
+    logger.info(f"Recomputed working days: {scanned} scanned, {len(changes)} mismatched, {updated} updated")
+    return {
+        "scanned": scanned,
+        "mismatched": len(changes),
+        "updated": updated,
+        "invalid": invalid,
+        "changes": [
+            {"request_id": row["request_id"], "status": row["status"], "stored_days": row["days_count"], "computed_days": days}
+            for row, days in changes[:RECOMPUTE_REPORT_LIMIT]
+        ],
+        "truncated": len(changes) > RECOMPUTE_REPORT_LIMIT
+    }
+
 # ==================== HOLIDAY CREDITS ROUTES ====================
 
 @api_router.get("/credits/my")
 async def get_my_credits(user: User = Depends(get_current_user)):
     """Get current user's holiday credits"""
-    credits = await db.holiday_credits.find(
-        {"user_id": user.user_id}, {"_id": 0}
-    ).sort([("year", -1), ("category", 1)]).to_list(100)
+    credits = await find_credit_rows({"user_id": user.user_id})
     
     # Add category name to each credit
+    categories = await category_registry.get()
     for credit in credits:
-        category_info = next((c for c in HOLIDAY_CATEGORIES if c["id"] == credit.get("category", "paid_holiday")), None)
-        credit["category_name"] = category_info["name"] if category_info else credit.get("category", "Paid Holidays")
+        credit["category_name"] = categories.name(credit.get("category", "paid_holiday"))
+        credit["available_days"] = credit["remaining_days"] - credit.get("reserved_days", 0.0)
     
     return credits
 
@@ -621,26 +3000,48 @@ async def get_user_credits(user_id: str, year: Optional[int] = None, current_use
     if year:
         query["year"] = year
     
-    credits = await db.holiday_credits.find(query, {"_id": 0}).sort([("year", -1), ("category", 1)]).to_list(100)
+    credits = await find_credit_rows(query)
     
     # Add category name to each credit
+    categories = await category_registry.get()
     for credit in credits:
-        category_info = next((c for c in HOLIDAY_CATEGORIES if c["id"] == credit.get("category", "paid_holiday")), None)
-        credit["category_name"] = category_info["name"] if category_info else credit.get("category", "Paid Holidays")
+        credit["category_name"] = categories.name(credit.get("category", "paid_holiday"))
+        credit["available_days"] = credit["remaining_days"] - credit.get("reserved_days", 0.0)
     
     return credits
 
 @api_router.get("/credits/all")
-async def get_all_credits(user: User = Depends(get_hr_user)):
-    """Get all users' holiday credits (HR only)"""
-    credits = await db.holiday_credits.find({}, {"_id": 0}).sort([("year", -1), ("user_name", 1), ("category", 1)]).to_list(5000)
+async def get_all_credits(
+    response: Response,
+    limit: int = Query(5000, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    user: User = Depends(get_hr_user)
+):
+    """Get all users' holiday credits, paginated with X-Next-Cursor (HR only).
+    
+    Pages are cut on (user, year) accounts: limit counts accounts, each giving one row per category.
+    """
+    projection, selected = select_fields(fields, HolidayCredit, CREDIT_ACCOUNTS_SORT, CREDIT_COMPUTED_FIELDS)
+    accounts = await find_page(
+        db.credit_accounts, {}, CREDIT_ACCOUNTS_SORT, limit, cursor, response, credit_account_projection(projection)
+    )
+    credits = [row for account in accounts for row in credit_rows(account)]
+    if legacy_credits_remain() and "X-Next-Cursor" not in response.headers:
+        # Balances not folded yet, or kept as conflicts, come after the accounts on the last page
+        credits.extend(await legacy_credit_rows({}))
     
     # Add category name to each credit
+    categories = await category_registry.get()
+    add_category_name = selected is None or "category_name" in selected
+    add_available_days = selected is None or "available_days" in selected
     for credit in credits:
-        category_info = next((c for c in HOLIDAY_CATEGORIES if c["id"] == credit.get("category", "paid_holiday")), None)
-        credit["category_name"] = category_info["name"] if category_info else credit.get("category", "Paid Holidays")
+        if add_category_name:
+            credit["category_name"] = categories.name(credit.get("category", "paid_holiday"))
+        if add_available_days:
+            credit["available_days"] = credit["remaining_days"] - credit.get("reserved_days", 0.0)
     
-    return credits
+    return json_response(trim_fields(credits, selected), response)
 
 @api_router.post("/credits")
 async def create_or_update_credit(credit: HolidayCreditCreate, user: User = Depends(get_hr_user)):
@@ -650,60 +3051,38 @@ async def create_or_update_credit(credit: HolidayCreditCreate, user: User = Depe
         raise HTTPException(status_code=404, detail="User not found")
     
     # Validate category
-    valid_categories = [c["id"] for c in HOLIDAY_CATEGORIES]
-    if credit.category not in valid_categories:
+    categories = await category_registry.get()
+    if not categories.is_active(credit.category):
         raise HTTPException(status_code=400, detail="Invalid holiday category")
     
-    category_name = next((c["name"] for c in HOLIDAY_CATEGORIES if c["id"] == credit.category), credit.category)
+    category_name = categories.name(credit.category)
     
     # For paid_holiday, set default expiration to July 31 of next year
-    expires_at = credit.expires_at
-    if credit.category == "paid_holiday" and not expires_at:
-        expires_at = f"{credit.year + 1}-07-31"
+    expires_at = credit.expires_at or default_credit_expiry(credit.category, credit.year)
     
-    existing = await db.holiday_credits.find_one(
-        {"user_id": credit.user_id, "year": credit.year, "category": credit.category}, {"_id": 0}
-    )
-    
-    if existing:
+    def set_total(existing: dict) -> dict:
         # Update existing credit
         new_remaining = credit.total_days - existing["used_days"]
         update_data = {
             "total_days": credit.total_days,
             "remaining_days": new_remaining,
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "available_days": new_remaining - existing.get("reserved_days", 0.0)
         }
         # Only update expires_at if provided or if it's paid_holiday
         if expires_at or credit.category == "paid_holiday":
             update_data["expires_at"] = expires_at
         elif credit.expires_at is not None:  # Explicitly set to None to clear
             update_data["expires_at"] = None
-            
-        await db.holiday_credits.update_one(
-            {"user_id": credit.user_id, "year": credit.year, "category": credit.category},
-            {"$set": update_data}
-        )
-    else:
-        # Create new credit
-        credit_doc = {
-            "credit_id": f"cred_{uuid.uuid4().hex[:12]}",
-            "user_id": credit.user_id,
-            "user_email": target_user["email"],
-            "user_name": target_user["name"],
-            "year": credit.year,
-            "category": credit.category,
-            "total_days": credit.total_days,
-            "used_days": 0.0,
-            "remaining_days": credit.total_days,
-            "expires_at": expires_at,
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }
-        await db.holiday_credits.insert_one(credit_doc)
+        return update_data
+    
+    if await update_credit_balance(credit.user_id, credit.year, credit.category, set_total) is None:
+        # Create new credit, in the user's account for the year (created along with it if needed)
+        account = {"user_id": credit.user_id, "user_email": target_user["email"], "user_name": target_user["name"], "year": credit.year}
+        await add_credit_balances([add_balance_operation(account, new_credit_balance(credit.category, credit.total_days, expires_at))])
     
     # Notify employee
     expiry_text = f"<p><strong>Expires:</strong> {expires_at}</p>" if expires_at else ""
-    await send_email_notification(
+    await queue_email_notification(
         target_user["email"],
         f"{category_name} Credits Updated for {credit.year}",
         f"""
@@ -729,30 +3108,22 @@ async def update_credit_expiration(data: CreditExpirationUpdate, current_user: U
     if data.category == "paid_holiday":
         raise HTTPException(status_code=400, detail="Paid Holidays expiration is fixed to July 31 of the following year")
     
-    # Find the credit
-    credit = await db.holiday_credits.find_one(
-        {"user_id": data.user_id, "year": data.year, "category": data.category},
-        {"_id": 0}
+    # Update expiration
+    await migrate_legacy_credits({"user_id": data.user_id, "year": data.year})
+    result = await db.credit_accounts.update_one(
+        balance_filter(data.user_id, data.year, data.category),
+        balance_update(set_fields={"expires_at": data.expires_at})
     )
     
-    if not credit:
+    if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Credit not found")
     
-    # Update expiration
-    await db.holiday_credits.update_one(
-        {"user_id": data.user_id, "year": data.year, "category": data.category},
-        {"$set": {
-            "expires_at": data.expires_at,
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }}
-    )
-    
     # Notify employee
     target_user = await db.users.find_one({"user_id": data.user_id}, {"_id": 0})
-    category_name = next((c["name"] for c in HOLIDAY_CATEGORIES if c["id"] == data.category), data.category)
+    category_name = (await category_registry.get()).name(data.category)
     
     if target_user and data.expires_at:
-        await send_email_notification(
+        await queue_email_notification(
             target_user["email"],
             f"{category_name} Credits Expiration Updated",
             f"""
@@ -775,51 +3146,46 @@ class CreditAdjustment(BaseModel):
 @api_router.put("/credits/adjust")
 async def adjust_credit(adjustment: CreditAdjustment, current_user: User = Depends(get_hr_user)):
     """Adjust (add or reduce) holiday credits for a user (HR only)"""
-    # Find the credit
-    credit = await db.holiday_credits.find_one(
-        {"user_id": adjustment.user_id, "year": adjustment.year, "category": adjustment.category},
-        {"_id": 0}
-    )
-    
-    if not credit:
-        raise HTTPException(status_code=404, detail="Credit not found for this user/year/category")
-    
-    # Calculate new values
-    new_remaining = credit["remaining_days"] + adjustment.adjustment
-    new_used = credit["used_days"] - adjustment.adjustment  # If reducing remaining, increase used
-    
-    # Validate
-    if new_remaining < 0:
-        raise HTTPException(status_code=400, detail=f"Cannot reduce more than available. Current remaining: {credit['remaining_days']} days")
-    
-    if new_used < 0:
-        new_used = 0  # Don't allow negative used days
-    
-    if new_remaining > credit["total_days"]:
-        # If adding more than total, also increase total
-        new_total = new_remaining
-    else:
-        new_total = credit["total_days"]
-    
-    # Update credit
-    await db.holiday_credits.update_one(
-        {"user_id": adjustment.user_id, "year": adjustment.year, "category": adjustment.category},
-        {"$set": {
+    def adjust(credit: dict) -> dict:
+        # Calculate new values
+        new_remaining = credit["remaining_days"] + adjustment.adjustment
+        new_used = credit["used_days"] - adjustment.adjustment  # If reducing remaining, increase used
+        
+        # Validate
+        if new_remaining < 0:
+            raise HTTPException(status_code=400, detail=f"Cannot reduce more than available. Current remaining: {credit['remaining_days']} days")
+        
+        if new_used < 0:
+            new_used = 0  # Don't allow negative used days
+        
+        if new_remaining > credit["total_days"]:
+            # If adding more than total, also increase total
+            new_total = new_remaining
+        else:
+            new_total = credit["total_days"]
+        
+        return {
             "total_days": new_total,
             "used_days": new_used,
             "remaining_days": new_remaining,
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }}
-    )
+            "available_days": new_remaining - credit.get("reserved_days", 0.0)
+        }
+    
+    # Update credit
+    updated = await update_credit_balance(adjustment.user_id, adjustment.year, adjustment.category, adjust)
+    if updated is None:
+        raise HTTPException(status_code=404, detail="Credit not found for this user/year/category")
+    _, changes = updated
+    new_total, new_used, new_remaining = changes["total_days"], changes["used_days"], changes["remaining_days"]
     
     # Get category name and user info for notification
-    category_name = next((c["name"] for c in HOLIDAY_CATEGORIES if c["id"] == adjustment.category), adjustment.category)
+    category_name = (await category_registry.get()).name(adjustment.category)
     target_user = await db.users.find_one({"user_id": adjustment.user_id}, {"_id": 0})
     
     # Notify employee
     if target_user:
         action = "increased" if adjustment.adjustment > 0 else "reduced"
-        await send_email_notification(
+        await queue_email_notification(
             target_user["email"],
             f"{category_name} Credits Adjusted for {adjustment.year}",
             f"""
@@ -840,15 +3206,38 @@ async def adjust_credit(adjustment: CreditAdjustment, current_user: User = Depen
 # ==================== PUBLIC HOLIDAYS ROUTES ====================
 
 @api_router.get("/public-holidays")
-async def get_public_holidays(year: Optional[int] = None, user: User = Depends(get_current_user)):
+async def get_public_holidays(
+    request: Request,
+    response: Response,
+    year: Optional[int] = None,
+    user: User = Depends(get_current_user)
+):
     """Get public holidays for a year"""
+    not_modified = await conditional_get(request, response, ["public_holidays"])
+    if not_modified:
+        return not_modified
+    
     query = {"year": year} if year else {}
     holidays = await db.public_holidays.find(query, {"_id": 0}).sort("date", 1).to_list(100)
     return holidays
 
+@api_router.get("/working-days")
+async def get_working_days(
+    start_date: str,
+    end_date: str,
+    start_half_day: bool = False,
+    end_half_day: bool = False,
+    user: User = Depends(get_current_user)
+):
+    """Count the working days a request for these dates would be charged"""
+    days_count = await count_working_days(start_date, end_date, start_half_day, end_half_day)
+    return {"start_date": start_date, "end_date": end_date, "days_count": days_count}
+
 @api_router.post("/public-holidays")
 async def create_public_holiday(holiday: PublicHolidayCreate, user: User = Depends(get_hr_user)):
     """Create a public holiday (HR only)"""
+    parse_date_range(holiday.date, holiday.date)
+    
     # Create calendar event
     event_id = await create_calendar_event(
         f"Public Holiday: {holiday.name}",
@@ -866,6 +3255,9 @@ async def create_public_holiday(holiday: PublicHolidayCreate, user: User = Depen
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.public_holidays.insert_one(holiday_doc)
+    await bump_change_counter("public_holidays")
+    holiday_calendar_cache.invalidate(int(holiday.date[:4]))
+    await add_to_calendar_buckets([public_holiday_calendar_event(holiday_doc)])
     
     return {"message": "Public holiday created", "holiday_id": holiday_doc["holiday_id"]}
 
@@ -881,61 +3273,312 @@ async def delete_public_holiday(holiday_id: str, user: User = Depends(get_hr_use
         await delete_calendar_event(holiday["calendar_event_id"])
     
     await db.public_holidays.delete_one({"holiday_id": holiday_id})
+    await bump_change_counter("public_holidays")
+    holiday_calendar_cache.invalidate(int(holiday["date"][:4]))
+    await remove_from_calendar_buckets(id=holiday_id)
     return {"message": "Public holiday deleted"}
 
 # ==================== CALENDAR ROUTES ====================
 
 @api_router.get("/calendar/events")
-async def get_calendar_events(year: int, month: int, user: User = Depends(get_current_user)):
-    """Get calendar events (approved holidays + public holidays)"""
-    # Get approved holidays
-    start_date = f"{year}-{month:02d}-01"
-    if month == 12:
-        end_date = f"{year+1}-01-01"
-    else:
-        end_date = f"{year}-{month+1:02d}-01"
-    
-    holidays = await db.holiday_requests.find({
-        "status": "approved",
-        "start_date": {"$gte": start_date, "$lt": end_date}
-    }, {"_id": 0}).to_list(1000)
-    
-    public_holidays = await db.public_holidays.find({
-        "date": {"$gte": start_date, "$lt": end_date}
-    }, {"_id": 0}).to_list(100)
-    
-    events = []
-    for h in holidays:
-        category = h.get("category", "paid_holiday")
-        category_name = next((c["name"] for c in HOLIDAY_CATEGORIES if c["id"] == category), category)
-        events.append({
-            "id": h["request_id"],
-            "title": f"{h['user_name']} - {category_name}",
-            "start": h["start_date"],
-            "end": h["end_date"],
-            "type": "holiday",
-            "category": category,
-            "user_name": h["user_name"]
-        })
+async def get_calendar_events(
+    request: Request,
+    response: Response,
+    year: int,
+    month: int,
+    user: User = Depends(get_current_user)
+):
+    """Get calendar events (approved holidays + public holidays) overlapping a month"""
+    if not 1 <= month <= 12:
+        raise HTTPException(status_code=400, detail="Month must be between 1 and 12")
+    not_modified = await conditional_get(request, response, ["calendar"])
+    if not_modified:
+        return not_modified
+    events = await get_calendar_bucket(f"{year}-{month:02d}")
+    # Buckets are appended to as writes come in, serve them in date order
+    return sorted(events, key=lambda e: (e["start"], e["id"]))
+
+@api_router.get("/calendar/range")
+async def get_calendar_range(
+    request: Request,
+    response: Response,
+    from_date: str = Query(..., alias="from"),
+    to_date: str = Query(..., alias="to"),
+    user: User = Depends(get_current_user)
+):
+    """Get every calendar event overlapping a range of up to a year in one compact payload.
+    
+    Events are returned as parallel column arrays; users and categories are listed once and
+    referenced by their index in those tables.
+    """
+    start, end = parse_date_range(from_date, to_date)
+    if (end - start).astype(int) >= CALENDAR_RANGE_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Range cannot exceed {CALENDAR_RANGE_MAX_DAYS} days")
+    not_modified = await conditional_get(request, response, ["calendar"])
+    if not_modified:
+        return not_modified
+    first, last = str(start), str(end)
+    
+    buckets = await get_calendar_buckets(months_between(first, last))
+    registry = await category_registry.get()
+    # A holiday spanning several months sits in each of their buckets
+    events = {}
+    for month_events in buckets.values():
+        for event in month_events:
+            if event["start"] <= last and event["end"] >= first:
+                events[event["id"]] = event
+    
+    users = {"user_id": [], "user_name": []}
+    user_index = {}
+    categories = {"id": [], "name": []}
+    category_index = {}
+    holidays = {"id": [], "user": [], "category": [], "start": [], "end": []}
+    public_holidays = {"id": [], "name": [], "date": []}
+    for event in sorted(events.values(), key=lambda e: (e["start"], e["id"])):
+        if event["type"] == "public_holiday":
+            public_holidays["id"].append(event["id"])
+            public_holidays["name"].append(event["title"])
+            public_holidays["date"].append(event["start"])
+            continue
+        if event["user_id"] not in user_index:
+            user_index[event["user_id"]] = len(users["user_id"])
+            users["user_id"].append(event["user_id"])
+            users["user_name"].append(event["user_name"])
+        if event["category"] not in category_index:
+            category_index[event["category"]] = len(categories["id"])
+            categories["id"].append(event["category"])
+            categories["name"].append(registry.name(event["category"]))
+        holidays["id"].append(event["id"])
+        holidays["user"].append(user_index[event["user_id"]])
+        holidays["category"].append(category_index[event["category"]])
+        holidays["start"].append(event["start"])
+        holidays["end"].append(event["end"])
     
-    for ph in public_holidays:
-        events.append({
-            "id": ph["holiday_id"],
-            "title": ph["name"],
-            "start": ph["date"],
-            "end": ph["date"],
-            "type": "public_holiday"
+    return {
+        "from": first,
+        "to": last,
+        "users": users,
+        "categories": categories,
+        "holidays": holidays,
+        "public_holidays": public_holidays
+    }
+
+# ==================== USER IMPORT ====================
+
+EMAIL_PATTERN = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+# Column names of a WordPress user export (or of our own users export) for each field we read
+USER_IMPORT_COLUMNS = {
+    "email": ["email", "user_email"],
+    "name": ["name", "display_name"],
+    "role": ["role", "roles"],
+    "active": ["active"]
+}
+
+def parse_user_import(body: bytes, import_format: str) -> List[dict]:
+    """Parse a CSV or JSON user export into rows keyed by lowercased column name"""
+    try:
+        text = body.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="The import must be UTF-8 encoded")
+    if import_format == "csv":
+        rows = list(csv.DictReader(io.StringIO(text)))
+    elif import_format == "json":
+        try:
+            rows = json.loads(text)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid JSON: {e}")
+        if isinstance(rows, dict):
+            rows = rows.get("users", [])
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise HTTPException(status_code=400, detail="JSON imports must be a list of user objects")
+    else:
+        raise HTTPException(status_code=400, detail="Format must be 'csv' or 'json'")
+    if len(rows) > USER_IMPORT_MAX_ROWS:
+        raise HTTPException(status_code=400, detail=f"At most {USER_IMPORT_MAX_ROWS} users per import")
+    return [{str(key).strip().lower(): value for key, value in row.items() if key is not None} for row in rows]
+
+def import_column(row: dict, field: str):
+    for column in USER_IMPORT_COLUMNS[field]:
+        value = row.get(column)
+        if value is not None and str(value).strip() != "":
+            return value
+    return None
+
+def normalize_import_row(row: dict) -> dict:
+    """email, name, role and active of one export row; role and active are None when the row does not set them"""
+    email = str(import_column(row, "email") or "").strip().lower()
+    if not EMAIL_PATTERN.match(email):
+        raise ValueError("Missing or invalid email")
+    
+    name = import_column(row, "name")
+    if name is None:
+        name = " ".join(str(row.get(column) or "").strip() for column in ("first_name", "last_name")).strip() or row.get("user_login")
+    name = str(name or email.split("@")[0]).strip()
+    
+    # WordPress roles (subscriber, editor, ...) mean nothing here, only ours are applied
+    role = None
+    roles = import_column(row, "role")
+    if roles is not None:
+        tokens = re.split(r"[,;|\s]+", str(roles).strip().lower())
+        role = "hr" if "hr" in tokens else "employee" if "employee" in tokens else None
+    
+    active = import_column(row, "active")
+    if active is not None and not isinstance(active, bool):
+        flag = str(active).strip().lower()
+        if flag not in ("true", "false", "1", "0", "yes", "no"):
+            raise ValueError(f"Invalid active value: {active}")
+        active = flag in ("true", "1", "yes")
+    return {"email": email, "name": name, "role": role, "active": active}
+
+async def import_users(rows: List[dict], deactivate_missing: bool = False, dry_run: bool = False,
+                       protected_user_id: Optional[str] = None) -> dict:
+    """Sync users with an export: create new emails, update changed ones and optionally deactivate the rest.
+    
+    New users get their default credits for the current year. All writes go out as unordered bulk_writes, so one
+    bad row only fails itself; every failure is reported against its row number. protected_user_id (the HR user
+    running the import) is never deactivated.
+    """
+    started = time.monotonic()
+    errors = []
+    unchanged = 0
+    
+    def fail(row_number: Optional[int], email: Optional[str], detail: str):
+        errors.append({"row": row_number, "email": email, "detail": detail})
+    
+    # One read of every user, matched by lowercased email since WordPress treats emails case-insensitively
+    existing = await db.users.find({}, {"_id": 0, "user_id": 1, "email": 1, "name": 1, "role": 1, "active": 1}).to_list(None)
+    by_email = {user["email"].lower(): user for user in existing if user.get("email")}
+    
+    seen = set()
+    changes = []  # One entry per user write: row number (None for deactivate_missing), email, user_id, kind, operation
+    for row_number, raw in enumerate(rows, start=1):
+        try:
+            row = normalize_import_row(raw)
+        except ValueError as e:
+            fail(row_number, raw.get("email") or raw.get("user_email"), str(e))
+            continue
+        email = row["email"]
+        if email in seen:
+            fail(row_number, email, "Duplicate email in the import")
+            continue
+        seen.add(email)
+        
+        user = by_email.get(email)
+        if user is None:
+            if row["active"] is False:
+                unchanged += 1
+                continue
+            new_user = {
+                "user_id": f"user_{uuid.uuid4().hex[:12]}",
+                "email": email,
+                "name": row["name"],
+                "picture": None,
+                "role": row["role"] or "employee",
+                "active": True,
+                "created_at": datetime.now(timezone.utc).isoformat()
+            }
+            changes.append({"row": row_number, "email": email, "user": new_user, "kind": "created", "operation": InsertOne(new_user)})
+            continue
+        
+        update = {}
+        if row["name"] != user.get("name"):
+            update["name"] = row["name"]
+        if row["role"] and row["role"] != user.get("role", "employee"):
+            update["role"] = row["role"]
+        active = True if row["active"] is None else row["active"]
+        if active != user.get("active", True) and not (active is False and user["user_id"] == protected_user_id):
+            update["active"] = active
+        if not update:
+            unchanged += 1
+            continue
+        changes.append({
+            "row": row_number, "email": email, "user": user,
+            "kind": "deactivated" if update.get("active") is False else "updated",
+            "operation": UpdateOne({"user_id": user["user_id"]}, {"$set": update})
         })
     
-    return events
+    if deactivate_missing:
+        for user in existing:
+            email = (user.get("email") or "").lower()
+            if email not in seen and user.get("active", True) and user["user_id"] != protected_user_id:
+                changes.append({
+                    "row": None, "email": email, "user": user, "kind": "deactivated",
+                    "operation": UpdateOne({"user_id": user["user_id"]}, {"$set": {"active": False}})
+                })
+    
+    if changes and not dry_run:
+        try:
+            await db.users.bulk_write([change["operation"] for change in changes], ordered=False)
+        except BulkWriteError as e:
+            failed = set()
+            for error in e.details.get("writeErrors", []):
+                change = changes[error["index"]]
+                failed.add(error["index"])
+                detail = "User with this email already exists" if error.get("code") == 11000 else error.get("errmsg", "Write failed")
+                fail(change["row"], change["email"], detail)
+            changes = [change for index, change in enumerate(changes) if index not in failed]
+    
+    # Default credits for every created user, one account document each
+    created = [change["user"] for change in changes if change["kind"] == "created"]
+    credits_provisioned = 0
+    if created and not dry_run:
+        categories = await category_registry.get()
+        year = datetime.now().year
+        credits_provisioned = len(created)
+        try:
+            await db.credit_accounts.bulk_write([
+                credit_account_upsert(user["user_id"], user["email"], user["name"], year, categories.default_credits)
+                for user in created
+            ], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                credits_provisioned -= 1
+                fail(None, created[error["index"]]["email"], f"User created but not their credits: {error.get('errmsg', 'write failed')}")
+    
+    if changes and not dry_run:
+        # Deactivated users are signed out; cached identities and the HR list are stale either way
+        deactivated_ids = [change["user"]["user_id"] for change in changes if change["kind"] == "deactivated"]
+        if deactivated_ids:
+            await db.user_sessions.delete_many({"user_id": {"$in": deactivated_ids}})
+        changed_ids = [change["user"]["user_id"] for change in changes if change["kind"] != "created"]
+        if changed_ids:
+            await invalidate_user_sessions(*changed_ids)
+        hr_recipients_cache.clear()
+    
+    elapsed = time.monotonic() - started
+    counts = {kind: sum(1 for change in changes if change["kind"] == kind) for kind in ("created", "updated", "deactivated")}
+    errors.sort(key=lambda error: (error["row"] is None, error["row"] or 0))
+    logger.info(
+        f"User import{' (dry run)' if dry_run else ''}: {len(rows)} rows, {counts['created']} created, "
+        f"{counts['updated']} updated, {counts['deactivated']} deactivated, {len(errors)} errors in {elapsed:.2f}s"
+    )
+    return {
+        "dry_run": dry_run,
+        "rows": len(rows),
+        **counts,
+        "unchanged": unchanged,
+        "credits_provisioned": credits_provisioned,
+        "errors": errors[:USER_IMPORT_ERROR_LIMIT],
+        "error_count": len(errors),
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(len(rows) / elapsed, 1) if elapsed else None
+    }
 
 # ==================== USERS ROUTES ====================
 
 @api_router.get("/users")
-async def get_all_users(user: User = Depends(get_hr_user)):
-    """Get all users (HR only)"""
-    users = await db.users.find({}, {"_id": 0}).sort("name", 1).to_list(1000)
-    return users
+async def get_all_users(
+    response: Response,
+    limit: int = Query(1000, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    user: User = Depends(get_hr_user)
+):
+    """Get all users by name, paginated with X-Next-Cursor (HR only)"""
+    projection, selected = select_fields(fields, User, USERS_SORT)
+    users = await find_page(db.users, {}, USERS_SORT, limit, cursor, response, projection)
+    return json_response(trim_fields(users, selected), response)
 
 @api_router.put("/users/{user_id}/role")
 async def update_user_role(user_id: str, role: str, current_user: User = Depends(get_hr_user)):
@@ -951,6 +3594,8 @@ async def update_user_role(user_id: str, role: str, current_user: User = Depends
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
     
+    await invalidate_user_sessions(user_id)
+    hr_recipients_cache.clear()
     return {"message": "Role updated successfully"}
 
 class UserCreate(BaseModel):
@@ -979,27 +3624,35 @@ async def create_user(user_data: UserCreate, current_user: User = Depends(get_hr
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.users.insert_one(new_user)
+    if user_data.role == "hr":
+        hr_recipients_cache.clear()
     
-    # Create default holiday credits for all categories
-    current_year = datetime.now().year
-    for cat_id, default_days in DEFAULT_CREDITS.items():
-        credit = {
-            "credit_id": f"cred_{uuid.uuid4().hex[:12]}",
-            "user_id": user_id,
-            "user_email": user_data.email,
-            "user_name": user_data.name,
-            "year": current_year,
-            "category": cat_id,
-            "total_days": default_days,
-            "used_days": 0.0,
-            "remaining_days": default_days,
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }
-        await db.holiday_credits.insert_one(credit)
+    # Create default holiday credits for all categories, one account document for the year
+    categories = await category_registry.get()
+    await db.credit_accounts.bulk_write(
+        [credit_account_upsert(user_id, user_data.email, user_data.name, datetime.now().year, categories.default_credits)]
+    )
     
     return {"message": "User created successfully", "user_id": user_id}
 
+@api_router.post("/users/import")
+async def import_users_route(
+    request: Request,
+    import_format: Optional[str] = Query(None, alias="format"),
+    deactivate_missing: bool = False,
+    dry_run: bool = False,
+    current_user: User = Depends(get_hr_user)
+):
+    """Create, update and deactivate users from a CSV or JSON WordPress user export (HR only).
+    
+    The format defaults from the Content-Type. With deactivate_missing=true users absent from the export are
+    deactivated; dry_run=true reports what would change without writing anything.
+    """
+    if import_format is None:
+        import_format = "csv" if "csv" in request.headers.get("content-type", "") else "json"
+    rows = parse_user_import(await request.body(), import_format)
+    return await import_users(rows, deactivate_missing=deactivate_missing, dry_run=dry_run, protected_user_id=current_user.user_id)
+
 @api_router.delete("/users/{user_id}")
 async def delete_user(user_id: str, current_user: User = Depends(get_hr_user)):
     """Delete a user (HR only)"""
@@ -1017,12 +3670,17 @@ async def delete_user(user_id: str, current_user: User = Depends(get_hr_user)):
     
     # Delete user's sessions
     await db.user_sessions.delete_many({"user_id": user_id})
+    await invalidate_user_sessions(user_id)
+    if user_to_delete.get("role") == "hr":
+        hr_recipients_cache.clear()
     
-    # Delete user's holiday credits
+    # Delete user's holiday credits, in both layouts
+    await db.credit_accounts.delete_many({"user_id": user_id})
     await db.holiday_credits.delete_many({"user_id": user_id})
     
     # Delete user's holiday requests
     await db.holiday_requests.delete_many({"user_id": user_id})
+    await remove_from_calendar_buckets(user_id=user_id)
     
     return {"message": "User deleted successfully"}
 
@@ -1031,12 +3689,15 @@ async def delete_user(user_id: str, current_user: User = Depends(get_hr_user)):
 @api_router.get("/settings")
 async def get_settings(user: User = Depends(get_hr_user)):
     """Get app settings (HR only)"""
-    settings = await db.settings.find_one({"settings_id": "app_settings"}, {"_id": 0})
+    snapshot = await settings_cache.get()
+    settings = deepcopy(dict(snapshot.data)) if snapshot.exists else None
     if not settings:
         settings = {
             "settings_id": "app_settings",
             "email_notifications_enabled": True,
             "calendar_sync_enabled": True,
+            "hr_digest_enabled": False,
+            "hr_digest_interval_minutes": 60,
             "google_connected": False
         }
     else:
@@ -1047,18 +3708,40 @@ async def get_settings(user: User = Depends(get_hr_user)):
 async def update_settings(
     email_notifications_enabled: bool = True,
     calendar_sync_enabled: bool = True,
+    hr_digest_enabled: Optional[bool] = None,
+    hr_digest_interval_minutes: Optional[int] = None,
     user: User = Depends(get_hr_user)
 ):
     """Update app settings (HR only)"""
-    await db.settings.update_one(
+    update_data = {
+        "email_notifications_enabled": email_notifications_enabled,
+        "calendar_sync_enabled": calendar_sync_enabled,
+        "updated_at": datetime.now(timezone.utc).isoformat()
+    }
+    # Digest options are only changed when sent, older clients do not know about them
+    if hr_digest_enabled is not None:
+        update_data["hr_digest_enabled"] = hr_digest_enabled
+    if hr_digest_interval_minutes is not None:
+        if hr_digest_interval_minutes < 5:
+            raise HTTPException(status_code=400, detail="Digest interval must be at least 5 minutes")
+        update_data["hr_digest_interval_minutes"] = hr_digest_interval_minutes
+    
+    previous = await db.settings.find_one_and_update(
         {"settings_id": "app_settings"},
-        {"$set": {
-            "email_notifications_enabled": email_notifications_enabled,
-            "calendar_sync_enabled": calendar_sync_enabled,
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }},
-        upsert=True
+        {
+            "$set": update_data,
+            "$inc": {"version": 1}
+        },
+        projection={"_id": 0, "hr_digest_enabled": 1},
+        upsert=True,
+        return_document=ReturnDocument.BEFORE
     )
+    if hr_digest_enabled and not (previous or {}).get("hr_digest_enabled", False):
+        # Requests made while digest mode was off were already notified one by one, start the digest from now
+        await db.job_state.update_one(
+            {"_id": "hr_digest"}, {"$set": {"last_sent_at": datetime.now(timezone.utc).isoformat()}}, upsert=True
+        )
+    settings_cache.invalidate()
     return {"message": "Settings updated successfully"}
 
 # ==================== GOOGLE OAUTH FOR GMAIL/CALENDAR ====================
@@ -1106,13 +3789,13 @@ async def google_oauth_callback(code: str, state: str):
     # Exchange code for tokens
     redirect_uri = f"{FRONTEND_URL}/api/oauth/google/callback"
     
-    token_resp = requests.post('https://oauth2.googleapis.com/token', data={
+    token_resp = (await http_request('POST', 'https://oauth2.googleapis.com/token', data={
         'code': code,
         'client_id': GOOGLE_CLIENT_ID,
         'client_secret': GOOGLE_CLIENT_SECRET,
         'redirect_uri': redirect_uri,
         'grant_type': 'authorization_code'
-    }).json()
+    })).json()
     
     if 'error' in token_resp:
         raise HTTPException(status_code=400, detail=token_resp.get('error_description', 'OAuth failed'))
@@ -1122,16 +3805,20 @@ async def google_oauth_callback(code: str, state: str):
     
     await db.settings.update_one(
         {"settings_id": "app_settings"},
-        {"$set": {
-            "google_tokens": {
-                "access_token": token_resp["access_token"],
-                "refresh_token": token_resp.get("refresh_token"),
-                "expires_at": expires_at.isoformat()
+        {
+            "$set": {
+                "google_tokens": {
+                    "access_token": token_resp["access_token"],
+                    "refresh_token": token_resp.get("refresh_token"),
+                    "expires_at": expires_at.isoformat()
+                },
+                "updated_at": datetime.now(timezone.utc).isoformat()
             },
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }},
+            "$inc": {"version": 1}
+        },
         upsert=True
     )
+    settings_cache.invalidate()
     
     # Redirect back to settings page
     return RedirectResponse(f"{FRONTEND_URL}/settings?google_connected=true")
@@ -1141,12 +3828,147 @@ async def google_oauth_disconnect(user: User = Depends(get_hr_user)):
     """Disconnect Google integration (HR only)"""
     await db.settings.update_one(
         {"settings_id": "app_settings"},
+        {
+            "$set": {
+                "google_tokens": None,
+                "updated_at": datetime.now(timezone.utc).isoformat()
+            },
+            "$inc": {"version": 1}
+        }
+    )
+    settings_cache.invalidate()
+    return {"message": "Google disconnected successfully"}
+
+# ==================== NOTIFICATION OUTBOX ROUTES ====================
+
+@api_router.get("/notifications/outbox")
+async def get_notification_outbox(status: Optional[str] = None, limit: int = 100, user: User = Depends(get_hr_user)):
+    """Get delivery status counts and the most recent outbox entries (HR only)"""
+    counts = {}
+    async for row in db.notification_outbox.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}]):
+        counts[row["_id"]] = row["count"]
+    
+    query = {"status": status} if status else {}
+    entries = await db.notification_outbox.find(query, {"_id": 0, "body": 0}).sort("created_at", -1).to_list(min(limit, 1000))
+    for entry in entries:
+        # Stored as a BSON date for the TTL index, served as an ISO string like the other timestamps
+        if isinstance(entry.get("sent_at"), datetime):
+            entry["sent_at"] = entry["sent_at"].replace(tzinfo=timezone.utc).isoformat()
+    return {"counts": counts, "entries": entries}
+
+@api_router.post("/notifications/outbox/{outbox_id}/retry")
+async def retry_notification(outbox_id: str, user: User = Depends(get_hr_user)):
+    """Requeue a dead-lettered notification (HR only)"""
+    result = await db.notification_outbox.update_one(
+        {"outbox_id": outbox_id, "status": "dead"},
         {"$set": {
-            "google_tokens": None,
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "status": "pending",
+            "attempts": 0,
+            "next_attempt_at": datetime.now(timezone.utc).isoformat()
         }}
     )
-    return {"message": "Google disconnected successfully"}
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Dead-lettered notification not found")
+    
+    outbox_wakeup.set()
+    return {"message": "Notification requeued"}
+
+# ==================== EXPORT ROUTES ====================
+
+# What each exportable collection is called in the URL, its model (the columns), its streaming order
+# and, for stored documents that hold several rows, how to flatten one into its rows
+EXPORTS = {
+    "requests": ("holiday_requests", HolidayRequest, [("start_date", ASCENDING), ("request_id", ASCENDING)], None),
+    "credits": ("credit_accounts", HolidayCredit, CREDIT_ACCOUNTS_SORT, credit_rows),
+    "users": ("users", User, USERS_SORT, None)
+}
+
+async def export_rows(collection: str, query: dict, columns: List[str], sort: list, export_format: str,
+                      expand: Optional[Callable] = None, tail: Optional[Callable] = None):
+    """Yield the export body one batch of rows at a time straight off the cursor, never holding more.
+    
+    tail, when given, is awaited once the cursor is exhausted for extra rows to write at the end.
+    """
+    projection = {"_id": 0} if expand else {"_id": 0, **{column: 1 for column in columns}}
+    cursor = db[collection].find(query, projection).sort(sort).batch_size(EXPORT_BATCH_SIZE)
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction="ignore")
+    lines = []
+    
+    def flush() -> bytes:
+        if export_format == "csv":
+            data = buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+        else:
+            data = b"".join(lines)
+            lines.clear()
+        return data
+    
+    if export_format == "csv":
+        writer.writeheader()
+    rows = 0
+    async def export_docs():
+        async for doc in cursor:
+            for row in expand(doc) if expand else [doc]:
+                yield row
+        if tail:
+            for row in await tail():
+                yield row
+    
+    async for row in export_docs():
+        if export_format == "csv":
+            writer.writerow(row)
+        else:
+            lines.append(orjson.dumps({column: row[column] for column in columns if column in row} if expand or tail else row) + b"\n")
+        rows += 1
+        if rows % EXPORT_BATCH_SIZE == 0:
+            yield flush()
+    data = flush()
+    if data:
+        yield data
+    logger.info(f"Exported {rows} rows from {collection} as {export_format}")
+
+@api_router.get("/export/{collection}")
+async def export_collection(
+    collection: str,
+    export_format: str = Query("ndjson", alias="format"),
+    year: Optional[int] = None,
+    status: Optional[str] = None,
+    user: User = Depends(get_hr_user)
+):
+    """Stream every request, credit or user as NDJSON or CSV, e.g. for payroll (HR only).
+    
+    year filters requests by start date and credits by credit year; status filters requests only.
+    """
+    if collection not in EXPORTS:
+        raise HTTPException(status_code=404, detail=f"Unknown export, choose one of: {', '.join(EXPORTS)}")
+    if export_format not in ["ndjson", "csv"]:
+        raise HTTPException(status_code=400, detail="Format must be 'ndjson' or 'csv'")
+    source, model, sort, expand = EXPORTS[collection]
+    
+    query = {}
+    if year is not None:
+        if collection == "requests":
+            query["start_date"] = {"$gte": f"{year}-01-01", "$lte": f"{year}-12-31"}
+        elif collection == "credits":
+            query["year"] = year
+        else:
+            raise HTTPException(status_code=400, detail=f"The year filter does not apply to {collection}")
+    if status is not None:
+        if collection != "requests":
+            raise HTTPException(status_code=400, detail=f"The status filter does not apply to {collection}")
+        query["status"] = status
+    
+    # Balances not folded yet, or kept as conflicts, are streamed after the accounts
+    tail = (lambda: legacy_credit_rows(query)) if collection == "credits" and legacy_credits_remain() else None
+    
+    filename = "-".join(str(part) for part in [collection, year, status] if part is not None) + f".{export_format}"
+    return StreamingResponse(
+        export_rows(source, query, list(model.model_fields), sort, export_format, expand, tail),
+        media_type="text/csv" if export_format == "csv" else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 # ==================== ROOT ====================
 
@@ -1158,17 +3980,106 @@ async def root():
 async def health():
     return {"status": "healthy"}
 
+@api_router.get("/jobs")
+async def get_job_state(user: User = Depends(get_hr_user)):
+    """Get the checkpoints of the batch jobs and migrations (HR only)"""
+    return await db.job_state.find({}).sort("_id", 1).to_list(None)
+
+@api_router.get("/indexes/report")
+async def get_index_report(refresh: bool = False, user: User = Depends(get_hr_user)):
+    """Get the index verification report from startup, or rerun it (HR only)"""
+    if refresh or not index_report:
+        return await ensure_indexes()
+    return index_report
+
+@api_router.get("/cache/stats")
+async def get_cache_stats(user: User = Depends(get_hr_user)):
+    """Get in-process cache counters (HR only)"""
+    return {
+        "sessions": session_cache.stats(),
+        "settings": settings_cache.stats(),
+        "hr_recipients": hr_recipients_cache.stats(),
+        "holiday_calendars": holiday_calendar_cache.stats(),
+        "categories": category_registry.stats()
+    }
+
 # Include the router in the main app
 app.include_router(api_router)
 
+# Brotli when the client accepts it, otherwise gzip at COMPRESSION_GZIP_LEVEL: the outer GZipMiddleware passes
+# responses Brotli already encoded through untouched (brotli-asgi's own gzip fallback ignores the level)
+if BrotliMiddleware is not None:
+    app.add_middleware(BrotliMiddleware, minimum_size=COMPRESSION_MIN_SIZE_BYTES, gzip_fallback=False)
+app.add_middleware(GZipMiddleware, minimum_size=COMPRESSION_MIN_SIZE_BYTES, compresslevel=COMPRESSION_GZIP_LEVEL)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
+@app.on_event("startup")
+async def startup_http_client():
+    global http_client
+    http_client = httpx.AsyncClient(
+        timeout=httpx.Timeout(HTTP_READ_TIMEOUT_SECONDS, connect=HTTP_CONNECT_TIMEOUT_SECONDS),
+        limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=20)
+    )
+
+@app.on_event("startup")
+async def startup_transaction_support():
+    global mongo_supports_transactions
+    mongo_supports_transactions = await detect_transaction_support()
+    logger.info(f"MongoDB multi-document transactions {'enabled' if mongo_supports_transactions else 'unavailable'}")
+
+@app.on_event("startup")
+async def startup_indexes():
+    if ENSURE_INDEXES_ON_STARTUP:
+        try:
+            await ensure_indexes()
+        except Exception as e:
+            logger.error(f"Index management failed: {e}")
+
+@app.on_event("startup")
+async def startup_category_registry():
+    await seed_categories()
+    categories = await category_registry.get()
+    logger.info(f"Category registry loaded: {len(categories.by_id)} categories, version {categories.version}")
+
+@app.on_event("startup")
+async def startup_credit_migration():
+    background_tasks.append(asyncio.create_task(migrate_credit_layout()))
+
+@app.on_event("startup")
+async def startup_outbox_workers():
+    try:
+        # Entries delivered before sent_at became a date, the TTL index would keep them forever
+        await db.notification_outbox.update_many(
+            {"sent_at": {"$type": "string"}}, [{"$set": {"sent_at": {"$toDate": "$sent_at"}}}]
+        )
+    except Exception as e:
+        logger.error(f"Could not convert old outbox sent_at values: {e}")
+    background_tasks.extend(asyncio.create_task(outbox_worker(i)) for i in range(OUTBOX_WORKERS))
+
+@app.on_event("startup")
+async def startup_hr_digest_scheduler():
+    background_tasks.append(asyncio.create_task(hr_digest_scheduler()))
+
+@app.on_event("startup")
+async def startup_job_scheduler():
+    if SCHEDULED_JOBS_ENABLED:
+        background_tasks.append(asyncio.create_task(job_scheduler()))
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    google_api_executor.shutdown(wait=False, cancel_futures=True)
     client.close()
+    if http_client is not None:
+        await http_client.aclose()
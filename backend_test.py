@@ -123,20 +123,28 @@ var categories = [
   {{id: 'maternity_leave', days: 90.0}}
 ];
 
-categories.forEach(function(cat) {{
-  db.holiday_credits.insertOne({{
-    credit_id: 'cred_test_' + cat.id + '_' + Date.now(),
-    user_id: userId,
-    user_email: email,
-    user_name: 'Test User HR',
-    year: currentYear,
-    category: cat.id,
-    total_days: cat.days,
-    used_days: 0.0,
-    remaining_days: cat.days,
-    created_at: new Date(),
-    updated_at: new Date()
-  }});
+// One credit account for the year, holding a balance per category
+db.credit_accounts.insertOne({{
+  account_id: 'acct_test_' + Date.now(),
+  user_id: userId,
+  user_email: email,
+  user_name: 'Test User HR',
+  year: currentYear,
+  balances: categories.map(function(cat) {{
+    return {{
+      credit_id: 'cred_test_' + cat.id + '_' + Date.now(),
+      category: cat.id,
+      total_days: cat.days,
+      used_days: 0.0,
+      remaining_days: cat.days,
+      reserved_days: 0.0,
+      available_days: cat.days,
+      created_at: new Date(),
+      updated_at: new Date()
+    }};
+  }}),
+  created_at: new Date(),
+  updated_at: new Date()
 }});
 
 print('SUCCESS: Test user created');
@@ -188,7 +196,19 @@ print('Session Token: ' + sessionToken);
         success, user_data = self.run_test("Get Current User", "GET", "auth/me", 200)
         if success and user_data:
             self.log(f"   User: {user_data.get('name', 'Unknown')} ({user_data.get('role', 'Unknown')})")
-            
+
+        # Repeat lookups should be served from the session cache
+        self.run_test("Get Current User (cached)", "GET", "auth/me", 200)
+        stats_success, stats = self.run_test("Get Cache Stats (HR)", "GET", "cache/stats", 200)
+        if stats_success and stats:
+            self.log(f"   Session cache hits: {stats['sessions']['hits']}, misses: {stats['sessions']['misses']}")
+
+        # Checkpoints of the yearly provisioning and expiry jobs
+        jobs_success, jobs = self.run_test("Get Job State (HR)", "GET", "jobs", 200)
+        if jobs_success and jobs:
+            for job in jobs:
+                self.log(f"   Job {job['_id']}: {job.get('status')}")
+
         return success
 
     def test_credits_endpoints(self):
@@ -219,6 +239,14 @@ print('Session Token: ' + sessionToken);
         if success:
             self.log(f"   Found {len(all_requests)} total requests")
             
+        # Test keyset pagination page size (HR only)
+        success, page = self.run_test("Get All Requests Page (HR)", "GET", "requests/all?limit=1", 200)
+        if success:
+            self.log(f"   Page holds {len(page)} request(s)")
+            
+        # Malformed cursors are rejected
+        self.run_test("Get All Requests Bad Cursor (HR)", "GET", "requests/all?cursor=not-a-cursor", 400)
+            
         # Test pending requests (HR only)
         success, pending = self.run_test("Get Pending Requests (HR)", "GET", "requests/pending", 200)
         if success:
@@ -234,6 +262,17 @@ print('Session Token: ' + sessionToken);
         success, response = self.run_test("Create Holiday Request", "POST", "requests", 201, request_data)
         if success:
             self.log(f"   Created request: {response.get('request_id', 'Unknown')}")
+            
+            # Cancelling releases the reserved days, a second cancel is refused
+            request_id = response.get('request_id')
+            self.run_test("Cancel Holiday Request", "PUT", f"requests/{request_id}/cancel", 200)
+            self.run_test("Cancel Holiday Request Twice", "PUT", f"requests/{request_id}/cancel", 400)
+            
+            # Bulk decisions report per request, a cancelled or unknown request is an item error not a failure
+            success, result = self.run_test("Bulk Reject Requests (HR)", "POST", "requests/bulk-decision", 200,
+                                            {"request_ids": [request_id, "req_unknown"], "decision": "reject"})
+            if success:
+                self.log(f"   Bulk decision processed {result.get('processed', 0)}, failed {result.get('failed', 0)}")
 
     def test_public_holidays_endpoints(self):
         """Test public holidays endpoints"""
@@ -253,6 +292,17 @@ print('Session Token: ' + sessionToken);
         success, response = self.run_test("Create Public Holiday (HR)", "POST", "public-holidays", 200, holiday_data)
         if success:
             self.log(f"   Created holiday: {response.get('holiday_id', 'Unknown')}")
+            
+        # Working days skip the weekend and the holiday just created
+        success, response = self.run_test("Count Working Days", "GET",
+                                          "working-days?start_date=2024-12-23&end_date=2024-12-29", 200)
+        if success:
+            self.log(f"   Working days 2024-12-23 to 2024-12-29: {response.get('days_count')}")
+            
+        success, absences = self.run_test("Get Absences", "GET",
+                                          "absences?start_date=2024-12-01&end_date=2024-12-31", 200)
+        if success:
+            self.log(f"   Found {len(absences)} approved absences in December 2024")
 
     def test_users_endpoints(self):
         """Test users endpoints"""
@@ -262,6 +312,26 @@ print('Session Token: ' + sessionToken);
         success, users = self.run_test("Get All Users (HR)", "GET", "users", 200)
         if success:
             self.log(f"   Found {len(users)} users")
+            
+        # Sparse fields return only what was asked for, unknown fields are refused
+        success, users = self.run_test("Get Users Sparse Fields (HR)", "GET", "users?fields=user_id,name", 200)
+        if success and users:
+            self.log(f"   Fields returned: {sorted(users[0].keys())}")
+        self.run_test("Get Users Unknown Field (HR)", "GET", "users?fields=password", 400)
+        
+        # Bulk import from a WordPress export, a dry run reports per-row errors and writes nothing
+        success, report = self.run_test(
+            "Import Users Dry Run (HR)", "POST", "users/import?dry_run=true", 200,
+            data=[{"user_email": "test.user.import@example.com", "display_name": "Test Import"}, {"user_email": "not-an-email"}]
+        )
+        if success and report:
+            self.log(f"   Would create {report.get('created')} user(s), {report.get('error_count')} row error(s)")
+        
+        # Streaming exports for payroll
+        current_year = datetime.now().year
+        self.run_test("Export Requests NDJSON (HR)", "GET", f"export/requests?year={current_year}", 200)
+        self.run_test("Export Credits CSV (HR)", "GET", f"export/credits?format=csv&year={current_year}", 200)
+        self.run_test("Export Unknown Collection (HR)", "GET", "export/sessions", 404)
 
     def test_settings_endpoints(self):
         """Test settings endpoints"""
@@ -273,6 +343,18 @@ print('Session Token: ' + sessionToken);
             self.log(f"   Email notifications: {settings.get('email_notifications_enabled', 'Unknown')}")
             self.log(f"   Calendar sync: {settings.get('calendar_sync_enabled', 'Unknown')}")
 
+    def test_notification_outbox_endpoints(self):
+        """Test notification outbox endpoints"""
+        self.log("\n📬 Testing Notification Outbox Endpoints...")
+        
+        # Test outbox status (HR only)
+        success, outbox = self.run_test("Get Notification Outbox (HR)", "GET", "notifications/outbox", 200)
+        if success:
+            self.log(f"   Outbox counts: {outbox.get('counts', {})}")
+            
+        # Retrying an unknown entry should 404
+        self.run_test("Retry Unknown Notification (HR)", "POST", "notifications/outbox/out_unknown/retry", 404)
+
     def test_calendar_endpoints(self):
         """Test calendar endpoints"""
         self.log("\n📅 Testing Calendar Endpoints...")
@@ -283,12 +365,23 @@ print('Session Token: ' + sessionToken);
         success, events = self.run_test("Get Calendar Events", "GET", f"calendar/events?year={current_year}&month={current_month}", 200)
         if success:
             self.log(f"   Found {len(events)} calendar events")
+            
+        # Whole year in one compact payload
+        success, calendar = self.run_test("Get Calendar Range", "GET", f"calendar/range?from={current_year}-01-01&to={current_year}-12-31", 200)
+        if success:
+            self.log(f"   Found {len(calendar.get('holidays', {}).get('id', []))} holidays for {len(calendar.get('users', {}).get('user_id', []))} users")
+        self.run_test("Get Calendar Range Too Wide", "GET", f"calendar/range?from={current_year}-01-01&to={current_year + 2}-01-01", 400)
 
     def test_category_specific_features(self):
         """Test category-specific functionality"""
         self.log("\n🏷️ Testing Category-Specific Features...")
         
         # Test categories endpoint
+        # Categories carry an ETag, revalidating with it costs a 304 and no body
+        etag = requests.get(f"{self.api_url}/categories", timeout=10).headers.get("ETag")
+        if etag:
+            self.run_test("Revalidate Holiday Categories", "GET", "categories", 304, headers={"If-None-Match": etag})
+        
         success, categories = self.run_test("Get Holiday Categories", "GET", "categories", 200)
         if success and categories:
             self.log(f"   Found {len(categories)} categories")
@@ -305,6 +398,10 @@ print('Session Token: ' + sessionToken);
                         "error": "Category not found in response"
                     })
         
+        # Category ids are lowercase slugs, and only existing categories can be edited
+        self.run_test("Create Category With Invalid Id", "POST", "categories", 400, data={"id": "Not A Slug", "name": "Invalid"})
+        self.run_test("Update Unknown Category", "PUT", "categories/no_such_category", 404, data={"name": "Missing"})
+        
         # Test credits by category
         success, credits = self.run_test("Get Credits by Category", "GET", "credits/my", 200)
         if success and credits:
@@ -329,8 +426,10 @@ print('Session Token: ' + sessionToken);
         """Test creating requests with different category values"""
         self.log("\n📝 Testing Requests with Different Categories...")
         
-        start_date = (datetime.now() + timedelta(days=7)).strftime('%Y-%m-%d')
-        end_date = (datetime.now() + timedelta(days=8)).strftime('%Y-%m-%d')
+        # Days are counted by the server, so start on a weekday to always charge at least one
+        start = datetime.now() + timedelta(days=7)
+        while start.weekday() >= 5:
+            start += timedelta(days=1)
         
         categories_to_test = [
             ('paid_holiday', 'Annual vacation'),
@@ -338,7 +437,10 @@ print('Session Token: ' + sessionToken);
             ('parental_leave', 'Child care needs')
         ]
         
-        for category, reason in categories_to_test:
+        for week, (category, reason) in enumerate(categories_to_test):
+            # A week apart, overlapping requests are refused
+            start_date = (start + timedelta(weeks=week)).strftime('%Y-%m-%d')
+            end_date = (start + timedelta(weeks=week, days=1)).strftime('%Y-%m-%d')
             request_data = {
                 "category": category,
                 "start_date": start_date,
@@ -417,7 +519,7 @@ print('Employee created: {emp_user_id}');
 use('test_database');
 var result1 = db.users.deleteMany({email: /test\.user\./});
 var result2 = db.user_sessions.deleteMany({session_token: /test_session/});
-var result3 = db.holiday_credits.deleteMany({credit_id: /cred_test/});
+var result3 = db.credit_accounts.deleteMany({user_email: /test\.user\./});
 var result4 = db.holiday_requests.deleteMany({user_email: /test\.user\./});
 var result5 = db.public_holidays.deleteMany({name: "Test Holiday"});
 
@@ -455,6 +557,7 @@ print('Deleted holidays: ' + result5.deletedCount);
         self.test_public_holidays_endpoints()
         self.test_users_endpoints()
         self.test_settings_endpoints()
+        self.test_notification_outbox_endpoints()
         self.test_calendar_endpoints()
         
         # Cleanup
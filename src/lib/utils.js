@@ -1,6 +1,20 @@
 import { clsx } from "clsx";
 import { twMerge } from "tailwind-merge"
+import axios from "axios";
 
 export function cn(...inputs) {
   return twMerge(clsx(inputs));
 }
+
+// Listing endpoints return one page at a time and set X-Next-Cursor while more rows follow.
+// Pages pass fields= with only the columns they render, the API drops the rest before it leaves the database.
+export async function fetchAllPages(url, config = {}) {
+  const rows = [];
+  let cursor;
+  do {
+    const response = await axios.get(url, { ...config, params: { ...config.params, cursor } });
+    rows.push(...response.data);
+    cursor = response.headers["x-next-cursor"];
+  } while (cursor);
+  return rows;
+}
@@ -50,6 +50,32 @@ const categoryColors = {
   compensatory_rest: "bg-teal-200 text-teal-800"
 };
 
+// /calendar/range sends column arrays with users and categories referenced by index
+const decodeCalendarRange = (data) => {
+  const { users, categories, holidays, public_holidays: ph } = data;
+  const publicHolidays = ph.id.map((id, i) => ({ holiday_id: id, name: ph.name[i], date: ph.date[i] }));
+  const events = holidays.id.map((id, i) => {
+    const userName = users.user_name[holidays.user[i]];
+    return {
+      id,
+      title: `${userName} - ${categories.name[holidays.category[i]]}`,
+      start: holidays.start[i],
+      end: holidays.end[i],
+      type: "holiday",
+      category: categories.id[holidays.category[i]],
+      user_name: userName
+    };
+  });
+  publicHolidays.forEach(h => events.push({
+    id: h.holiday_id,
+    title: h.name,
+    start: h.date,
+    end: h.date,
+    type: "public_holiday"
+  }));
+  return { events, publicHolidays };
+};
+
 const Calendar = () => {
   const { user } = useContext(AuthContext);
   const [currentDate, setCurrentDate] = useState(new Date());
@@ -58,24 +84,24 @@ const Calendar = () => {
   const [categories, setCategories] = useState([]);
   const [loading, setLoading] = useState(true);
 
+  // The whole year comes in one request, month navigation within it needs no fetch
+  const currentYear = currentDate.getFullYear();
+
   useEffect(() => {
     fetchEvents();
-  }, [currentDate]);
+  }, [currentYear]);
 
   const fetchEvents = async () => {
     setLoading(true);
     try {
-      const year = currentDate.getFullYear();
-      const month = currentDate.getMonth() + 1;
-      
-      const [eventsRes, holidaysRes, categoriesRes] = await Promise.all([
-        axios.get(`${API}/calendar/events?year=${year}&month=${month}`),
-        axios.get(`${API}/public-holidays?year=${year}`),
+      const [rangeRes, categoriesRes] = await Promise.all([
+        axios.get(`${API}/calendar/range`, { params: { from: `${currentYear}-01-01`, to: `${currentYear}-12-31` } }),
         axios.get(`${API}/categories`)
       ]);
       
-      setEvents(eventsRes.data);
-      setPublicHolidays(holidaysRes.data);
+      const decoded = decodeCalendarRange(rangeRes.data);
+      setEvents(decoded.events);
+      setPublicHolidays(decoded.publicHolidays);
       setCategories(categoriesRes.data);
     } catch (error) {
       console.error("Error fetching events:", error);
@@ -102,6 +128,14 @@ const Calendar = () => {
     });
   };
 
+  // Holidays of the displayed month that have not started yet
+  const upcomingHolidays = events.filter(e =>
+    e.type === "holiday" &&
+    e.start >= format(new Date(), "yyyy-MM-dd") &&
+    e.start <= format(monthEnd, "yyyy-MM-dd") &&
+    e.end >= format(monthStart, "yyyy-MM-dd")
+  );
+
   const isPublicHoliday = (date) => {
     const dateStr = format(date, "yyyy-MM-dd");
     return publicHolidays.find(h => h.date === dateStr);
@@ -267,12 +301,11 @@ const Calendar = () => {
             </CardTitle>
           </CardHeader>
           <CardContent>
-            {events.filter(e => e.type === "holiday" && e.start >= format(new Date(), "yyyy-MM-dd")).length === 0 ? (
+            {upcomingHolidays.length === 0 ? (
               <p className="text-sm text-slate-500">No upcoming holidays this month</p>
             ) : (
               <div className="space-y-3">
-                {events
-                  .filter(e => e.type === "holiday" && e.start >= format(new Date(), "yyyy-MM-dd"))
+                {upcomingHolidays
                   .slice(0, 5)
                   .map((event, idx) => (
                     <div key={idx} className="flex items-center justify-between p-3 bg-blue-50 rounded-lg">
@@ -2,6 +2,7 @@ import React, { useContext, useState, useEffect } from "react";
 import { useNavigate } from "react-router-dom";
 import { AuthContext, API } from "../App";
 import axios from "axios";
+import { fetchAllPages } from "../lib/utils";
 import { toast } from "sonner";
 import {
   CalendarDays,
@@ -31,6 +32,7 @@ import {
 import { Input } from "../components/ui/input";
 import { Label } from "../components/ui/label";
 import { Textarea } from "../components/ui/textarea";
+import { Checkbox } from "../components/ui/checkbox";
 import { Calendar as CalendarPicker } from "../components/ui/calendar";
 import { Popover, PopoverContent, PopoverTrigger } from "../components/ui/popover";
 import {
@@ -77,6 +79,9 @@ const Dashboard = () => {
   const [selectedCategory, setSelectedCategory] = useState("paid_holiday");
   const [startDate, setStartDate] = useState(null);
   const [endDate, setEndDate] = useState(null);
+  const [startHalfDay, setStartHalfDay] = useState(false);
+  const [endHalfDay, setEndHalfDay] = useState(false);
+  const [workingDays, setWorkingDays] = useState(null);
   const [reason, setReason] = useState("");
   const [submitting, setSubmitting] = useState(false);
 
@@ -84,15 +89,33 @@ const Dashboard = () => {
     fetchData();
   }, []);
 
+  // The server excludes weekends and public holidays, ask it for the days that will be charged
+  useEffect(() => {
+    setWorkingDays(null);
+    if (!startDate || !endDate) return;
+    let cancelled = false;
+    axios.get(`${API}/working-days`, {
+      params: {
+        start_date: format(startDate, "yyyy-MM-dd"),
+        end_date: format(endDate, "yyyy-MM-dd"),
+        start_half_day: startHalfDay,
+        end_half_day: endHalfDay
+      }
+    })
+      .then((res) => { if (!cancelled) setWorkingDays(res.data.days_count); })
+      .catch((error) => console.error("Error counting working days:", error));
+    return () => { cancelled = true; };
+  }, [startDate, endDate, startHalfDay, endHalfDay]);
+
   const fetchData = async () => {
     try {
-      const [creditsRes, requestsRes, categoriesRes] = await Promise.all([
+      const [creditsRes, requests, categoriesRes] = await Promise.all([
         axios.get(`${API}/credits/my`),
-        axios.get(`${API}/requests/my`),
+        fetchAllPages(`${API}/requests/my`),
         axios.get(`${API}/categories`),
       ]);
       setCredits(creditsRes.data);
-      setRequests(requestsRes.data);
+      setRequests(requests);
       setCategories(categoriesRes.data);
     } catch (error) {
       console.error("Error fetching data:", error);
@@ -109,15 +132,21 @@ const Dashboard = () => {
     return currentYearCredits.find(c => c.category === categoryId) || {
       total_days: 0,
       used_days: 0,
-      remaining_days: 0
+      remaining_days: 0,
+      reserved_days: 0,
+      available_days: 0
     };
   };
 
+  // Days not yet held by pending requests
+  const getAvailableDays = (credit) => credit.available_days ?? credit.remaining_days;
+
   const pendingRequests = requests.filter(r => r.status === "pending").length;
   const approvedRequests = requests.filter(r => r.status === "approved").length;
 
   const calculateDays = () => {
     if (!startDate || !endDate) return 0;
+    if (workingDays !== null) return workingDays;
     return differenceInBusinessDays(endDate, startDate) + 1;
   };
 
@@ -130,14 +159,14 @@ const Dashboard = () => {
 
     const daysCount = calculateDays();
     if (daysCount <= 0) {
-      toast.error("End date must be after start date");
+      toast.error("The selected dates contain no working days");
       return;
     }
 
     const selectedCredit = getCreditForCategory(selectedCategory);
-    if (daysCount > selectedCredit.remaining_days) {
+    if (daysCount > getAvailableDays(selectedCredit)) {
       const categoryName = categories.find(c => c.id === selectedCategory)?.name || selectedCategory;
-      toast.error(`Insufficient ${categoryName} credits. Available: ${selectedCredit.remaining_days} days`);
+      toast.error(`Insufficient ${categoryName} credits. Available: ${getAvailableDays(selectedCredit)} days`);
       return;
     }
 
@@ -147,13 +176,16 @@ const Dashboard = () => {
         category: selectedCategory,
         start_date: format(startDate, "yyyy-MM-dd"),
         end_date: format(endDate, "yyyy-MM-dd"),
-        days_count: daysCount,
+        start_half_day: startHalfDay,
+        end_half_day: endHalfDay,
         reason: reason.trim()
       });
       toast.success("Holiday request submitted successfully");
       setIsDialogOpen(false);
       setStartDate(null);
       setEndDate(null);
+      setStartHalfDay(false);
+      setEndHalfDay(false);
       setReason("");
       setSelectedCategory("paid_holiday");
       fetchData();
@@ -233,7 +265,7 @@ const Dashboard = () => {
                               <Icon size={16} />
                             <span>{cat.name}</span>
                             <span className="text-xs text-slate-500">
-                              ({credit.remaining_days} days left)
+                              ({getAvailableDays(credit)} days left)
                             </span>
                           </div>
                         </SelectItem>
@@ -294,9 +326,30 @@ const Dashboard = () => {
                 </div>
               </div>
 
+              <div className="flex gap-6">
+                <div className="flex items-center gap-2">
+                  <Checkbox
+                    id="start-half-day"
+                    checked={startHalfDay}
+                    onCheckedChange={(checked) => setStartHalfDay(checked === true)}
+                    data-testid="start-half-day-checkbox"
+                  />
+                  <Label htmlFor="start-half-day" className="text-sm font-normal">Afternoon only on first day</Label>
+                </div>
+                <div className="flex items-center gap-2">
+                  <Checkbox
+                    id="end-half-day"
+                    checked={endHalfDay}
+                    onCheckedChange={(checked) => setEndHalfDay(checked === true)}
+                    data-testid="end-half-day-checkbox"
+                  />
+                  <Label htmlFor="end-half-day" className="text-sm font-normal">Morning only on last day</Label>
+                </div>
+              </div>
+
               {startDate && endDate && (
                 <div className="p-3 bg-blue-50 rounded-lg text-sm text-blue-700">
-                  <strong>{calculateDays()}</strong> business day(s) requested
+                  <strong>{calculateDays()}</strong> working day(s) requested
                 </div>
               )}
 
@@ -344,7 +397,7 @@ const Dashboard = () => {
             const Icon = categoryIcons[cat.id] || Briefcase;
             const colorClass = categoryColors[cat.id] || "bg-slate-100 text-slate-700";
             const percentage = credit.total_days > 0 
-              ? (credit.remaining_days / credit.total_days) * 100 
+              ? (getAvailableDays(credit) / credit.total_days) * 100 
               : 0;
             
             return (
@@ -359,9 +412,12 @@ const Dashboard = () => {
                     </div>
                   </div>
                   <div className="flex items-baseline gap-1">
-                    <span className="text-2xl font-bold text-slate-900">{credit.remaining_days}</span>
+                    <span className="text-2xl font-bold text-slate-900">{getAvailableDays(credit)}</span>
                     <span className="text-sm text-slate-500">/ {credit.total_days}</span>
                   </div>
+                  {credit.reserved_days > 0 && (
+                    <p className="text-xs text-slate-500 mt-1">{credit.reserved_days} day(s) pending approval</p>
+                  )}
                   <div className="mt-2 h-1.5 bg-slate-200 rounded-full overflow-hidden">
                     <div
                       className={`h-full rounded-full transition-all duration-500 ${
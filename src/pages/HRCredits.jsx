@@ -1,6 +1,7 @@
 import React, { useContext, useState, useEffect } from "react";
 import { AuthContext, API } from "../App";
 import axios from "axios";
+import { fetchAllPages } from "../lib/utils";
 import { toast } from "sonner";
 import {
   CreditCard,
@@ -62,6 +63,9 @@ const categoryColors = {
   compensatory_rest: "bg-teal-100 text-teal-700 border-teal-200"
 };
 
+const CREDIT_FIELDS = "credit_id,user_id,user_name,user_email,year,category,category_name,total_days,used_days,remaining_days,expires_at";
+const USER_FIELDS = "user_id,name,email";
+
 const HRCredits = () => {
   const { user } = useContext(AuthContext);
   const [credits, setCredits] = useState([]);
@@ -103,13 +107,13 @@ const HRCredits = () => {
 
   const fetchData = async () => {
     try {
-      const [creditsRes, usersRes, categoriesRes] = await Promise.all([
-        axios.get(`${API}/credits/all`),
-        axios.get(`${API}/users`),
+      const [credits, users, categoriesRes] = await Promise.all([
+        fetchAllPages(`${API}/credits/all`, { params: { fields: CREDIT_FIELDS } }),
+        fetchAllPages(`${API}/users`, { params: { fields: USER_FIELDS } }),
         axios.get(`${API}/categories`)
       ]);
-      setCredits(creditsRes.data);
-      setUsers(usersRes.data);
+      setCredits(credits);
+      setUsers(users);
       setCategories(categoriesRes.data);
     } catch (error) {
       console.error("Error fetching data:", error);
@@ -1,6 +1,7 @@
 import React, { useContext, useState, useEffect } from "react";
 import { AuthContext, API } from "../App";
 import axios from "axios";
+import { fetchAllPages } from "../lib/utils";
 import { toast } from "sonner";
 import {
   Clock,
@@ -57,6 +58,8 @@ const categoryColors = {
   compensatory_rest: "bg-teal-100 text-teal-700"
 };
 
+const REQUEST_FIELDS = "request_id,user_id,user_name,user_email,category,start_date,end_date,days_count,reason,status,processed_at";
+
 const HRDashboard = () => {
   const { user } = useContext(AuthContext);
   const [requests, setRequests] = useState([]);
@@ -78,11 +81,11 @@ const HRDashboard = () => {
 
   const fetchData = async () => {
     try {
-      const [requestsRes, categoriesRes] = await Promise.all([
-        axios.get(`${API}/requests/all`),
+      const [requests, categoriesRes] = await Promise.all([
+        fetchAllPages(`${API}/requests/all`, { params: { fields: REQUEST_FIELDS } }),
         axios.get(`${API}/categories`)
       ]);
-      setRequests(requestsRes.data);
+      setRequests(requests);
       setCategories(categoriesRes.data);
     } catch (error) {
       console.error("Error fetching requests:", error);
@@ -2,6 +2,7 @@ import React, { useContext, useState, useEffect } from "react";
 import { useSearchParams } from "react-router-dom";
 import { AuthContext, API } from "../App";
 import axios from "axios";
+import { fetchAllPages } from "../lib/utils";
 import { toast } from "sonner";
 import {
   Settings,
@@ -46,6 +47,8 @@ import {
   AlertDialogTrigger,
 } from "../components/ui/alert-dialog";
 
+const USER_FIELDS = "user_id,name,email,role";
+
 const HRSettings = () => {
   const { user } = useContext(AuthContext);
   const [searchParams] = useSearchParams();
@@ -77,12 +80,12 @@ const HRSettings = () => {
 
   const fetchData = async () => {
     try {
-      const [settingsRes, usersRes] = await Promise.all([
+      const [settingsRes, users] = await Promise.all([
         axios.get(`${API}/settings`),
-        axios.get(`${API}/users`)
+        fetchAllPages(`${API}/users`, { params: { fields: USER_FIELDS } })
       ]);
       setSettings(settingsRes.data);
-      setUsers(usersRes.data);
+      setUsers(users);
     } catch (error) {
       console.error("Error fetching settings:", error);
       toast.error("Failed to load settings");
@@ -1,6 +1,7 @@
 import React, { useContext, useState, useEffect } from "react";
 import { AuthContext, API } from "../App";
 import axios from "axios";
+import { fetchAllPages } from "../lib/utils";
 import { toast } from "sonner";
 import {
   Clock,
@@ -59,11 +60,11 @@ const MyRequests = () => {
 
   const fetchData = async () => {
     try {
-      const [requestsRes, categoriesRes] = await Promise.all([
-        axios.get(`${API}/requests/my`),
+      const [requests, categoriesRes] = await Promise.all([
+        fetchAllPages(`${API}/requests/my`),
         axios.get(`${API}/categories`)
       ]);
-      setRequests(requestsRes.data);
+      setRequests(requests);
       setCategories(categoriesRes.data);
     } catch (error) {
       console.error("Error fetching requests:", error);
@@ -73,6 +74,16 @@ const MyRequests = () => {
     }
   };
 
+  const handleCancel = async (requestId) => {
+    try {
+      await axios.put(`${API}/requests/${requestId}/cancel`);
+      toast.success("Request cancelled");
+      fetchData();
+    } catch (error) {
+      toast.error(error.response?.data?.detail || "Failed to cancel request");
+    }
+  };
+
   const filteredRequests = requests.filter(req => {
     const matchesStatus = statusFilter === "all" || req.status === statusFilter;
     const matchesCategory = categoryFilter === "all" || req.category === categoryFilter;
@@ -85,6 +96,8 @@ const MyRequests = () => {
         return <CheckCircle className="w-5 h-5 text-emerald-500" />;
       case "rejected":
         return <XCircle className="w-5 h-5 text-red-500" />;
+      case "cancelled":
+        return <MinusCircle className="w-5 h-5 text-slate-400" />;
       default:
         return <Clock className="w-5 h-5 text-amber-500" />;
     }
@@ -164,6 +177,7 @@ const MyRequests = () => {
             <SelectItem value="pending">Pending</SelectItem>
             <SelectItem value="approved">Approved</SelectItem>
             <SelectItem value="rejected">Rejected</SelectItem>
+            <SelectItem value="cancelled">Cancelled</SelectItem>
           </SelectContent>
         </Select>
         <Select value={categoryFilter} onValueChange={setCategoryFilter}>
@@ -243,6 +257,17 @@ const MyRequests = () => {
                         <p className="mono">
                           {new Date(req.created_at).toLocaleDateString()}
                         </p>
+                        {req.status === "pending" && (
+                          <Button
+                            variant="outline"
+                            size="sm"
+                            className="mt-2"
+                            onClick={() => handleCancel(req.request_id)}
+                            data-testid={`cancel-request-${req.request_id}`}
+                          >
+                            Cancel
+                          </Button>
+                        )}
                       </div>
                     </div>
                   </div>